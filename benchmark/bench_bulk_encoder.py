@@ -0,0 +1,66 @@
+"""
+Benchmark the bulk body encoder against the previous json.dumps/str.join path on text heavy documents
+
+    $ python benchmark/bench_bulk_encoder.py [num_of_documents] [chars_per_document]
+"""
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src")))
+
+import bulkencoder
+from bulkencoder import BulkEncoder
+from esclient import TextfileDocument
+
+def legacy_encode(index : str, doc_type : str, pid_list : list, document_list : list) -> bytes:
+    data_list = [
+        "\n".join([
+            json.dumps({ "create" : {"_id" : pid, "_type" : doc_type, "_index" : index} }),
+            json.dumps(document)
+        ]) for pid, document in zip(pid_list, document_list)
+    ]
+    data = "\n".join(data_list) + "\n"
+    return data.encode("UTF-8")
+
+def measure(label : str, encode, payload_size : int = None, rounds : int = 5):
+    tracemalloc.start()
+    data = encode()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        data = encode()
+    elapsed = (time.perf_counter() - start) / rounds
+    size = len(data)
+    print(f"{label:<16} body={size / 2 ** 20:.1f}MB throughput={size / 2 ** 20 / elapsed:.1f}MB/s peak={peak / 2 ** 20:.1f}MB")
+
+if __name__ == "__main__":
+    num_of_documents = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    chars_per_document = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    random.seed(0)
+    words = ["amazon", "seattle", "elasticsearch", "lambda", "document", "invoice", "résumé", "quarterly", "report"]
+    tx = TextfileDocument()
+    pid_list = [f"bucket-file-{i}.pdf" for i in range(num_of_documents)]
+    document_list = [
+        tx.create_doc_entry(
+            title=f"file-{i}.pdf",
+            extension="pdf",
+            s3_tuple=("bucket", f"file-{i}.pdf", chars_per_document),
+            content=" ".join(random.choice(words) for _ in range(chars_per_document // 8))
+        ) for i in range(num_of_documents)
+    ]
+
+    measure("legacy", lambda: legacy_encode(tx.index, tx.doc_type, pid_list, document_list))
+    orjson = bulkencoder.orjson
+    bulkencoder.orjson = None
+    measure("encoder-json", lambda: BulkEncoder(tx.index, tx.doc_type, op_type="create").encode(zip(pid_list, document_list)))
+    bulkencoder.orjson = orjson
+    if orjson is not None:
+        measure("encoder-orjson", lambda: BulkEncoder(tx.index, tx.doc_type, op_type="create").encode(zip(pid_list, document_list)))
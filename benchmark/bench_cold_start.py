@@ -0,0 +1,30 @@
+"""
+Benchmark the cold start import time of the lambda modules, each measured in a fresh interpreter
+
+    $ python benchmark/bench_cold_start.py [rounds]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src"))
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+def import_time(module : str) -> float:
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "us-east-1"))
+    output = subprocess.check_output([sys.executable, "-c", SNIPPET.format(module=module)], cwd=SRC_DIR, env=env)
+    return float(output.decode("UTF-8").strip().splitlines()[-1]) * 1000
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for module in ["fileprocess", "lambda_es_indexing"]:
+        samples = [import_time(module) for _ in range(rounds)]
+        print(f"{module:<20} median={statistics.median(samples):.1f}ms min={min(samples):.1f}ms")
@@ -0,0 +1,47 @@
+"""
+Benchmark one-shot requests against the pooled keep-alive session using a local elasticsearch stand-in
+
+    $ python benchmark/bench_es_session.py [num_of_requests]
+"""
+import os
+import statistics
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir)))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src")))
+
+import requests
+
+from esclient import TextfileDocument, close_sessions
+from test.es_stub import ESStubServer
+
+def percentile(samples : list, pct : float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run(label : str, send, num_of_requests : int):
+    server = ESStubServer().start()
+    try:
+        samples = []
+        for _ in range(num_of_requests):
+            start = time.perf_counter()
+            send(server)
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{label:<10} connections={server.connection_count:<6} "
+              f"p50={statistics.median(samples):.3f}ms p99={percentile(samples, 99):.3f}ms")
+    finally:
+        server.stop()
+
+def send_oneshot(server):
+    requests.get(url=f"{server.host}:{server.port}/textfilesearch/textfile/_search", json={"query" : {"match_all" : {}}})
+
+def send_pooled(server):
+    TextfileDocument(host=server.host, port=server.port).search_document(body={"query" : {"match_all" : {}}})
+
+if __name__ == "__main__":
+    num_of_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run("one-shot", send_oneshot, num_of_requests)
+    run("pooled", send_pooled, num_of_requests)
+    close_sessions()
@@ -0,0 +1,69 @@
+"""
+Benchmark the single-pass event parser against decoder.deserialize_to_dict on SQS events of S3 notifications
+
+    $ python benchmark/bench_event_parser.py [rounds]
+"""
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src")))
+
+from decoder import deserialize_to_dict
+from eventparser import iter_s3_records
+
+def make_sqs_event(num_of_records : int) -> dict:
+    return {"Records" : [{
+        "messageId" : f"059f36b4-87a3-44ab-83d2-{i:012d}",
+        "receiptHandle" : "AQEBwJnKyrHigUMZj6rYigCgxlaS3SLy0a" * 4,
+        "eventSource" : "aws:sqs",
+        "eventSourceARN" : "arn:aws:sqs:us-east-1:123456789012:fileprocess-queue",
+        "attributes" : {"ApproximateReceiveCount" : "1", "SentTimestamp" : "1545082649183"},
+        "messageAttributes" : {},
+        "body" : json.dumps({"Records" : [{
+            "eventVersion" : "2.1",
+            "eventSource" : "aws:s3",
+            "awsRegion" : "us-east-1",
+            "eventTime" : "2019-01-01T00:00:00.000Z",
+            "eventName" : "ObjectCreated:Put",
+            "userIdentity" : {"principalId" : "EXAMPLE"},
+            "requestParameters" : {"sourceIPAddress" : "127.0.0.1"},
+            "responseElements" : {"x-amz-request-id" : "EXAMPLE123456789", "x-amz-id-2" : "EXAMPLE123/abcdefghijklmno"},
+            "s3" : {
+                "s3SchemaVersion" : "1.0",
+                "configurationId" : "s3putevent",
+                "bucket" : {"name" : "example-bucket", "ownerIdentity" : {"principalId" : "EXAMPLE"}, "arn" : "arn:aws:s3:::example-bucket"},
+                "object" : {"key" : f"documents/report-{i}.pdf", "size" : 1024, "eTag" : "0123456789abcdef0123456789abcdef", "sequencer" : f"{i:016X}"}
+            }
+        }]})
+    } for i in range(num_of_records)]}
+
+def legacy_parse(event : dict) -> list:
+    event = deserialize_to_dict(event)
+    return [(record["body"]["Records"][0]["s3"]["bucket"]["name"],
+             record["body"]["Records"][0]["s3"]["object"]["key"],
+             record["body"]["Records"][0]["s3"]["object"]["size"],
+             record["body"]["Records"][0]["s3"]["object"].get("eTag")) for record in event["Records"]]
+
+def parse(event : dict) -> list:
+    return [s3_record.s3_tuple for s3_record in iter_s3_records(event)]
+
+def measure(label : str, func, event : dict, rounds : int):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(event)
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<22} p50={statistics.median(samples):.3f}ms min={min(samples):.3f}ms")
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for num_of_records in [10, 10000]:
+        event = make_sqs_event(num_of_records)
+        assert legacy_parse(event) == parse(event)
+        print(f"{num_of_records} records")
+        measure("deserialize_to_dict", legacy_parse, event, rounds if num_of_records < 10000 else max(1, rounds // 10))
+        measure("eventparser", parse, event, rounds if num_of_records < 10000 else max(1, rounds // 10))
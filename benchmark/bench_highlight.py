@@ -0,0 +1,77 @@
+"""
+Benchmark highlight latency on large documents for each highlighter and the content mapping it needs
+
+Every highlighter gets its own index, so this needs a disposable elasticsearch cluster:
+
+    $ ES_HOST=http://localhost ES_PORT=9200 python benchmark/bench_highlight.py [num_of_docs] [doc_chars] [num_of_queries]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src")))
+
+from esclient import TextfileDocument, HIGHLIGHTER_FIELD_OPTIONS, close_sessions
+from config import ES_HOST, ES_PORT
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliett",
+         "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango"]
+
+def percentile(samples : list, pct : float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def make_text(rng : random.Random, num_of_chars : int) -> str:
+    words = []
+    size = 0
+    while size < num_of_chars:
+        word = rng.choice(WORDS) + str(rng.randrange(1000))
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+class BenchDocument(TextfileDocument):
+
+    def __init__(self, highlighter : str):
+        super().__init__(host=ES_HOST, port=ES_PORT, highlighter=highlighter)
+        self._index = f"bench-highlight-{highlighter}"
+
+def run(highlighter : str, documents : list, queries : list):
+    es = BenchDocument(highlighter)
+    es.delete_index()
+    es.ensure_index(force=True)
+    try:
+        summary = es.put_document_stream(documents)
+        assert summary.failed == 0, summary.errors
+        es._request("POST", f"/{es.index}/_refresh")
+
+        # warm up the caches once before timing
+        es.search_and_highlight_document(keywords=queries[0])
+        samples = []
+        for keywords in queries:
+            start = time.perf_counter()
+            res = es.search_and_highlight_document(keywords=keywords, num_of_highlights=1, highlight_fragment_size=50)
+            samples.append((time.perf_counter() - start) * 1000)
+            assert res.status_code == 200, res.text
+        took = [es.search_and_highlight_document(keywords=keywords).json()["took"] for keywords in queries[:20]]
+        print(f"{highlighter:<8} p50={statistics.median(samples):.1f}ms p99={percentile(samples, 99):.1f}ms "
+              f"es took p50={statistics.median(took):.0f}ms")
+    finally:
+        es.delete_index()
+
+if __name__ == "__main__":
+    num_of_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    doc_chars = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    num_of_queries = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    rng = random.Random(42)
+    documents = [(str(i), {"title" : f"doc{i}.txt", "content" : make_text(rng, doc_chars)}) for i in range(num_of_docs)]
+    queries = [[rng.choice(WORDS) + str(rng.randrange(1000))] for _ in range(num_of_queries)]
+
+    print(f"{num_of_docs} documents of {doc_chars} chars, {num_of_queries} queries")
+    for highlighter in HIGHLIGHTER_FIELD_OPTIONS:
+        run(highlighter, documents, queries)
+    close_sessions()
@@ -0,0 +1,45 @@
+"""
+Benchmark page-parallel pdf text extraction by number of worker processes
+
+    $ python benchmark/bench_pdf_extraction.py [copies_of_test_pdf]
+"""
+import io
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+TESTFILES_DIR = os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "test", "testfiles"))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src")))
+
+import PyPDF2
+
+from fileprocess import get_cpu_count, get_pdf_text_from_binary_data, get_file_texts_from_binary_data_list
+
+def make_large_pdf(copies : int) -> bytes:
+    reader = PyPDF2.PdfFileReader(open(os.path.join(TESTFILES_DIR, "fw4.pdf"), "rb"))
+    writer = PyPDF2.PdfFileWriter()
+    for _ in range(copies):
+        for i in range(reader.numPages):
+            writer.addPage(reader.getPage(i))
+    binary_data = io.BytesIO()
+    writer.write(binary_data)
+    return binary_data.getvalue()
+
+if __name__ == "__main__":
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    data = make_large_pdf(copies)
+    num_of_pages = PyPDF2.PdfFileReader(io.BytesIO(data)).numPages
+
+    start = time.perf_counter()
+    get_pdf_text_from_binary_data(io.BytesIO(data))
+    elapsed = time.perf_counter() - start
+    print(f"serial     pages={num_of_pages} pages/sec={num_of_pages / elapsed:.1f}")
+
+    cpu_count = get_cpu_count()
+    worker_counts = sorted(set([1, 2, 4, 8, cpu_count]))
+    for workers in worker_counts:
+        start = time.perf_counter()
+        get_file_texts_from_binary_data_list(["pdf"], [io.BytesIO(data)], max_workers=workers, min_parallel_pages=1)
+        elapsed = time.perf_counter() - start
+        print(f"workers={workers:<3} pages={num_of_pages} pages/sec={num_of_pages / elapsed:.1f} (vcpus={cpu_count})")
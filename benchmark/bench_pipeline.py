@@ -0,0 +1,38 @@
+"""
+Benchmark the staged ingest pipeline against running the stages in turn, using simulated stage latencies
+
+    $ python benchmark/bench_pipeline.py [num_of_files] [fetch_ms] [extract_ms] [enrich_ms] [bulk_ms]
+"""
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir, "src")))
+
+from concurrency import prefetch
+
+def stage(items, latency : float):
+    for item in items:
+        time.sleep(latency)
+        yield item
+
+def run(label : str, num_of_files : int, latencies : list, queue_size : int):
+    start = time.perf_counter()
+    items = range(num_of_files)
+    for latency in latencies[:-1]:
+        items = stage(items, latency)
+        if queue_size > 0:
+            items = prefetch(items, queue_size)
+    for item in stage(items, latencies[-1]):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed:.2f}s {num_of_files / elapsed:.1f} files/s")
+
+if __name__ == "__main__":
+    num_of_files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latencies = [float(arg) / 1000 for arg in sys.argv[2:6]] or [0.02, 0.04, 0.01, 0.005]
+    print(f"{num_of_files} files, stage latencies {[f'{latency * 1000:.0f}ms' for latency in latencies]}, "
+          f"sum {sum(latencies) * 1000:.0f}ms slowest {max(latencies) * 1000:.0f}ms")
+    run("in turn", num_of_files, latencies, queue_size=0)
+    run("staged", num_of_files, latencies, queue_size=8)
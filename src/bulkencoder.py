@@ -0,0 +1,104 @@
+"""
+A module that encodes elasticsearch bulk request bodies
+"""
+import gzip
+import io
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps_json(obj : object) -> bytes:
+    """ Serialize an object into compact UTF-8 json, using orjson when it is installed
+    
+    Arguments:
+        obj {object} -- json serializable object
+    
+    Returns:
+        bytes -- json bytes
+    """
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. non string dictionary keys, which the json module coerces
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode("UTF-8")
+
+def gzip_body(data : bytes, compresslevel : int = 1) -> bytes:
+    """ Compress a request body, sent with "Content-Encoding: gzip"
+    
+    Arguments:
+        data {bytes} -- request body
+    
+    Keyword Arguments:
+        compresslevel {int} -- gzip level, the lowest level keeps most of the ratio on text at a fraction of the cpu (default: {1})
+    
+    Returns:
+        bytes -- gzipped body
+    """
+
+    return gzip.compress(data, compresslevel=compresslevel)
+
+class BulkEncoder:
+    """ Encodes bulk actions for one index with a pre-encoded action header template """
+
+    def __init__(self, index : str, doc_type : str, op_type : str = "index", serializer=dumps_json):
+        self._op_type = op_type
+        self._serializer = serializer
+        self._header_prefix = b"".join([
+            b'{', serializer(op_type), b':{"_index":', serializer(index), b',"_type":', serializer(doc_type), b',"_id":'
+        ])
+        self._header_suffix = b'}}\n'
+
+    @property
+    def op_type(self) -> str:
+        return self._op_type
+
+    def encode_action(self, pid, document : dict = None) -> bytes:
+        """ Encode a single action line, followed by its source line unless the op is a delete
+        
+        Arguments:
+            pid {str} -- primary id
+        
+        Keyword Arguments:
+            document {dict} -- document source (default: {None})
+        
+        Returns:
+            bytes -- ndjson lines
+        """
+
+        buffer = io.BytesIO()
+        self._write(buffer, pid, document)
+        return buffer.getvalue()
+
+    def encode(self, actions) -> bytes:
+        """ Encode a whole bulk body into a single buffer
+        
+        Arguments:
+            actions {iterable} -- iterable of (pid, document), or of pid for delete ops
+        
+        Returns:
+            bytes -- ndjson bulk body
+        """
+
+        buffer = io.BytesIO()
+        if self._op_type == "delete":
+            for pid in actions:
+                self._write(buffer, pid, None)
+        else:
+            for pid, document in actions:
+                self._write(buffer, pid, document)
+        # getvalue shares the buffer instead of copying it when nothing is written afterwards
+        return buffer.getvalue()
+
+    def _write(self, buffer : io.BytesIO, pid, document : dict):
+        buffer.write(self._header_prefix)
+        buffer.write(self._serializer(pid))
+        buffer.write(self._header_suffix)
+        if self._op_type != "delete":
+            buffer.write(self._serializer(document))
+            buffer.write(b"\n")
@@ -0,0 +1,305 @@
+"""
+A module that provides caches that survive across warm lambda invocations, in process or in a local file
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+class TTLCache:
+    """ Thread-safe LRU cache whose entries expire after a time to live """
+
+    def __init__(self, maxsize : int = 128, ttl : float = 60.0, timer=time.monotonic):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] > self._timer()
+
+    def get(self, key, default=None):
+        """ Get a cached value and mark it as recently used
+        
+        Arguments:
+            key {hashable} -- cache key
+        
+        Keyword Arguments:
+            default {object} -- value returned on a miss (default: {None})
+        
+        Returns:
+            object -- cached value or default
+        """
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= self._timer():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        """ Cache a value, evicting the least recently used entry when full
+        
+        Arguments:
+            key {hashable} -- cache key
+            value {object} -- value to be cached
+        """
+
+        with self._lock:
+            self._data[key] = (self._timer() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def set_generation(self, generation) -> bool:
+        """ Drop every entry when the generation of the cached data source changed
+        
+        Arguments:
+            generation {hashable} -- token that changes whenever the source changes
+        
+        Returns:
+            bool -- the cache was invalidated
+        """
+
+        with self._lock:
+            changed = self._generation is not None and generation != self._generation
+            if changed:
+                self._data.clear()
+            self._generation = generation
+            return changed
+
+    def stats(self) -> dict:
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "evictions" : self.evictions,
+            "size" : len(self._data)
+        }
+
+class SqliteCache:
+    """ Thread-safe cache of JSON values in a sqlite file, e.g. in /tmp so that it outlives the process within a container """
+
+    def __init__(self, path : str, ttl : float = 3600.0, timer=time.time):
+        self._path = path
+        self._ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+        self._connection.execute("DELETE FROM cache WHERE expires <= ?", (self._timer(),))
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key : str, default=None):
+        """ Get a cached value
+        
+        Arguments:
+            key {str} -- cache key
+        
+        Keyword Arguments:
+            default {object} -- value returned on a miss or a storage error (default: {None})
+        
+        Returns:
+            object -- cached value or default
+        """
+
+        with self._lock:
+            try:
+                row = self._connection.execute("SELECT expires, value FROM cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                self.errors += 1
+                return default
+            if row is None or row[0] <= self._timer():
+                self.misses += 1
+                return default
+            self.hits += 1
+            return json.loads(row[1])
+
+    def set(self, key : str, value):
+        """ Cache a JSON serializable value, a storage error only counts as an error
+        
+        Arguments:
+            key {str} -- cache key
+            value {object} -- value to be cached
+        """
+
+        with self._lock:
+            try:
+                self._connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, self._timer() + self._ttl, json.dumps(value)))
+            except sqlite3.Error:
+                self.errors += 1
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def stats(self) -> dict:
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "errors" : self.errors
+        }
+
+class TieredCache:
+    """ An in-memory cache in front of an optional persistent cache, promoting persistent hits into memory """
+
+    def __init__(self, memory : TTLCache, persistent : SqliteCache = None):
+        self._memory = memory
+        self._persistent = persistent
+
+    def get(self, key, default=None):
+        value = self._memory.get(key, _missing)
+        if value is not _missing:
+            return value
+        if self._persistent is None:
+            return default
+        value = self._persistent.get(key, _missing)
+        if value is _missing:
+            return default
+        self._memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self._memory.set(key, value)
+        if self._persistent is not None:
+            self._persistent.set(key, value)
+
+    def clear(self):
+        self._memory.clear()
+        if self._persistent is not None:
+            self._persistent.clear()
+
+    def stats(self) -> dict:
+        return {
+            "memory" : self._memory.stats(),
+            "persistent" : self._persistent.stats() if self._persistent is not None else None
+        }
+
+class S3JSONStore:
+    """ Store of JSON values as compact sidecar objects under a prefix of an S3 bucket """
+
+    def __init__(self, client, bucket : str, prefix : str = ""):
+        self._client = client
+        self._bucket = bucket
+        self._prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key : str, default=None):
+        """ Get a stored value, a missing object is a miss and any other failure an error
+        
+        Arguments:
+            key {str} -- object name under the prefix
+        
+        Keyword Arguments:
+            default {object} -- value returned on a miss or an error (default: {None})
+        
+        Returns:
+            object -- stored value or default
+        """
+
+        try:
+            response = self._client.get_object(Bucket=self._bucket, Key=self._prefix + key)
+            value = json.loads(response["Body"].read())
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                self.misses += 1
+            else:
+                self.errors += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key : str, value):
+        try:
+            self._client.put_object(
+                Bucket=self._bucket,
+                Key=self._prefix + key,
+                Body=json.dumps(value, separators=(",", ":")).encode("utf-8"),
+                ContentType="application/json"
+            )
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "errors" : self.errors
+        }
+
+class DirectoryJSONStore:
+    """ Store of JSON values as files of a local directory, for tests and local runs """
+
+    def __init__(self, directory : str):
+        self._directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key : str, default=None):
+        try:
+            with open(os.path.join(self._directory, key), "rb") as f:
+                value = json.loads(f.read())
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (OSError, ValueError):
+            self.errors += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key : str, value):
+        path = os.path.join(self._directory, key)
+        try:
+            # write then rename so that a concurrent reader never sees a partial file
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(value, f, separators=(",", ":"))
+            os.replace(temp_path, path)
+        except OSError:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "errors" : self.errors
+        }
@@ -1,11 +1,202 @@
 """
 A module that interfaces with Amazon Comprehend Service
 """
+import functools
+import hashlib
+import logging
+import threading
 import boto3
+from botocore.config import Config
 
-comprehend = boto3.client("comprehend")
+from cache import TTLCache, SqliteCache, TieredCache
+from concurrency import ordered_map, RateLimiter
+from config import COMPREHEND_CONCURRENCY, COMPREHEND_MAX_TPS
+from config import COMPREHEND_CACHE_MAXSIZE, COMPREHEND_CACHE_TTL, COMPREHEND_CACHE_PATH
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+comprehend = boto3.client("comprehend", config=Config(max_pool_connections=max(10, COMPREHEND_CONCURRENCY)))
 default_language = "en"
 
+# the detect cache opens its sqlite file on first use, so importing this module has no side effect on disk
+detect_cache = None
+_detect_cache_lock = threading.Lock()
+
+def create_detect_cache(path : str = COMPREHEND_CACHE_PATH) -> TieredCache:
+    """ Create the cache of detect_* results, in memory only if the persistent file cannot be opened
+    
+    Keyword Arguments:
+        path {str} -- sqlite file of the persistent tier, disabled if empty (default: {COMPREHEND_CACHE_PATH})
+    
+    Returns:
+        TieredCache -- detect cache
+    """
+
+    persistent = None
+    if path:
+        try:
+            persistent = SqliteCache(path, ttl=COMPREHEND_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Unable to open comprehend cache {path}, caching in memory only")
+            logger.warning(e)
+    return TieredCache(TTLCache(maxsize=COMPREHEND_CACHE_MAXSIZE, ttl=COMPREHEND_CACHE_TTL), persistent)
+
+def get_detect_cache() -> TieredCache:
+    """ Get the cache of detect_* results, creating it on first use
+    
+    Returns:
+        TieredCache -- detect cache
+    """
+
+    global detect_cache
+    with _detect_cache_lock:
+        if detect_cache is None:
+            detect_cache = create_detect_cache()
+    return detect_cache
+
+def detect_cache_key(operation : str, text : str, language : str = default_language) -> str:
+    """ Hash an operation, language and text into a cache key
+    
+    Arguments:
+        operation {str} -- detect operation name
+        text {str} -- text to be detected
+    
+    Keyword Arguments:
+        language {str} -- language code (default: {default_language})
+    
+    Returns:
+        str -- hex digest
+    """
+
+    return hashlib.sha256(f"{operation}\0{language}\0{text}".encode("utf-8")).hexdigest()
+
+def cached_detect(operation : str):
+    """ Decorate a single text detect function so that repeated texts are answered from the detect cache """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(text : str):
+            key = detect_cache_key(operation, text)
+            cache = get_detect_cache()
+            result = cache.get(key)
+            if result is None:
+                result = func(text)
+                cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+# limits of the batch_detect_* apis
+BATCH_MAX_DOCUMENTS = 25
+BATCH_MAX_DOCUMENT_BYTES = 5000
+
+class ComprehendItemError(Exception):
+    """ A document of a batch that comprehend could not process """
+
+    def __init__(self, index : int, error_code : str, error_message : str):
+        super().__init__(f"{error_code}: {error_message}")
+        self.index = index
+        self.error_code = error_code
+        self.error_message = error_message
+
+def truncate_utf8(text : str, max_bytes : int = BATCH_MAX_DOCUMENT_BYTES) -> str:
+    """ Truncate a text to at most max_bytes of UTF-8 without splitting a character
+    
+    Arguments:
+        text {str} -- text to be truncated
+    
+    Keyword Arguments:
+        max_bytes {int} -- max UTF-8 bytes (default: {BATCH_MAX_DOCUMENT_BYTES})
+    
+    Returns:
+        str -- truncated text
+    """
+
+    # a character is at most 4 bytes, so shorter texts never need encoding
+    if len(text) * 4 <= max_bytes:
+        return text
+    return text[:max_bytes].encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+
+def parse_entities(result : dict) -> list:
+    return [{"type" : entity["Type"], "content" : entity["Text"]} for entity in result["Entities"]]
+
+def parse_keyphrases(result : dict) -> list:
+    return [keyphrase["Text"] for keyphrase in result["KeyPhrases"]]
+
+def parse_sentiment(result : dict) -> str:
+    return result["Sentiment"]
+
+# name -> (batch api, result parser, result of a blank text)
+BATCH_OPERATIONS = {
+    "entities" : ("batch_detect_entities", parse_entities, []),
+    "keyphrases" : ("batch_detect_key_phrases", parse_keyphrases, []),
+    "sentiment" : ("batch_detect_sentiment", parse_sentiment, None)
+}
+
+def batch_detect(operations : list, text_list : list, max_workers : int = COMPREHEND_CONCURRENCY, max_tps : float = COMPREHEND_MAX_TPS, batch_size : int = BATCH_MAX_DOCUMENTS, max_bytes : int = BATCH_MAX_DOCUMENT_BYTES) -> dict:
+    """ Run comprehend batch operations on any number of texts
+    
+    Texts are truncated to max_bytes of UTF-8 and sent batch_size at a time, so an operation
+    costs one call per batch_size texts. The calls of every operation and batch share one thread
+    pool and rate limiter. Results are mapped back to their text by the batch index, and blank
+    texts are answered locally because comprehend rejects them.
+    
+    Arguments:
+        operations {list} -- names in BATCH_OPERATIONS, e.g. ["entities", "keyphrases", "sentiment"]
+        text_list {list} -- list of text to be detected
+    
+    Keyword Arguments:
+        max_workers {int} -- max number of concurrent comprehend calls (default: {COMPREHEND_CONCURRENCY})
+        max_tps {float} -- max comprehend calls per second, unlimited if 0 (default: {COMPREHEND_MAX_TPS})
+        batch_size {int} -- max texts per call (default: {BATCH_MAX_DOCUMENTS})
+        max_bytes {int} -- max UTF-8 bytes per text (default: {BATCH_MAX_DOCUMENT_BYTES})
+    
+    Returns:
+        dict -- operation name -> list with the result of every text, or the exception of a failed text
+    """
+
+    limiter = RateLimiter(max_tps)
+    results = {name : [BATCH_OPERATIONS[name][2]] * len(text_list) for name in operations}
+    indices = [index for index, text in enumerate(text_list) if text and not text.isspace()]
+    batches = [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+
+    def detect(task : tuple):
+        name, batch = task
+        limiter.acquire()
+        try:
+            return getattr(comprehend, BATCH_OPERATIONS[name][0])(
+                TextList=[truncate_utf8(text_list[index], max_bytes) for index in batch],
+                LanguageCode=default_language
+            )
+        except Exception as e:
+            logger.error(f"Unable to detect {name} in a batch of {len(batch)} texts")
+            logger.error(e)
+            return e
+
+    tasks = [(name, batch) for name in operations for batch in batches]
+    for (name, batch), response in zip(tasks, ordered_map(detect, tasks, max_workers=max_workers)):
+        if isinstance(response, Exception):
+            for index in batch:
+                results[name][index] = response
+            continue
+        parse = BATCH_OPERATIONS[name][1]
+        for result in response["ResultList"]:
+            results[name][batch[result["Index"]]] = parse(result)
+        for error in response["ErrorList"]:
+            results[name][batch[error["Index"]]] = ComprehendItemError(batch[error["Index"]], error["ErrorCode"], error["ErrorMessage"])
+    return results
+
+def _batch_results(name : str, text_list : list, return_exceptions : bool) -> list:
+    results = batch_detect([name], text_list)[name]
+    if not return_exceptions:
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+    return results
+
+@cached_detect("entities")
 def detect_entities(text : str) -> list:
     """ Detect entities in a text
     
@@ -31,12 +222,15 @@ def detect_entities(text : str) -> list:
     )
     return list(map(lambda x : {"type" : x["Type"], "content" : x["Text"]}, response["Entities"]))
 
-def detect_entities_batch(text_list : list) -> list:
+def detect_entities_batch(text_list : list, return_exceptions : bool = False) -> list:
     """ Detect entities for texts using batching
     
     Arguments:
         text_list {list} -- list of text to be detected
     
+    Keyword Arguments:
+        return_exceptions {bool} -- put the exception of a failed text in its place instead of raising it (default: {False})
+    
     Returns:
         list -- list of list of entities in the format of
         [
@@ -55,12 +249,9 @@ def detect_entities_batch(text_list : list) -> list:
             ...
         ]
     """
-    response = comprehend.batch_detect_entities(
-        TextList=text_list,
-        LanguageCode=default_language
-    )
-    return list(map(lambda x: list(map(lambda y : {"type" : y["Type"], "content" : y["Text"]}, x["Entities"])), response["ResultList"]))
+    return _batch_results("entities", text_list, return_exceptions)
 
+@cached_detect("keyphrases")
 def detect_keyphrases(text : str) -> list:
     """ Detect key phrases in a text
     
@@ -81,12 +272,15 @@ def detect_keyphrases(text : str) -> list:
     )
     return list(map(lambda x : x["Text"], response["KeyPhrases"]))
 
-def detect_keyphrases_batch(text_list : list) -> list:
+def detect_keyphrases_batch(text_list : list, return_exceptions : bool = False) -> list:
     """ Detect key phrases in texts using batch
     
     Arguments:
         text_list {list} -- list of text to be detected
     
+    Keyword Arguments:
+        return_exceptions {bool} -- put the exception of a failed text in its place instead of raising it (default: {False})
+    
     Returns:
         list -- list of list of key phrases in the format of
         [
@@ -101,12 +295,9 @@ def detect_keyphrases_batch(text_list : list) -> list:
             ...
         ]
     """
-    response = comprehend.batch_detect_key_phrases(
-        TextList=text_list,
-        LanguageCode=default_language
-    )
-    return list(map(lambda x: list(map(lambda y: y["Text"], x["KeyPhrases"])), response["ResultList"]))
+    return _batch_results("keyphrases", text_list, return_exceptions)
 
+@cached_detect("sentiment")
 def detect_sentiment(text : str) -> str:
     """ Detect sentiment in text
     
@@ -123,11 +314,14 @@ def detect_sentiment(text : str) -> str:
     )
     return response["Sentiment"]
 
-def detect_sentiment_batch(text_list : list) -> list:
-    """[summary]
+def detect_sentiment_batch(text_list : list, return_exceptions : bool = False) -> list:
+    """ Detect sentiment in texts using batch
     
     Arguments:
-        text_list {list} -- [description]
+        text_list {list} -- list of text to be detected
+    
+    Keyword Arguments:
+        return_exceptions {bool} -- put the exception of a failed text in its place instead of raising it (default: {False})
     
     Returns:
         list -- list of sentiment in the form
@@ -139,8 +333,31 @@ def detect_sentiment_batch(text_list : list) -> list:
             ...
         ]
     """
-    response = comprehend.batch_detect_sentiment(
-        TextList=text_list,
-        LanguageCode=default_language
-    )
-    return [result["Sentiment"] for result in response["ResultList"]]
+    return _batch_results("sentiment", text_list, return_exceptions)
+
+def enrich_texts(text_list : list, operations : list = ("entities", "keyphrases", "sentiment")) -> list:
+    """ Detect entities, key phrases and sentiment of texts, dropping the fields that failed
+    
+    Arguments:
+        text_list {list} -- list of text to be enriched
+    
+    Keyword Arguments:
+        operations {list} -- names in BATCH_OPERATIONS (default: {("entities", "keyphrases", "sentiment")})
+    
+    Returns:
+        list -- list of dictionaries in the form
+        [
+            {
+                "entities" : [{"type" : "...", "content" : "..."}, ...],
+                "keyphrases" : ["phrase 1", ...],
+                "sentiment" : "POSITIVE"
+            },
+            ...
+        ]
+    """
+
+    results = batch_detect(list(operations), text_list)
+    return [
+        {name : results[name][index] for name in operations if not isinstance(results[name][index], Exception)}
+        for index in range(len(text_list))
+    ]
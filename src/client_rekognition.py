@@ -1,9 +1,54 @@
 """
 A module that interfaces with Amazon Rekognition Service
 """
+import hashlib
+import json
+import logging
 import boto3
+from botocore.config import Config
 
-rekognition = boto3.client("rekognition")
+from cache import S3JSONStore, DirectoryJSONStore
+from concurrency import ordered_map, RateLimiter
+from config import REKOGNITION_CONCURRENCY, REKOGNITION_MAX_TPS
+from config import REKOGNITION_CACHE_BUCKET, REKOGNITION_CACHE_PREFIX, REKOGNITION_CACHE_DIR
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+rekognition = boto3.client("rekognition", config=Config(max_pool_connections=max(10, REKOGNITION_CONCURRENCY)))
+
+def create_analysis_store():
+    """ Create the store of image analyses from the configuration
+    
+    Returns:
+        S3JSONStore -- sidecar store in REKOGNITION_CACHE_BUCKET, a DirectoryJSONStore in REKOGNITION_CACHE_DIR, or None if disabled
+    """
+
+    if REKOGNITION_CACHE_BUCKET:
+        client = boto3.client("s3", config=Config(max_pool_connections=max(10, REKOGNITION_CONCURRENCY)))
+        return S3JSONStore(client, REKOGNITION_CACHE_BUCKET, prefix=REKOGNITION_CACHE_PREFIX)
+    if REKOGNITION_CACHE_DIR:
+        return DirectoryJSONStore(REKOGNITION_CACHE_DIR)
+    return None
+
+analysis_store = create_analysis_store()
+
+def analysis_key(s3_tuple : tuple, params : dict) -> str:
+    """ Get the store key of an image analysis from the object identity and the call parameters
+    
+    Arguments:
+        s3_tuple {tuple} -- tuple in the form (s3 bucket, s3 object key, file size, etag)
+        params {dict} -- parameters of the rekognition calls
+    
+    Returns:
+        str -- key, or None if the object has no etag and so no stable identity
+    """
+
+    if len(s3_tuple) < 4 or not s3_tuple[3]:
+        return None
+    identity = json.dumps([s3_tuple[0], s3_tuple[1], s3_tuple[3].strip('"'), params], sort_keys=True)
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest() + ".json"
 
 def detect_labels(s3_tuple : tuple, max_labels : int = 20, min_confidence : float = 0.9) -> list:
     """ Detect image labels given an image file from s3
@@ -97,3 +142,74 @@ def recognize_celebrities(s3_tuple : tuple, min_confidence : float = 0.9) -> lis
     )
     celebrities = [celebrity["Name"] for celebrity in response["CelebrityFaces"] if celebrity["MatchConfidence"] >= min_confidence]
     return celebrities
+
+
+def iter_image_analyses(s3_tuple_list : list, max_workers : int = REKOGNITION_CONCURRENCY, max_tps : float = REKOGNITION_MAX_TPS, max_labels : int = 20, min_confidence : float = 0.9, store=None):
+    """ Detect labels, text and celebrities of every image concurrently
+    
+    All three analyses of all images are spread over one thread pool and paced by a shared rate
+    limiter. A failing analysis yields an empty list and is recorded in "errors" rather than
+    failing the whole batch. Images whose analysis is in the store, keyed by bucket, key, etag and
+    parameters, are not sent to rekognition again, and complete new analyses are stored.
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples in the form (s3 bucket, s3 object key, file size[, etag])
+    
+    Keyword Arguments:
+        max_workers {int} -- max number of concurrent rekognition calls (default: {REKOGNITION_CONCURRENCY})
+        max_tps {float} -- max calls per second of each rekognition api, unlimited if 0 (default: {REKOGNITION_MAX_TPS})
+        max_labels {int} -- maximum number of labels (default: {20})
+        min_confidence {float} -- minimum confidence (default: {0.9})
+        store {object} -- analysis store with get and set, analysis_store if None (default: {None})
+    
+    Yields:
+        tuple -- (s3_tuple, analysis) in the order of the list, with analysis in the form
+        {
+            "labels" : [...],
+            "texts" : [...],
+            "celebrities" : [...],
+            "errors" : {"labels" : "error message", ...}
+        }
+    """
+
+    store = store if store is not None else analysis_store
+    params = {"max_labels" : max_labels, "min_confidence" : min_confidence}
+    analyses = [
+        ("labels", lambda s3_tuple: detect_labels(s3_tuple, max_labels=max_labels, min_confidence=min_confidence)),
+        ("texts", lambda s3_tuple: detect_text(s3_tuple, min_confidence=min_confidence)),
+        ("celebrities", lambda s3_tuple: recognize_celebrities(s3_tuple, min_confidence=min_confidence))
+    ]
+    # rekognition quotas apply per api, so each operation is spaced on its own
+    limiters = {name : RateLimiter(max_tps) for name, func in analyses}
+
+    keys = [None] * len(s3_tuple_list)
+    stored = [None] * len(s3_tuple_list)
+    if store is not None:
+        keys = [analysis_key(s3_tuple, params) for s3_tuple in s3_tuple_list]
+        stored = list(ordered_map(lambda key: store.get(key) if key is not None else None, keys, max_workers=max_workers))
+        print(f"Reusing {sum(analysis is not None for analysis in stored)} of {len(s3_tuple_list)} stored image analyses")
+
+    def analyze(task : tuple) -> tuple:
+        s3_tuple, name, func = task
+        limiters[name].acquire()
+        try:
+            return func(s3_tuple), None
+        except Exception as e:
+            logger.error(f"Unable to detect {name} in bucket {s3_tuple[0]} key {s3_tuple[1]}")
+            logger.error(e)
+            return [], str(e)
+
+    tasks = ((s3_tuple, name, func) for s3_tuple, analysis in zip(s3_tuple_list, stored) if analysis is None for name, func in analyses)
+    results = ordered_map(analyze, tasks, max_workers=max_workers)
+    for s3_tuple, key, analysis in zip(s3_tuple_list, keys, stored):
+        if analysis is not None:
+            yield s3_tuple, dict(analysis, errors={})
+            continue
+        analysis = {"errors" : {}}
+        for name, func in analyses:
+            analysis[name], error = next(results)
+            if error is not None:
+                analysis["errors"][name] = error
+        if key is not None and not analysis["errors"]:
+            store.set(key, {name : analysis[name] for name, func in analyses})
+        yield s3_tuple, analysis
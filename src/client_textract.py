@@ -1,46 +1,179 @@
-# TODO: replace fileprocess module with Amazon Textract once the service become available
-# Getting really excited about the new features in Reinvent 2018!!!
-# https://docs.aws.amazon.com/textract/latest/dg/detecting-document-text.html
+"""
+A module that interfaces with Amazon Textract asynchronous text detection
 
-# import boto3
-# import io
+A job is started per document with StartDocumentTextDetection. Textract publishes the completion to an
+SNS topic, and the subscribed lambda collects the pages with GetDocumentTextDetection, so that the text
+of large or scanned documents is detected off the lambda's CPU and outside of one invocation.
+https://docs.aws.amazon.com/textract/latest/dg/api-async.html
+"""
+import hashlib
+import json
+import threading
 
-# textract = boto3.client('textract')
-# s3 = boto3.client('s3')
+from config import TEXTRACT_SNS_TOPIC_ARN, TEXTRACT_ROLE_ARN
 
-# def get_file_stream_in_s3(bucket : str, key : str) -> io.BytesIO:
-#     """Extract binary data from file in an S3 bucket
-    
-#     Arguments:
-#         bucket {str} -- S3 Bucket Name
-#         key {str} -- File Key
-    
-#     Returns:
-#         io.BytesIO -- file stream
-#     """
+textract = None
+_textract_lock = threading.Lock()
 
-#     try:
-#         response = s3.get_object(Bucket=bucket, Key=key)
-#         s3_file_content = response['Body'].read()
-#         return io.BytesIO(s3_file_content)
-#     except Exception as e:
-#         print(f"Unable to read from bucket and {bucket} key {key}")
-#         print(e)
-#         raise e
+SUCCEEDED_STATUSES = set(["SUCCEEDED", "PARTIAL_SUCCESS"])
 
-# def test(bucket : str, document : str):
-#     response = textract.detect_document_text(
-#         Document={'S3Object' : {'Bucket' : bucket, 'Name' : document}}
-#     )
+class TextractJobError(Exception):
+    """ A text detection job that did not succeed """
 
-#     print('response')
-#     print(response)
-#     print()
+    def __init__(self, job_id : str, status : str, message : str = ""):
+        super().__init__(f"Textract job {job_id} {status} {message}".strip())
+        self.job_id = job_id
+        self.status = status
 
-#     blocks = response["Blocks"]
+def get_textract_client():
+    """ Get the Textract client, creating it on first use
 
+    Returns:
+        botocore.client.Textract -- Textract client
+    """
+    global textract
+    with _textract_lock:
+        if textract is None:
+            import boto3
+            textract = boto3.client("textract")
+    return textract
 
-# if __name__ == "__main__":
-#     pass
+def encode_job_tag(s3_tuple : tuple) -> str:
+    """ Encode the object size and etag, which the completion message lacks, into a job tag
 
+    Arguments:
+        s3_tuple {tuple} -- tuple in the form (s3 bucket, s3 object key, file size[, etag])
 
+    Returns:
+        str -- job tag in the form "size:etag"
+    """
+
+    etag = s3_tuple[3].strip('"') if len(s3_tuple) > 3 and s3_tuple[3] else ""
+    return f"{s3_tuple[2]}:{etag}"
+
+def decode_job_tag(job_tag : str) -> tuple:
+    """ Decode a job tag created by encode_job_tag
+
+    Arguments:
+        job_tag {str} -- job tag
+
+    Returns:
+        tuple -- (file size, etag or None)
+    """
+
+    size, _, etag = (job_tag or "0:").partition(":")
+    return int(size), etag or None
+
+def start_text_detection(s3_tuple : tuple, sns_topic_arn : str = TEXTRACT_SNS_TOPIC_ARN, role_arn : str = TEXTRACT_ROLE_ARN) -> str:
+    """ Start an asynchronous text detection job whose completion is published to an SNS topic
+
+    The client request token is derived from the object identity, so a retried event does not start a second job.
+
+    Arguments:
+        s3_tuple {tuple} -- tuple in the form (s3 bucket, s3 object key, file size[, etag])
+
+    Keyword Arguments:
+        sns_topic_arn {str} -- topic textract publishes the completion to (default: {TEXTRACT_SNS_TOPIC_ARN})
+        role_arn {str} -- role allowing textract to publish to the topic (default: {TEXTRACT_ROLE_ARN})
+
+    Returns:
+        str -- job id
+    """
+
+    job_tag = encode_job_tag(s3_tuple)
+    # the whole object identity is hashed, so objects that share a key suffix, a key or an etag get their own job
+    token = hashlib.sha256(json.dumps([s3_tuple[0], s3_tuple[1], job_tag]).encode("utf-8")).hexdigest()
+    response = get_textract_client().start_document_text_detection(
+        DocumentLocation={
+            "S3Object" : {
+                "Bucket" : s3_tuple[0],
+                "Name" : s3_tuple[1]
+            }
+        },
+        ClientRequestToken=token,
+        JobTag=job_tag,
+        NotificationChannel={
+            "SNSTopicArn" : sns_topic_arn,
+            "RoleArn" : role_arn
+        }
+    )
+    return response["JobId"]
+
+def iter_text_detection_blocks(job_id : str, max_results : int = 1000):
+    """ Iterate the blocks of a finished text detection job, following the pagination
+
+    Arguments:
+        job_id {str} -- job id
+
+    Keyword Arguments:
+        max_results {int} -- max blocks per GetDocumentTextDetection call (default: {1000})
+
+    Yields:
+        dict -- block
+    """
+
+    client = get_textract_client()
+    kwargs = {"JobId" : job_id, "MaxResults" : max_results}
+    while True:
+        response = client.get_document_text_detection(**kwargs)
+        if response["JobStatus"] not in SUCCEEDED_STATUSES:
+            raise TextractJobError(job_id, response["JobStatus"], response.get("StatusMessage", ""))
+        yield from response["Blocks"]
+        if not response.get("NextToken"):
+            return
+        kwargs["NextToken"] = response["NextToken"]
+
+def blocks_to_pages(blocks) -> list:
+    """ Join the LINE blocks of every page, in the reading order textract returns them
+
+    Arguments:
+        blocks {iterable} -- textract blocks
+
+    Returns:
+        list -- text of each page, empty for a page without lines
+    """
+
+    lines = {}
+    num_of_pages = 0
+    for block in blocks:
+        page = block.get("Page", 1)
+        num_of_pages = max(num_of_pages, page)
+        if block["BlockType"] == "LINE":
+            lines.setdefault(page, []).append(block["Text"])
+    return ["\n".join(lines.get(page, [])) for page in range(1, num_of_pages + 1)]
+
+def get_text_detection_pages(job_id : str) -> list:
+    """ Get the page texts of a finished text detection job
+
+    Arguments:
+        job_id {str} -- job id
+
+    Returns:
+        list -- text of each page
+    """
+
+    return blocks_to_pages(iter_text_detection_blocks(job_id))
+
+def parse_completion_record(record : dict) -> dict:
+    """ Parse the SNS record of a job completion
+
+    Arguments:
+        record {dict} -- SNS event record
+
+    Returns:
+        dict -- completion in the form
+        {
+            "job_id" : "...",
+            "status" : "SUCCEEDED"|"FAILED"|"ERROR"|...,
+            "s3_tuple" : (s3 bucket, s3 object key, file size, etag)
+        }
+    """
+
+    message = json.loads(record["Sns"]["Message"])
+    size, etag = decode_job_tag(message.get("JobTag"))
+    location = message["DocumentLocation"]
+    return {
+        "job_id" : message["JobId"],
+        "status" : message["Status"],
+        "s3_tuple" : (location["S3Bucket"], location["S3ObjectName"], size, etag)
+    }
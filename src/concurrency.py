@@ -0,0 +1,161 @@
+"""
+A module with helpers to overlap blocking calls on threads
+"""
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_exhausted = object()
+
+def ordered_map(func, items, max_workers : int, weight=None, budget : int = None):
+    """ Apply a blocking function to items on a thread pool and yield the results in the original order
+    
+    At most max_workers items are submitted ahead of the consumer, and the summed weight of the
+    submitted but not yet consumed items stays within the budget. An item heavier than the whole
+    budget is still submitted once nothing else is outstanding.
+    
+    Arguments:
+        func {callable} -- function applied to every item
+        items {iterable} -- items to be processed
+        max_workers {int} -- max number of concurrent calls
+    
+    Keyword Arguments:
+        weight {callable} -- function returning the weight of an item, e.g. its size in bytes (default: {None})
+        budget {int} -- max summed weight of outstanding items, unbounded if None (default: {None})
+    
+    Yields:
+        object -- result of func for every item, in order; the exception of a failed call is raised when reached
+    """
+
+    items = iter(items)
+    pending = deque()
+    held = 0
+    next_item = _exhausted
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(pending) < max_workers:
+                if next_item is _exhausted:
+                    next_item = next(items, _exhausted)
+                    if next_item is _exhausted:
+                        break
+                item_weight = weight(next_item) if weight is not None else 0
+                if pending and budget is not None and held + item_weight > budget:
+                    break
+                pending.append((executor.submit(func, next_item), item_weight))
+                held += item_weight
+                next_item = _exhausted
+
+            if not pending:
+                return
+            future, item_weight = pending.popleft()
+            try:
+                result = future.result()
+            finally:
+                held -= item_weight
+            yield result
+
+def _put_until_stopped(bounded_queue : queue.Queue, entry : tuple, stop : threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            bounded_queue.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def prefetch(items, maxsize : int):
+    """ Run an iterator on a background thread so that producing items overlaps with consuming them
+    
+    Chaining prefetch between the stages of a generator pipeline gives every stage its own thread,
+    so the pipeline runs at the pace of its slowest stage rather than the sum of all stages. At most
+    maxsize produced items wait in the bounded queue, which bounds the memory held between stages.
+    
+    Arguments:
+        items {iterable} -- items to be produced, e.g. the generator of the previous stage
+        maxsize {int} -- max number of produced items waiting to be consumed
+    
+    Yields:
+        object -- every item, in order; the exception of the producer is raised when reached.
+        Closing the generator stops the producer at its next item.
+    """
+
+    bounded_queue = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not _put_until_stopped(bounded_queue, (item, None), stop):
+                    return
+            _put_until_stopped(bounded_queue, (_exhausted, None), stop)
+        except BaseException as e:
+            _put_until_stopped(bounded_queue, (_exhausted, e), stop)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = bounded_queue.get()
+            if error is not None:
+                raise error
+            if item is _exhausted:
+                return
+            yield item
+    finally:
+        stop.set()
+
+class RateLimiter:
+    """ Thread-safe limiter that spaces calls evenly to stay under a number of transactions per second """
+
+    def __init__(self, max_tps : float, timer=time.monotonic, sleep=time.sleep):
+        self._interval = 1.0 / max_tps if max_tps and max_tps > 0 else 0.0
+        self._timer = timer
+        self._sleep = sleep
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until the caller may send its next call """
+
+        if not self._interval:
+            return
+        with self._lock:
+            now = self._timer()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            self._sleep(slot - now)
+
+class DeadlineReached(Exception):
+    """ Work left unfinished because the invocation ran out of time """
+
+    def __init__(self, message : str = "lambda deadline reached before the object was processed"):
+        super().__init__(message)
+
+class Deadline:
+    """ Time left to a lambda invocation, reached once less than a safety margin remains """
+
+    def __init__(self, context=None, margin_ms : float = 0, clock=time.monotonic):
+        # a context without get_remaining_time_in_millis, e.g. the {} of a local run, never reaches the deadline
+        get_remaining_time_in_millis = getattr(context, "get_remaining_time_in_millis", None)
+        # the remaining time is read once and counted down on the clock, which tests can replace
+        self._clock = clock
+        self._end = math.inf if get_remaining_time_in_millis is None else clock() + get_remaining_time_in_millis() / 1000
+        self.margin_ms = margin_ms
+
+    def remaining_ms(self) -> float:
+        """ Get the milliseconds left before the invocation times out, infinite without a context """
+
+        return (self._end - self._clock()) * 1000
+
+    def reached(self, margin_ms : float = None) -> bool:
+        """ Check whether less than the safety margin, or another margin, is left """
+
+        return self.remaining_ms() < (self.margin_ms if margin_ms is None else margin_ms)
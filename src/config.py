@@ -7,3 +7,87 @@ ES_HOST = os.getenv("ES_HOST", "http://localhost")
 ES_PORT = int(os.getenv("ES_PORT", 9200))
 
 AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
+
+ES_POOL_MAXSIZE = int(os.getenv("ES_POOL_MAXSIZE", 10))
+ES_CONNECT_TIMEOUT = float(os.getenv("ES_CONNECT_TIMEOUT", 3.05))
+ES_READ_TIMEOUT = float(os.getenv("ES_READ_TIMEOUT", 30))
+# max seconds a background task such as a _delete_by_query is polled for
+ES_TASK_MAX_WAIT = float(os.getenv("ES_TASK_MAX_WAIT", 60))
+
+ES_BULK_MAX_BYTES = int(os.getenv("ES_BULK_MAX_BYTES", 5 * 1024 * 1024))
+ES_BULK_MAX_DOCS = int(os.getenv("ES_BULK_MAX_DOCS", 500))
+ES_BULK_MAX_RETRIES = int(os.getenv("ES_BULK_MAX_RETRIES", 3))
+ES_BULK_BACKOFF = float(os.getenv("ES_BULK_BACKOFF", 0.5))
+
+ES_MAX_CONCURRENCY = int(os.getenv("ES_MAX_CONCURRENCY", 4))
+
+# "legacy" registers a _template for the indices, the typed mappings of this client need elasticsearch 6.x
+ES_INDEX_TEMPLATE = os.getenv("ES_INDEX_TEMPLATE", "")
+
+ES_BULK_GZIP = os.getenv("ES_BULK_GZIP", "false").lower() == "true"
+
+SEARCH_CACHE_MAXSIZE = int(os.getenv("SEARCH_CACHE_MAXSIZE", 256))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 60))
+SEARCH_CACHE_GENERATION_INTERVAL = float(os.getenv("SEARCH_CACHE_GENERATION_INTERVAL", 10))
+
+S3_FETCH_CONCURRENCY = int(os.getenv("S3_FETCH_CONCURRENCY", 8))
+S3_FETCH_BYTE_BUDGET = int(os.getenv("S3_FETCH_BYTE_BUDGET", 32 * 1024 * 1024))
+
+# three calls per image, so the calls of 8 images are in flight at once
+REKOGNITION_CONCURRENCY = int(os.getenv("REKOGNITION_CONCURRENCY", 24))
+# calls per second of each rekognition api, the default quota of DetectLabels, DetectText and RecognizeCelebrities
+# in the large regions such as us-east-1, lower it to the quota of smaller regions
+REKOGNITION_MAX_TPS = float(os.getenv("REKOGNITION_MAX_TPS", 50))
+
+ETAG_CACHE_MAXSIZE = int(os.getenv("ETAG_CACHE_MAXSIZE", 4096))
+ETAG_CACHE_TTL = float(os.getenv("ETAG_CACHE_TTL", 3600))
+
+S3_READ_CHUNK_SIZE = int(os.getenv("S3_READ_CHUNK_SIZE", 1024 * 1024))
+S3_SPOOL_THRESHOLD = int(os.getenv("S3_SPOOL_THRESHOLD", 8 * 1024 * 1024))
+# largest object downloaded, a larger txt is cut off and a larger file of any other format is sent to textract or skipped
+S3_MAX_OBJECT_BYTES = int(os.getenv("S3_MAX_OBJECT_BYTES", 100 * 1024 * 1024))
+MAX_CONTENT_CHARS = int(os.getenv("MAX_CONTENT_CHARS", 5 * 1000 * 1000))
+
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", 0))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 50))
+# seconds to wait for the extraction workers, the units of a worker that did not answer are extracted in process
+PDF_WORKER_TIMEOUT = float(os.getenv("PDF_WORKER_TIMEOUT", 120))
+
+TEXTFILE_PASSAGE_MODE = os.getenv("TEXTFILE_PASSAGE_MODE", "false").lower() == "true"
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", 1000))
+# number of re-indexed files whose stale passages are deleted with a single delete by query
+PASSAGE_DELETE_BATCH_SIZE = int(os.getenv("PASSAGE_DELETE_BATCH_SIZE", 25))
+
+# one of "plain" (re-analyze at query time), "unified" (offsets in the postings) or "fvh" (term vectors with offsets),
+# the content mapping follows it and elasticsearch rejects the changed mapping of an existing index, so switching
+# from the default "plain" requires new indices and a re-index
+ES_HIGHLIGHTER = os.getenv("ES_HIGHLIGHTER", "plain")
+# enforced from elasticsearch 7, 6.x only logs a deprecation warning when a highlighted field is longer
+ES_HIGHLIGHT_MAX_ANALYZED_OFFSET = int(os.getenv("ES_HIGHLIGHT_MAX_ANALYZED_OFFSET", 1000000))
+
+COMPREHEND_CONCURRENCY = int(os.getenv("COMPREHEND_CONCURRENCY", 4))
+COMPREHEND_MAX_TPS = float(os.getenv("COMPREHEND_MAX_TPS", 10))
+COMPREHEND_ENRICHMENT = os.getenv("COMPREHEND_ENRICHMENT", "false").lower() == "true"
+
+COMPREHEND_CACHE_MAXSIZE = int(os.getenv("COMPREHEND_CACHE_MAXSIZE", 1024))
+COMPREHEND_CACHE_TTL = float(os.getenv("COMPREHEND_CACHE_TTL", 24 * 3600))
+# sqlite file that keeps detect_* results for the lifetime of the container, disabled if empty
+COMPREHEND_CACHE_PATH = os.getenv("COMPREHEND_CACHE_PATH", "/tmp/comprehend-cache.sqlite3")
+
+# sidecar store of rekognition analyses keyed by object identity, an s3 bucket takes precedence over a local directory
+REKOGNITION_CACHE_BUCKET = os.getenv("REKOGNITION_CACHE_BUCKET", "")
+REKOGNITION_CACHE_PREFIX = os.getenv("REKOGNITION_CACHE_PREFIX", "rekognition-cache/")
+REKOGNITION_CACHE_DIR = os.getenv("REKOGNITION_CACHE_DIR", "")
+
+# large documents of these extensions are detected by asynchronous textract jobs, disabled without a topic
+TEXTRACT_SNS_TOPIC_ARN = os.getenv("TEXTRACT_SNS_TOPIC_ARN", "")
+TEXTRACT_ROLE_ARN = os.getenv("TEXTRACT_ROLE_ARN", "")
+TEXTRACT_EXTENSIONS = set(filter(None, os.getenv("TEXTRACT_EXTENSIONS", "pdf").split(",")))
+TEXTRACT_MIN_BYTES = int(os.getenv("TEXTRACT_MIN_BYTES", 5 * 1024 * 1024))
+
+# max number of items buffered between two stages of the ingest pipeline (fetch, extract, enrich, bulk), 0 runs the stages in turn
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+
+# the indexer stops taking new objects once less than this is left before the lambda timeout,
+# the objects not taken are reported as failures to be retried by themselves
+LAMBDA_DEADLINE_MARGIN_MS = int(os.getenv("LAMBDA_DEADLINE_MARGIN_MS", 30000))
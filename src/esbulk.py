@@ -0,0 +1,125 @@
+"""
+A module that cuts elasticsearch bulk actions into bounded chunks and interprets bulk responses
+"""
+from http import HTTPStatus
+
+RETRYABLE_ERROR_TYPES = set(["es_rejected_execution_exception"])
+MAPPING_ERROR_TYPES = set([
+    "index_not_found_exception",
+    "mapper_parsing_exception",
+    "strict_dynamic_mapping_exception",
+    "illegal_argument_exception"
+])
+
+class BulkSummary:
+    """ Compact result of one or more bulk requests """
+
+    def __init__(self):
+        self.success = 0
+        self.retried = 0
+        self.chunks = 0
+        self.errors = []
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    @property
+    def failed_pids(self) -> list:
+        return [pid for pid, status, error_type in self.errors]
+
+    def merge(self, other : "BulkSummary") -> "BulkSummary":
+        """ Add the counts and errors of another summary into this one
+        
+        Arguments:
+            other {BulkSummary} -- summary to be merged
+        
+        Returns:
+            BulkSummary -- this summary
+        """
+
+        self.success += other.success
+        self.retried += other.retried
+        self.chunks += other.chunks
+        self.errors.extend(other.errors)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "success" : self.success,
+            "failed" : self.failed,
+            "retried" : self.retried,
+            "chunks" : self.chunks,
+            "errors" : self.errors
+        }
+
+    def __repr__(self):
+        return f"BulkSummary(success={self.success}, failed={self.failed}, retried={self.retried}, chunks={self.chunks})"
+
+def iter_bulk_chunks(actions, max_chunk_bytes : int, max_chunk_docs : int):
+    """ Group encoded bulk actions into chunks bounded by byte size and document count
+    
+    Arguments:
+        actions {iterable} -- iterable of (pid, encoded action bytes)
+        max_chunk_bytes {int} -- max number of bytes in a chunk
+        max_chunk_docs {int} -- max number of actions in a chunk
+    
+    Yields:
+        list -- list of (pid, encoded action bytes); an action larger than max_chunk_bytes is sent on its own
+    """
+
+    chunk = []
+    chunk_bytes = 0
+    for pid, data in actions:
+        if chunk and (chunk_bytes + len(data) > max_chunk_bytes or len(chunk) >= max_chunk_docs):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append((pid, data))
+        chunk_bytes += len(data)
+    if chunk:
+        yield chunk
+
+def is_retryable(status : int, error : dict) -> bool:
+    """ Check if a bulk item was rejected because the cluster is overloaded
+    
+    Arguments:
+        status {int} -- item http status
+        error {dict} -- item error, or None
+    
+    Returns:
+        bool -- the item should be retried
+    """
+
+    if status == HTTPStatus.TOO_MANY_REQUESTS:
+        return True
+    return bool(error) and error.get("type") in RETRYABLE_ERROR_TYPES
+
+def parse_bulk_items(chunk : list, response_body : dict) -> tuple:
+    """ Split the actions of a chunk by their item result in the bulk response
+    
+    Arguments:
+        chunk {list} -- list of (pid, encoded action bytes) that was sent
+        response_body {dict} -- json body of the bulk response
+    
+    Returns:
+        tuple -- (number of successful items, list of actions to retry, list of (pid, status, error type) failures)
+    """
+
+    success = 0
+    retry = []
+    errors = []
+    items = response_body.get("items", [])
+    for action, item in zip(chunk, items):
+        result = next(iter(item.values()))
+        status = result.get("status", HTTPStatus.INTERNAL_SERVER_ERROR)
+        error = result.get("error")
+        if 200 <= status < 300 and not error:
+            success += 1
+        elif is_retryable(status, error):
+            retry.append(action)
+        else:
+            errors.append((action[0], status, error.get("type") if isinstance(error, dict) else error))
+    for action in chunk[len(items):]:
+        errors.append((action[0], HTTPStatus.INTERNAL_SERVER_ERROR, "missing_bulk_item"))
+    return success, retry, errors
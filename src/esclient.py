@@ -1,16 +1,124 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 from http import HTTPStatus
-import json
+import socket
+import threading
+import time
+
+from esbulk import BulkSummary, iter_bulk_chunks, parse_bulk_items, MAPPING_ERROR_TYPES
+from bulkencoder import BulkEncoder, gzip_body
+from config import ES_POOL_MAXSIZE, ES_CONNECT_TIMEOUT, ES_READ_TIMEOUT, ES_INDEX_TEMPLATE, ES_TASK_MAX_WAIT
+from config import ES_BULK_MAX_BYTES, ES_BULK_MAX_DOCS, ES_BULK_MAX_RETRIES, ES_BULK_BACKOFF, ES_BULK_GZIP
+from config import ES_HIGHLIGHTER, ES_HIGHLIGHT_MAX_ANALYZED_OFFSET
+
+# sessions are kept at module level so that warm lambda containers reuse the pooled connections
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# (endpoint, index) pairs whose index, settings and mapping are known to be in place in this container
+_ensured_indices = set()
+_ensured_indices_lock = threading.Lock()
+
+class KeepAliveAdapter(HTTPAdapter):
+    """ HTTP adapter that turns on TCP keep-alive for every pooled connection """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        return super().init_poolmanager(*args, **kwargs)
+
+def get_session(pool_maxsize : int = ES_POOL_MAXSIZE) -> requests.Session:
+    """ Get the shared keep-alive session for a given pool size, creating it on first use
+    
+    Keyword Arguments:
+        pool_maxsize {int} -- max number of pooled connections per host (default: {ES_POOL_MAXSIZE})
+    
+    Returns:
+        requests.Session -- pooled http session
+    """
+
+    with _sessions_lock:
+        session = _sessions.get(pool_maxsize)
+        if session is None:
+            session = requests.Session()
+            adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Connection" : "keep-alive"})
+            _sessions[pool_maxsize] = session
+        return session
+
+def close_sessions():
+    """ Close all the shared sessions and their pooled connections """
+
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+def get_etag(s3_tuple : tuple) -> str:
+    """ Get the S3 ETag of an object tuple
+    
+    Arguments:
+        s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size[, object etag])
+    
+    Returns:
+        str -- etag without quotes, or None if unknown
+    """
+
+    if len(s3_tuple) > 3 and s3_tuple[3]:
+        return s3_tuple[3].strip('"')
+    return None
+
+# highlighter type -> options of the highlighted text field storing what the highlighter reads
+HIGHLIGHTER_FIELD_OPTIONS = {
+    "unified" : {"index_options" : "offsets"},
+    "fvh" : {"term_vector" : "with_positions_offsets"},
+    "plain" : {}
+}
+
+def highlighted_text_field(highlighter : str = ES_HIGHLIGHTER) -> dict:
+    """ Get the mapping of a text field highlighted without re-analyzing the hits
+    
+    Keyword Arguments:
+        highlighter {str} -- "unified", "fvh" or "plain" (default: {ES_HIGHLIGHTER})
+    
+    Returns:
+        dict -- text field mapping
+    """
+
+    if highlighter not in HIGHLIGHTER_FIELD_OPTIONS:
+        raise ValueError(f"Unsupported highlighter {highlighter}, expected one of {sorted(HIGHLIGHTER_FIELD_OPTIONS)}")
+    return dict({"type" : "text"}, **HIGHLIGHTER_FIELD_OPTIONS[highlighter])
+
+def highlight_settings(max_analyzed_offset : int = ES_HIGHLIGHT_MAX_ANALYZED_OFFSET) -> dict:
+    """ Get the index settings bounding the text a highlighter re-analyzes when no offsets are stored
+    
+    Elasticsearch 6.x accepts the setting but only logs a deprecation warning when a field is longer, the text
+    highlighted on the 6.3 domain is bounded by MAX_CONTENT_CHARS at extraction and by passage mode instead.
+    
+    Keyword Arguments:
+        max_analyzed_offset {int} -- max characters analyzed per highlighted field (default: {ES_HIGHLIGHT_MAX_ANALYZED_OFFSET})
+    
+    Returns:
+        dict -- index settings
+    """
+
+    return {"index.highlight.max_analyzed_offset" : max_analyzed_offset}
 
 class ESClientBase:
 
-    def __init__(self, host : str, port : int, index : str, doc_type : str, mapping : dict):
+    def __init__(self, host : str, port : int, index : str, doc_type : str, mapping : dict, session : requests.Session = None, timeout : tuple = None, settings : dict = None):
         self._host = host
         self._port = port
         self._es_endpoint = f"{host}:{port}"
         self._index = index
         self._doc_type = doc_type
         self._mapping = mapping
+        self._settings = settings if settings is not None else {}
+        self._bulk_encoders = {}
+        self._session = session if session is not None else get_session()
+        self._timeout = timeout if timeout is not None else (ES_CONNECT_TIMEOUT, ES_READ_TIMEOUT)
 
         if self._es_endpoint[:4] != "http":
             if self._port == 443:
@@ -30,6 +138,28 @@ class ESClientBase:
     def mapping(self):
         return self._mapping
 
+    @property
+    def settings(self):
+        return self._settings
+
+    @property
+    def session(self):
+        return self._session
+
+    def _request(self, method : str, path : str, **kwargs) -> requests.Response:
+        """ Send a request to the elasticsearch endpoint through the pooled session
+        
+        Arguments:
+            method {str} -- http method
+            path {str} -- url path starting with "/"
+        
+        Returns:
+            requests.Response -- http response
+        """
+
+        kwargs.setdefault("timeout", self._timeout)
+        return self._session.request(method, url=f"{self._es_endpoint}{path}", **kwargs)
+
     def put_index(self, ignore_exist_error=True) -> requests.Response:
         """ Add an elasticsearch index by sending a put request
         
@@ -40,7 +170,7 @@ class ESClientBase:
             requests.Response -- put index http response
         """
 
-        res = requests.put(url=f"{self._es_endpoint}/{self._index}")
+        res = self._request("PUT", f"/{self._index}")
         if ignore_exist_error:
             assert res.status_code in [HTTPStatus.OK, HTTPStatus.BAD_REQUEST]
         else:
@@ -57,7 +187,8 @@ class ESClientBase:
             requests.Response -- delete index http response
         """
 
-        res = requests.delete(url=f"{self._es_endpoint}/{self._index}")
+        self.invalidate_index_cache()
+        res = self._request("DELETE", f"/{self._index}")
         if ignore_nonexist_error:
             assert res.status_code in [HTTPStatus.OK, HTTPStatus.NOT_FOUND]
         else:
@@ -71,10 +202,105 @@ class ESClientBase:
             requests.Response -- put mapping http response
         """
 
-        res = requests.put(url=f"{self._es_endpoint}/{self._index}/_mapping/{self._doc_type}", json=self._mapping)
+        res = self._request("PUT", f"/{self._index}/_mapping/{self._doc_type}", json=self._mapping)
         assert HTTPStatus.OK == res.status_code
         return res
 
+    def index_exists(self) -> bool:
+        """ Check if the index exists by sending a head request
+        
+        Returns:
+            bool -- the index exists
+        """
+
+        res = self._request("HEAD", f"/{self._index}")
+        assert res.status_code in [HTTPStatus.OK, HTTPStatus.NOT_FOUND]
+        return HTTPStatus.OK == res.status_code
+
+    def index_generation(self) -> tuple:
+        """ Get a token that changes whenever documents are indexed into or deleted from the index
+        
+        Returns:
+            tuple -- (index_total, delete_total) of the primary shards
+        """
+
+        res = self._request("GET", f"/{self._index}/_stats/indexing")
+        assert HTTPStatus.OK == res.status_code
+        indexing = res.json()["_all"]["primaries"]["indexing"]
+        return (indexing["index_total"], indexing["delete_total"])
+
+    def create_index(self) -> requests.Response:
+        """ Create the index with its settings and mapping in a single put request
+        
+        Returns:
+            requests.Response -- create index http response, a concurrent creation is not an error
+        """
+
+        body = {
+            "settings" : self._settings,
+            "mappings" : {
+                self._doc_type : self._mapping
+            }
+        }
+        res = self._request("PUT", f"/{self._index}", json=body)
+        if HTTPStatus.BAD_REQUEST == res.status_code:
+            assert res.json()["error"]["type"] == "resource_already_exists_exception"
+        else:
+            assert HTTPStatus.OK == res.status_code
+        return res
+
+    def put_index_template(self) -> requests.Response:
+        """ Register a legacy index template so that new indices matching the index name get the settings and mapping
+        
+        Returns:
+            requests.Response -- put template http response
+        """
+
+        body = {
+            "index_patterns" : [f"{self._index}*"],
+            "settings" : self._settings,
+            "mappings" : {
+                self._doc_type : self._mapping
+            }
+        }
+        res = self._request("PUT", f"/_template/{self._index}", json=body)
+        assert HTTPStatus.OK == res.status_code
+        return res
+
+    def ensure_index(self, force : bool = False, index_template : str = ES_INDEX_TEMPLATE) -> bool:
+        """ Make sure the index, settings and mapping exist, at most once per container
+        
+        Keyword Arguments:
+            force {bool} -- check again even if the index is cached as ensured (default: {False})
+            index_template {str} -- "legacy" to register an index template first, so that indices created
+                                    outside of this client get the mapping as well (default: {ES_INDEX_TEMPLATE})
+        
+        Returns:
+            bool -- False if the cached state was used, True if elasticsearch was contacted
+        """
+
+        key = (self._es_endpoint, self._index)
+        if not force and key in _ensured_indices:
+            return False
+
+        if index_template:
+            self.put_index_template()
+        if not self.index_exists():
+            self.create_index()
+        else:
+            # a template only applies to new indices, an existing one gets the fields added since it was created
+            self.put_mapping()
+
+        with _ensured_indices_lock:
+            _ensured_indices.add(key)
+        return True
+
+    def invalidate_index_cache(self):
+        """ Forget the ensured state of the index so the next ensure_index call checks it again """
+
+        with _ensured_indices_lock:
+            _ensured_indices.discard((self._es_endpoint, self._index))
+
     def get_document(self, pid : str) -> requests.Response:
         """ Retrieve document by sending a get request
         
@@ -85,10 +311,32 @@ class ESClientBase:
             requests.Response -- get document http response
         """
 
-        res = requests.get(url=f"{self._es_endpoint}/{self._index}/{self._doc_type}/{pid}")
+        res = self._request("GET", f"/{self._index}/{self._doc_type}/{pid}")
         assert HTTPStatus.OK == res.status_code
         return res
 
+    def get_document_sources(self, pid_list : list, fields : list = None) -> dict:
+        """ Retrieve the source of multiple documents with a single _mget request
+        
+        Arguments:
+            pid_list {list} -- list of primary ids
+        
+        Keyword Arguments:
+            fields {list} -- list of _source fields to return, whole source if None (default: {None})
+        
+        Returns:
+            dict -- dictionary of primary id to source for the documents found
+        """
+
+        if not pid_list:
+            return {}
+        docs = [{"_id" : pid} if fields is None else {"_id" : pid, "_source" : fields} for pid in pid_list]
+        res = self._request("POST", f"/{self._index}/{self._doc_type}/_mget", json={"docs" : docs})
+        if HTTPStatus.NOT_FOUND == res.status_code:
+            return {}
+        assert HTTPStatus.OK == res.status_code
+        return {doc["_id"] : doc.get("_source", {}) for doc in res.json()["docs"] if doc.get("found")}
+
     def put_document(self, pid : str, document : dict) -> requests.Response:
         """ Add document by sending a put request
         
@@ -100,7 +348,7 @@ class ESClientBase:
             requests.Response -- put document http response
         """
 
-        res = requests.put(url=f"{self._es_endpoint}/{self._index}/{self._doc_type}/{pid}", json=document)
+        res = self._request("PUT", f"/{self._index}/{self._doc_type}/{pid}", json=document)
         assert HTTPStatus.CREATED == res.status_code
         return res
 
@@ -116,18 +364,141 @@ class ESClientBase:
         """
 
         assert len(pid_list) == len(document_list)
-        data_list = [
-            "\n".join([
-                json.dumps({ "create" : {"_id" : pid, "_type" : self._doc_type, "_index" : self._index} }),
-                json.dumps(document)
-            ]) for pid, document in zip(pid_list, document_list)
-        ]
-        data = "\n".join(data_list) + "\n"
-        headers = {"Content-Type": "application/x-ndjson"}
-        res = requests.post(url=f"{self._es_endpoint}/_bulk?pretty", data=data, headers=headers)
+        res = self._post_bulk(self.bulk_encoder("create").encode(zip(pid_list, document_list)))
         assert HTTPStatus.OK == res.status_code
         return res
 
+    def bulk_encoder(self, op_type : str = "index") -> BulkEncoder:
+        """ Get the bulk encoder of this index for a bulk operation
+        
+        Keyword Arguments:
+            op_type {str} -- "index", "create" or "delete" (default: {"index"})
+        
+        Returns:
+            BulkEncoder -- encoder with the pre-encoded action header
+        """
+
+        encoder = self._bulk_encoders.get(op_type)
+        if encoder is None:
+            encoder = self._bulk_encoders[op_type] = BulkEncoder(self._index, self._doc_type, op_type=op_type)
+        return encoder
+
+    def _post_bulk(self, data : bytes, gzip : bool = ES_BULK_GZIP) -> requests.Response:
+        """ Send an ndjson body to the bulk endpoint
+        
+        Arguments:
+            data {bytes} -- ndjson bulk body
+        
+        Keyword Arguments:
+            gzip {bool} -- compress the body with gzip (default: {ES_BULK_GZIP})
+        
+        Returns:
+            requests.Response -- bulk http response
+        """
+
+        headers = {"Content-Type": "application/x-ndjson"}
+        if gzip:
+            data = gzip_body(data)
+            headers["Content-Encoding"] = "gzip"
+        return self._request("POST", "/_bulk", data=data, headers=headers)
+
+    def iter_bulk_actions(self, documents, op_type : str = "index"):
+        """ Encode (pid, document) pairs into bulk actions lazily
+        
+        Arguments:
+            documents {iterable} -- iterable of (primary id, document)
+        
+        Keyword Arguments:
+            op_type {str} -- bulk operation, "index" or "create" (default: {"index"})
+        
+        Yields:
+            tuple -- (primary id, encoded action and source lines)
+        """
+
+        encoder = self.bulk_encoder(op_type)
+        for pid, document in documents:
+            yield pid, encoder.encode_action(pid, document)
+
+    def submit_bulk_chunk(self, chunk : list, max_retries : int = ES_BULK_MAX_RETRIES, backoff : float = ES_BULK_BACKOFF) -> BulkSummary:
+        """ Send one chunk of encoded bulk actions, retrying only the items rejected by an overloaded cluster
+        
+        Arguments:
+            chunk {list} -- list of (primary id, encoded action bytes)
+        
+        Keyword Arguments:
+            max_retries {int} -- max number of retries for rejected items (default: {ES_BULK_MAX_RETRIES})
+            backoff {float} -- initial backoff in seconds, doubled on every retry (default: {ES_BULK_BACKOFF})
+        
+        Returns:
+            BulkSummary -- summary of the chunk
+        """
+
+        summary = BulkSummary()
+        summary.chunks = 1
+        pending = chunk
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+                summary.retried += len(pending)
+
+            res = self._post_bulk(b"".join(data for pid, data in pending))
+            if res.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+                continue
+            if res.status_code != HTTPStatus.OK:
+                summary.errors.extend((pid, res.status_code, "bulk_request_failed") for pid, data in pending)
+                return summary
+
+            success, pending, errors = parse_bulk_items(pending, res.json())
+            summary.success += success
+            summary.errors.extend(errors)
+            if any(error_type in MAPPING_ERROR_TYPES for pid, status, error_type in errors):
+                self.invalidate_index_cache()
+            if not pending:
+                return summary
+
+        summary.errors.extend((pid, HTTPStatus.TOO_MANY_REQUESTS, "es_rejected_execution_exception") for pid, data in pending)
+        return summary
+
+    def put_document_stream(self, documents, op_type : str = "index", max_chunk_bytes : int = ES_BULK_MAX_BYTES, max_chunk_docs : int = ES_BULK_MAX_DOCS, max_retries : int = ES_BULK_MAX_RETRIES, backoff : float = ES_BULK_BACKOFF) -> BulkSummary:
+        """ Stream documents into elasticsearch using bulk requests bounded by byte size and document count
+        
+        Arguments:
+            documents {iterable} -- iterable or generator of (primary id, document)
+        
+        Keyword Arguments:
+            op_type {str} -- bulk operation, "index" or "create" (default: {"index"})
+            max_chunk_bytes {int} -- max bytes per bulk request (default: {ES_BULK_MAX_BYTES})
+            max_chunk_docs {int} -- max documents per bulk request (default: {ES_BULK_MAX_DOCS})
+            max_retries {int} -- max number of retries for rejected items (default: {ES_BULK_MAX_RETRIES})
+            backoff {float} -- initial retry backoff in seconds (default: {ES_BULK_BACKOFF})
+        
+        Returns:
+            BulkSummary -- number of successes, retries and the (pid, status, error type) of every failure
+        """
+
+        return self.put_action_stream(self.iter_bulk_actions(documents, op_type), max_chunk_bytes=max_chunk_bytes, max_chunk_docs=max_chunk_docs, max_retries=max_retries, backoff=backoff)
+
+    def put_action_stream(self, actions, max_chunk_bytes : int = ES_BULK_MAX_BYTES, max_chunk_docs : int = ES_BULK_MAX_DOCS, max_retries : int = ES_BULK_MAX_RETRIES, backoff : float = ES_BULK_BACKOFF) -> BulkSummary:
+        """ Stream already encoded bulk actions, which may target other indices, using bounded bulk requests
+        
+        Arguments:
+            actions {iterable} -- iterable of (primary id, encoded action bytes), e.g. from iter_bulk_actions of several clients
+        
+        Keyword Arguments:
+            max_chunk_bytes {int} -- max bytes per bulk request (default: {ES_BULK_MAX_BYTES})
+            max_chunk_docs {int} -- max documents per bulk request (default: {ES_BULK_MAX_DOCS})
+            max_retries {int} -- max number of retries for rejected items (default: {ES_BULK_MAX_RETRIES})
+            backoff {float} -- initial retry backoff in seconds (default: {ES_BULK_BACKOFF})
+        
+        Returns:
+            BulkSummary -- number of successes, retries and the (pid, status, error type) of every failure
+        """
+
+        summary = BulkSummary()
+        for chunk in iter_bulk_chunks(actions, max_chunk_bytes, max_chunk_docs):
+            summary.merge(self.submit_bulk_chunk(chunk, max_retries=max_retries, backoff=backoff))
+        return summary
+
     def delete_document(self, pid : str, ignore_nonexist_error=True) -> requests.Response:
         """ Delete document by sending a delete request
         
@@ -141,7 +512,7 @@ class ESClientBase:
             requests.Response -- delete request http response
         """
 
-        res = requests.delete(url=f"{self._es_endpoint}/{self._index}/{self._doc_type}/{pid}")
+        res = self._request("DELETE", f"/{self._index}/{self._doc_type}/{pid}")
         if ignore_nonexist_error:
             assert res.status_code in [HTTPStatus.OK, HTTPStatus.NOT_FOUND]
         else:
@@ -157,36 +528,102 @@ class ESClientBase:
         Returns:
             requests.Response -- post request http response
         """
-        # TODO: Need Unittest to Verify If Functionalities are achieved
 
-        data_list = [
-            json.dumps({ "delete" : {"_id" : pid, "_type" : self._doc_type, "_index" : self._index} })
-            for pid in pid_list
-        ]
-        data = "\n".join(data_list) + "\n"
-        headers = {"Content-Type": "application/x-ndjson"}
-        res = requests.post(url=f"{self._es_endpoint}/_bulk?pretty", data=data, headers=headers)
+        res = self._post_bulk(self.bulk_encoder("delete").encode(pid_list))
         assert HTTPStatus.OK == res.status_code
         return res
 
     
-    def delete_document_by_query(self, body : dict) -> requests.Response:
-        """ Delete queried document
+    def delete_document_by_query(self, body : dict, slices="auto", wait_for_completion : bool = True, poll_task : bool = False, poll_interval : float = 1.0, max_wait : float = ES_TASK_MAX_WAIT, missing_ok : bool = False) -> requests.Response:
+        """ Delete every queried document on the server side using _delete_by_query
         
         Arguments:
             body {dict} -- query body
         
+        Keyword Arguments:
+            slices {int or str} -- number of parallel slices, "auto" lets elasticsearch pick one per shard (default: {"auto"})
+            wait_for_completion {bool} -- block the request until every document is deleted (default: {True})
+            poll_task {bool} -- when not waiting for completion, poll the returned task until it finishes (default: {False})
+            poll_interval {float} -- seconds between task polls (default: {1.0})
+            max_wait {float} -- max seconds the task is polled for (default: {ES_TASK_MAX_WAIT})
+            missing_ok {bool} -- return the 404 response of a missing index, which has nothing to delete (default: {False})
+        
         Returns:
-            requests.Response -- http response
+            requests.Response -- delete by query http response, or the finished task response when polling
         """
 
-        res = self.search_document(body=body)
-        data = res.json()
-        if data["hits"]["total"] > 0:
-            pid_list = [document["_id"] for document in data["hits"]["hits"]]
-            return self.delete_document_bulk(pid_list=pid_list)
+        params = {
+            "slices" : slices,
+            "conflicts" : "proceed",
+            "wait_for_completion" : "true" if wait_for_completion else "false"
+        }
+        res = self._request("POST", f"/{self._index}/{self._doc_type}/_delete_by_query", params=params, json=body)
+        if missing_ok and HTTPStatus.NOT_FOUND == res.status_code:
+            return res
+        assert HTTPStatus.OK == res.status_code
+        if not wait_for_completion and poll_task:
+            return self.wait_for_task(res.json()["task"], poll_interval=poll_interval, max_wait=max_wait)
         return res
 
+    def wait_for_task(self, task_id : str, poll_interval : float = 1.0, max_wait : float = ES_TASK_MAX_WAIT) -> requests.Response:
+        """ Poll the tasks api until a background task completes
+        
+        Arguments:
+            task_id {str} -- task id in the form "node_id:task_number"
+        
+        Keyword Arguments:
+            poll_interval {float} -- seconds between polls (default: {1.0})
+            max_wait {float} -- max seconds to poll, a stuck or cancelled task raises TimeoutError after it (default: {ES_TASK_MAX_WAIT})
+        
+        Returns:
+            requests.Response -- task http response with the task result
+        """
+
+        started = time.monotonic()
+        while True:
+            res = self._request("GET", f"/_tasks/{task_id}")
+            assert HTTPStatus.OK == res.status_code
+            if res.json().get("completed"):
+                return res
+            if time.monotonic() - started + poll_interval > max_wait:
+                raise TimeoutError(f"Task {task_id} did not complete within {max_wait} seconds")
+            time.sleep(poll_interval)
+
+    def scan(self, body : dict = None, source : list = None, size : int = 500, scroll : str = "1m"):
+        """ Iterate over every queried document lazily using the scroll api
+        
+        Keyword Arguments:
+            body {dict} -- query body, every document is matched by default (default: {None})
+            source {list} -- list of _source fields to return, or False to skip the source (default: {None})
+            size {int} -- hits fetched per round trip (default: {500})
+            scroll {str} -- how long elasticsearch keeps the search context between round trips (default: {"1m"})
+        
+        Yields:
+            dict -- search hit with "_id" and "_source"
+        """
+
+        body = dict(body) if body is not None else {"query" : {"match_all" : {}}}
+        body["size"] = size
+        body.setdefault("sort", ["_doc"])
+        if source is not None:
+            body["_source"] = source
+
+        res = self._request("POST", f"/{self._index}/{self._doc_type}/_search", params={"scroll" : scroll}, json=body)
+        assert HTTPStatus.OK == res.status_code
+        data = res.json()
+        scroll_id = data.get("_scroll_id")
+        try:
+            while data["hits"]["hits"]:
+                for hit in data["hits"]["hits"]:
+                    yield hit
+                res = self._request("POST", "/_search/scroll", json={"scroll" : scroll, "scroll_id" : scroll_id})
+                assert HTTPStatus.OK == res.status_code
+                data = res.json()
+                scroll_id = data.get("_scroll_id", scroll_id)
+        finally:
+            if scroll_id:
+                self._request("DELETE", "/_search/scroll", json={"scroll_id" : [scroll_id]})
+
     def search_document(self, body : dict) -> requests.Response:
         """ Search document in elasticsearch
         
@@ -197,11 +634,11 @@ class ESClientBase:
             requests.Response -- search document http response
         """
 
-        res = requests.get(url=f"{self._es_endpoint}/{self._index}/{self._doc_type}/_search", json=body)
+        res = self._request("GET", f"/{self._index}/{self._doc_type}/_search", json=body)
         return res
     
     def query_all(self) -> requests.Response:
-        """ Select all elements in the index
+        """ Select all elements in the index, only the first page of hits is returned, use scan to iterate them all
         
         Returns:
             requests.Response -- search document http response
@@ -212,15 +649,16 @@ class ESClientBase:
                 "match_all" : {}
             }
         }
-        res = requests.get(url=f"{self._es_endpoint}/{self._index}/{self._doc_type}/_search", json=query_param)
+        res = self._request("GET", f"/{self._index}/{self._doc_type}/_search", json=query_param)
         assert HTTPStatus.OK == res.status_code
         return res
 
 class TextfileDocument(ESClientBase):
 
-    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1"):
+    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1", session : requests.Session = None, highlighter : str = ES_HIGHLIGHTER):
         
         self.aws_region = aws_region
+        self.highlighter = highlighter
 
         index = "textfilesearch"
         doc_type = "textfile"
@@ -238,18 +676,35 @@ class TextfileDocument(ESClientBase):
                 "filesize" : {
                     "type" : "integer"
                 },
-                "content" : {
+                "etag" : {
+                    "type" : "keyword"
+                },
+                "content" : highlighted_text_field(highlighter),
+                "entities" : {
+                    "properties" : {
+                        "type" : {
+                            "type" : "keyword"
+                        },
+                        "content" : {
+                            "type" : "text"
+                        }
+                    }
+                },
+                "keyphrases" : {
                     "type" : "text"
+                },
+                "sentiment" : {
+                    "type" : "keyword"
                 }
             }
         }
-        return super().__init__(host, port, index, doc_type, mapping)
+        return super().__init__(host, port, index, doc_type, mapping, session=session, settings=highlight_settings())
 
     def create_pid(self, s3_tuple : tuple) -> str:
         """ Get primary id from s3 bucket and object name
         
         Arguments:
-            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size)
+            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size[, object etag])
         
         Returns:
             str -- primary id
@@ -257,25 +712,32 @@ class TextfileDocument(ESClientBase):
 
         return "-".join(s3_tuple[:2])
 
-    def create_doc_entry(self, title : str, extension : str, s3_tuple : tuple, content : str) -> dict:
+    def create_doc_entry(self, title : str, extension : str, s3_tuple : tuple, content : str, enrichment : dict = None) -> dict:
         """ Create document entry
         
         Arguments:
             title {str} -- file title
             extension {str} -- file extension
-            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size)
+            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size[, object etag])
             content {str} -- document body
         
+        Keyword Arguments:
+            enrichment {dict} -- entities, keyphrases and sentiment fields from client_comprehend.enrich_texts (default: {None})
+        
         Returns:
             dict -- textfile document
         """
-        return {
+        document = {
             "title" : title,
             "extension" : extension,
             "filesize" : s3_tuple[2],
+            "etag" : get_etag(s3_tuple),
             "s3_url" : f"https://s3.amazonaws.com/{s3_tuple[0]}/{s3_tuple[1]}",
             "content" : content
         }
+        if enrichment:
+            document.update(enrichment)
+        return document
     
     def search_and_highlight_document(self, keywords : list, num_of_docs : int = 3, num_of_highlights : int = 3, highlight_fragment_size : int = 100) -> dict:
         """ Search document by keywords and returns searched highlights
@@ -324,7 +786,9 @@ class TextfileDocument(ESClientBase):
                 "number_of_fragments" : num_of_highlights,
                 "fragment_size" : highlight_fragment_size,
                 "fields" : {
-                    "content" : {}
+                    "content" : {
+                        "type" : self.highlighter
+                    }
                 }
             }
         }
@@ -335,7 +799,7 @@ class TextfileDocument(ESClientBase):
 
 class ImagefileDocument(ESClientBase):
 
-    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1"):
+    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1", session : requests.Session = None):
         self.aws_region = aws_region
 
         index = "imagefilesearch"
@@ -351,18 +815,21 @@ class ImagefileDocument(ESClientBase):
                 "filesize" : {
                     "type" : "integer"
                 },
+                "etag" : {
+                    "type" : "keyword"
+                },
                 "tags" : {
                     "type" : "text"
                 }
             }
         }
-        return super().__init__(host, port, index, doc_type, mapping)
+        return super().__init__(host, port, index, doc_type, mapping, session=session)
 
     def create_pid(self, s3_tuple : tuple) -> str:
         """ Get primary id from s3 bucket and object name
         
         Arguments:
-            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size)
+            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size[, object etag])
         
         Returns:
             str -- primary id
@@ -375,7 +842,7 @@ class ImagefileDocument(ESClientBase):
         
         Arguments:
             extension {str} -- file extension
-            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size)
+            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size[, object etag])
             image_labels {list} -- list of image labels
             image_texts {list} -- list of image texts
             celebrities {list} -- list of celebrities in image
@@ -390,6 +857,7 @@ class ImagefileDocument(ESClientBase):
         return {
             "extension" : extension,
             "filesize" : s3_tuple[2],
+            "etag" : get_etag(s3_tuple),
             "s3_url" : f"https://s3.amazonaws.com/{s3_tuple[0]}/{s3_tuple[1]}",
             "tags" : tags
         }
@@ -441,6 +909,140 @@ class ImagefileDocument(ESClientBase):
         })
         return res
 
+class TextfilePassageDocument(ESClientBase):
+
+    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1", session : requests.Session = None, highlighter : str = ES_HIGHLIGHTER):
+        self.aws_region = aws_region
+        self.highlighter = highlighter
+
+        index = "textfilepassages"
+        doc_type = "passage"
+        mapping = {
+            "properties" : {
+                "parent_id" : {
+                    "type" : "keyword"
+                },
+                "title" : {
+                    "type" : "text"
+                },
+                "extension" : {
+                    "type" : "keyword"
+                },
+                "s3_url" : {
+                    "type" : "text"
+                },
+                "page" : {
+                    "type" : "integer"
+                },
+                "offset" : {
+                    "type" : "integer"
+                },
+                "content" : highlighted_text_field(highlighter)
+            }
+        }
+        return super().__init__(host, port, index, doc_type, mapping, session=session, settings=highlight_settings())
+
+    def create_pid(self, parent_pid : str, passage_number : int) -> str:
+        """ Get primary id of a passage
+        
+        Arguments:
+            parent_pid {str} -- primary id of the textfile document
+            passage_number {int} -- position of the passage in the document
+        
+        Returns:
+            str -- primary id
+        """
+
+        return f"{parent_pid}#{passage_number}"
+
+    def create_doc_entries(self, parent_pid : str, title : str, extension : str, s3_tuple : tuple, passages : list) -> list:
+        """ Create the passage entries of a textfile document
+        
+        Arguments:
+            parent_pid {str} -- primary id of the textfile document
+            title {str} -- file title
+            extension {str} -- file extension
+            s3_tuple {tuple} -- tuple of (s3 bucket, object key, object size[, object etag])
+            passages {list} -- list of {"page", "offset", "content"} dictionaries
+        
+        Returns:
+            list -- list of (primary id, passage document)
+        """
+
+        s3_url = f"https://s3.amazonaws.com/{s3_tuple[0]}/{s3_tuple[1]}"
+        return [
+            (self.create_pid(parent_pid, passage_number), {
+                "parent_id" : parent_pid,
+                "title" : title,
+                "extension" : extension,
+                "s3_url" : s3_url,
+                "page" : passage["page"],
+                "offset" : passage["offset"],
+                "content" : passage["content"]
+            }) for passage_number, passage in enumerate(passages)
+        ]
+
+    def delete_passages(self, parent_pid_list : list) -> requests.Response:
+        """ Delete the passages of textfile documents, so that a re-indexed document keeps no stale passage
+        
+        Arguments:
+            parent_pid_list {list} -- primary ids of the textfile documents
+        
+        Returns:
+            requests.Response -- delete by query http response, a 404 response if the passage index does not exist yet
+        """
+
+        return self.delete_document_by_query(body={
+            "query" : {
+                "terms" : {
+                    "parent_id" : parent_pid_list
+                }
+            }
+        }, missing_ok=True)
+
+    def search_and_highlight_passages(self, keywords : list, num_of_docs : int = 3, num_of_highlights : int = 1, highlight_fragment_size : int = 100) -> requests.Response:
+        """ Search passages by keywords, keeping the best passage of each document, and returns searched highlights
+        
+        Arguments:
+            keywords {list} -- list of strings to be searched
+        
+        Keyword Arguments:
+            num_of_docs {int} -- max number of searched documents (default: {3})
+            num_of_highlights {int} -- number of highlight fragments (default: {1})
+            highlight_fragment_size {int} -- chars display per highlight fragment (default: {100})
+        
+        Returns:
+            requests.Response -- search response whose hits are the best passage of each document, with
+            "_source" holding parent_id, title, s3_url, page and "highlight" holding content fragments
+        """
+
+        body = {
+            "from" : 0,
+            "size" : num_of_docs,
+            "query" : {
+                "multi_match" : {
+                    "query" : " ".join(keywords),
+                    "fields" : ["content", "title"]
+                }
+            },
+            "collapse" : {
+                "field" : "parent_id"
+            },
+            "_source" : ["parent_id", "title", "extension", "s3_url", "page", "offset"],
+            "highlight" : {
+                "number_of_fragments" : num_of_highlights,
+                "fragment_size" : highlight_fragment_size,
+                "fields" : {
+                    "content" : {
+                        "type" : self.highlighter
+                    }
+                }
+            }
+        }
+
+        print(f"search and highlight passages using body: {body}")
+        return self.search_document(body=body)
+
 if __name__ == "__main__":
     tx = TextfileDocument()
     tx.put_index()
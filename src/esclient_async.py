@@ -0,0 +1,205 @@
+"""
+A module that exposes the elasticsearch clients as asyncio coroutines
+
+Requests are sent by the synchronous clients through the shared pooled session on a bounded
+thread executor, so several bulk chunks and searches can be in flight at once while the
+synchronous API stays unchanged for existing callers.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from esclient import ESClientBase, TextfileDocument, ImagefileDocument, get_session
+from esbulk import BulkSummary, iter_bulk_chunks
+from config import ES_POOL_MAXSIZE, ES_MAX_CONCURRENCY, ES_BULK_MAX_BYTES, ES_BULK_MAX_DOCS, ES_BULK_MAX_RETRIES, ES_BULK_BACKOFF
+
+# get_running_loop is only available from python 3.7, the python3.6 runtime falls back to the current loop
+get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+def run(coroutine):
+    """ Run a coroutine to completion on a fresh event loop
+    
+    Arguments:
+        coroutine {coroutine} -- coroutine to be run
+    
+    Returns:
+        object -- coroutine result
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class AsyncESClientBase:
+
+    def __init__(self, client : ESClientBase, max_concurrency : int = ES_MAX_CONCURRENCY):
+        self._client = client
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    @property
+    def client(self) -> ESClientBase:
+        return self._client
+
+    @property
+    def index(self):
+        return self._client.index
+
+    @property
+    def doc_type(self):
+        return self._client.doc_type
+
+    @property
+    def mapping(self):
+        return self._client.mapping
+
+    @property
+    def max_concurrency(self) -> int:
+        return self._max_concurrency
+
+    async def _run(self, func, *args, **kwargs):
+        """ Run a blocking client call on the executor
+        
+        Arguments:
+            func {callable} -- synchronous client method
+        
+        Returns:
+            object -- result of the call
+        """
+
+        return await get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        """ Shut down the executor once the in-flight calls finish """
+
+        self._executor.shutdown(wait=True)
+
+    async def put_index(self, ignore_exist_error=True) -> requests.Response:
+        return await self._run(self._client.put_index, ignore_exist_error=ignore_exist_error)
+
+    async def delete_index(self, ignore_nonexist_error=True) -> requests.Response:
+        return await self._run(self._client.delete_index, ignore_nonexist_error=ignore_nonexist_error)
+
+    async def put_mapping(self) -> requests.Response:
+        return await self._run(self._client.put_mapping)
+
+    async def ensure_index(self, force : bool = False) -> bool:
+        return await self._run(self._client.ensure_index, force=force)
+
+    async def get_document(self, pid : str) -> requests.Response:
+        return await self._run(self._client.get_document, pid)
+
+    async def put_document(self, pid : str, document : dict) -> requests.Response:
+        return await self._run(self._client.put_document, pid, document)
+
+    async def put_document_bulk(self, pid_list : list, document_list : list) -> requests.Response:
+        return await self._run(self._client.put_document_bulk, pid_list, document_list)
+
+    async def delete_document(self, pid : str, ignore_nonexist_error=True) -> requests.Response:
+        return await self._run(self._client.delete_document, pid, ignore_nonexist_error=ignore_nonexist_error)
+
+    async def delete_document_bulk(self, pid_list : list) -> requests.Response:
+        return await self._run(self._client.delete_document_bulk, pid_list)
+
+    async def delete_document_by_query(self, body : dict, **kwargs) -> requests.Response:
+        return await self._run(self._client.delete_document_by_query, body, **kwargs)
+
+    async def search_document(self, body : dict) -> requests.Response:
+        return await self._run(self._client.search_document, body)
+
+    async def query_all(self) -> requests.Response:
+        return await self._run(self._client.query_all)
+
+    async def put_document_stream(self, documents, op_type : str = "index", max_chunk_bytes : int = ES_BULK_MAX_BYTES, max_chunk_docs : int = ES_BULK_MAX_DOCS, max_retries : int = ES_BULK_MAX_RETRIES, backoff : float = ES_BULK_BACKOFF) -> BulkSummary:
+        """ Stream documents into elasticsearch keeping up to max_concurrency bulk chunks in flight
+        
+        The documents iterable is consumed on a producer thread, see put_action_stream.
+        
+        Arguments:
+            documents {iterable} -- iterable or generator of (primary id, document)
+        
+        Keyword Arguments:
+            op_type {str} -- bulk operation, "index" or "create" (default: {"index"})
+            max_chunk_bytes {int} -- max bytes per bulk request (default: {ES_BULK_MAX_BYTES})
+            max_chunk_docs {int} -- max documents per bulk request (default: {ES_BULK_MAX_DOCS})
+            max_retries {int} -- max number of retries for rejected items (default: {ES_BULK_MAX_RETRIES})
+            backoff {float} -- initial retry backoff in seconds (default: {ES_BULK_BACKOFF})
+        
+        Returns:
+            BulkSummary -- merged summary of every chunk
+        """
+
+        return await self.put_action_stream(self._client.iter_bulk_actions(documents, op_type), max_chunk_bytes=max_chunk_bytes, max_chunk_docs=max_chunk_docs, max_retries=max_retries, backoff=backoff)
+
+    async def put_action_stream(self, actions, max_chunk_bytes : int = ES_BULK_MAX_BYTES, max_chunk_docs : int = ES_BULK_MAX_DOCS, max_retries : int = ES_BULK_MAX_RETRIES, backoff : float = ES_BULK_BACKOFF) -> BulkSummary:
+        """ Stream already encoded bulk actions keeping up to max_concurrency bulk chunks in flight
+        
+        The actions are pulled one chunk at a time on a producer thread, so a blocking generator such as the
+        fetch and extract pipeline does not stall the event loop and the in-flight chunks. A new chunk is only
+        built once a slot is free, which keeps client memory bounded by the concurrency limit.
+        
+        Arguments:
+            actions {iterable} -- iterable of (primary id, encoded action bytes)
+        
+        Keyword Arguments:
+            max_chunk_bytes {int} -- max bytes per bulk request (default: {ES_BULK_MAX_BYTES})
+            max_chunk_docs {int} -- max documents per bulk request (default: {ES_BULK_MAX_DOCS})
+            max_retries {int} -- max number of retries for rejected items (default: {ES_BULK_MAX_RETRIES})
+            backoff {float} -- initial retry backoff in seconds (default: {ES_BULK_BACKOFF})
+        
+        Returns:
+            BulkSummary -- merged summary of every chunk
+        """
+
+        summary = BulkSummary()
+        pending = set()
+        chunks = iter_bulk_chunks(actions, max_chunk_bytes, max_chunk_docs)
+        with ThreadPoolExecutor(max_workers=1) as producer:
+            while True:
+                chunk = await get_running_loop().run_in_executor(producer, next, chunks, None)
+                if chunk is None:
+                    break
+                if len(pending) >= self._max_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        summary.merge(task.result())
+                pending.add(asyncio.ensure_future(self._run(self._client.submit_bulk_chunk, chunk, max_retries=max_retries, backoff=backoff)))
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            for task in done:
+                summary.merge(task.result())
+        return summary
+
+class AsyncTextfileDocument(AsyncESClientBase):
+
+    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1", max_concurrency : int = ES_MAX_CONCURRENCY):
+        client = TextfileDocument(host=host, port=port, aws_region=aws_region, session=get_session(pool_maxsize=max(ES_POOL_MAXSIZE, max_concurrency)))
+        super().__init__(client, max_concurrency=max_concurrency)
+
+    def create_pid(self, s3_tuple : tuple) -> str:
+        return self._client.create_pid(s3_tuple)
+
+    def create_doc_entry(self, *args, **kwargs) -> dict:
+        return self._client.create_doc_entry(*args, **kwargs)
+
+    async def search_and_highlight_document(self, keywords : list, num_of_docs : int = 3, num_of_highlights : int = 3, highlight_fragment_size : int = 100) -> requests.Response:
+        return await self._run(self._client.search_and_highlight_document, keywords, num_of_docs=num_of_docs, num_of_highlights=num_of_highlights, highlight_fragment_size=highlight_fragment_size)
+
+class AsyncImagefileDocument(AsyncESClientBase):
+
+    def __init__(self, host : str = "http://localhost", port : int = 9200, aws_region : str = "us-east-1", max_concurrency : int = ES_MAX_CONCURRENCY):
+        client = ImagefileDocument(host=host, port=port, aws_region=aws_region, session=get_session(pool_maxsize=max(ES_POOL_MAXSIZE, max_concurrency)))
+        super().__init__(client, max_concurrency=max_concurrency)
+
+    def create_pid(self, s3_tuple : tuple) -> str:
+        return self._client.create_pid(s3_tuple)
+
+    def create_doc_entry(self, *args, **kwargs) -> dict:
+        return self._client.create_doc_entry(*args, **kwargs)
+
+    async def search_document_by_tags(self, tag_list : list, num_of_docs : int = 3) -> requests.Response:
+        return await self._run(self._client.search_document_by_tags, tag_list, num_of_docs=num_of_docs)
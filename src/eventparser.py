@@ -0,0 +1,84 @@
+"""
+A module that parses the S3 notifications of lambda events in a single pass
+
+Only the SQS message bodies are decoded, every S3 record of a body is expanded and S3 test
+events are skipped, unlike decoder.deserialize_to_dict which walks and json decodes the whole event.
+"""
+import json
+from typing import NamedTuple
+from urllib.parse import unquote_plus
+
+class S3Record(NamedTuple):
+    """ An S3 object notification """
+
+    message_id : str
+    event_name : str
+    bucket : str
+    key : str
+    size : int
+    etag : str
+    sequencer : str
+
+    @property
+    def s3_tuple(self) -> tuple:
+        return (self.bucket, self.key, self.size, self.etag)
+
+    @property
+    def is_removed(self) -> bool:
+        return self.event_name.startswith("ObjectRemoved")
+
+def parse_s3_record(record : dict, message_id : str = None) -> S3Record:
+    """ Parse an S3 event notification record
+
+    Arguments:
+        record {dict} -- S3 event record
+
+    Keyword Arguments:
+        message_id {str} -- id of the SQS message carrying the record (default: {None})
+
+    Returns:
+        S3Record -- record, with the url encoded object key decoded
+    """
+
+    s3 = record["s3"]
+    s3_object = s3["object"]
+    return S3Record(
+        message_id=message_id,
+        event_name=record.get("eventName", "ObjectCreated:Put"),
+        bucket=s3["bucket"]["name"],
+        key=unquote_plus(s3_object["key"]),
+        size=s3_object.get("size", 0),
+        etag=s3_object.get("eTag"),
+        sequencer=s3_object.get("sequencer")
+    )
+
+def parse_sqs_message(record : dict) -> list:
+    """ Parse the S3 records of an SQS message, an S3 test event has none
+
+    Arguments:
+        record {dict} -- SQS event record
+
+    Returns:
+        list -- list of S3Record
+    """
+
+    body = record["body"]
+    if isinstance(body, str):
+        body = json.loads(body)
+    return [parse_s3_record(s3_record, message_id=record.get("messageId")) for s3_record in body.get("Records", [])]
+
+def iter_s3_records(event : dict):
+    """ Iterate the S3 records of an S3 or SQS lambda event
+
+    Arguments:
+        event {dict} -- lambda event
+
+    Yields:
+        S3Record -- record
+    """
+
+    for record in event["Records"]:
+        if "body" in record:
+            yield from parse_sqs_message(record)
+        elif "s3" in record:
+            yield parse_s3_record(record)
@@ -3,17 +3,148 @@ A module that extracts information from files
 """
 import logging
 import io
-import boto3
-import PyPDF2
+import os
+import codecs
+import tempfile
+import mimetypes
+import multiprocessing
+import threading
+import time
+
+from concurrency import ordered_map, prefetch, DeadlineReached
+from config import S3_FETCH_CONCURRENCY, S3_FETCH_BYTE_BUDGET
+from config import S3_READ_CHUNK_SIZE, S3_SPOOL_THRESHOLD, S3_MAX_OBJECT_BYTES, MAX_CONTENT_CHARS
+from config import PDF_PARALLEL_WORKERS, PDF_PARALLEL_MIN_PAGES, PDF_WORKER_TIMEOUT, PASSAGE_MAX_CHARS, PIPELINE_QUEUE_SIZE
 #import docx
 # TODO: docx is not working in lambda function because of the lxml import problem
-# TODO: move this file to deprecated and replace it with Amazon Textract
+# large or scanned documents are detected by Amazon Textract jobs instead, see client_textract
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.WARNING)
 
-s3 = boto3.client('s3')
+# boto3 and the format libraries are imported on first use, so a cold start only pays for what a batch needs
+s3 = None
+_s3_lock = threading.Lock()
+
+# extension -> extractor function, extension -> page extractor function, mime type -> extension, and (magic number, extension)
+_extractors = {}
+_page_extractors = {}
+_mime_types = {}
+_magic_numbers = []
+# extensions whose leading bytes can still be extracted when the rest of the file is cut off
+_truncatable_extensions = set()
+
+class UnsupportedFileTypeError(ValueError):
+    pass
+
+class ObjectTooLargeError(ValueError):
+    pass
+
+def get_s3_client():
+    """Get the S3 client, creating it on first use
+    
+    Returns:
+        botocore.client.S3 -- S3 client
+    """
+    global s3
+    with _s3_lock:
+        if s3 is None:
+            import boto3
+            from botocore.config import Config
+            s3 = boto3.client('s3', config=Config(max_pool_connections=max(10, S3_FETCH_CONCURRENCY)))
+    return s3
+
+def load_pypdf2():
+    """Import PyPDF2 on first use
+    
+    Returns:
+        module -- PyPDF2 module
+    """
+    import PyPDF2
+    return PyPDF2
+
+def register_extractor(extensions : list, mime_types : list = (), magic : bytes = None, truncatable : bool = False):
+    """Register a function extracting text from binary data for file extensions
+    
+    Arguments:
+        extensions {list} -- lower case file extensions
+    
+    Keyword Arguments:
+        mime_types {list} -- mime types mapped to the first extension (default: {()})
+        magic {bytes} -- leading bytes identifying the format when the extension is unknown (default: {None})
+        truncatable {bool} -- the format can be extracted from the first bytes of a file, so large files are cut off instead of skipped (default: {False})
+    
+    Returns:
+        callable -- decorator registering the extractor
+    """
+    def decorator(func):
+        for extension in extensions:
+            _extractors[extension] = func
+        for mime_type in mime_types:
+            _mime_types[mime_type] = extensions[0]
+        if magic is not None:
+            _magic_numbers.append((magic, extensions[0]))
+        if truncatable:
+            _truncatable_extensions.update(extensions)
+        return func
+    return decorator
+
+def register_page_extractor(extensions : list):
+    """Register a function extracting the text of each page from binary data, for paged formats
+    
+    Arguments:
+        extensions {list} -- lower case file extensions
+    
+    Returns:
+        callable -- decorator registering the page extractor
+    """
+    def decorator(func):
+        for extension in extensions:
+            _page_extractors[extension] = func
+        return func
+    return decorator
+
+def supported_extensions() -> set:
+    """Get the file extensions that have a registered extractor
+    
+    Returns:
+        set -- set of extensions
+    """
+    return set(_extractors)
+
+def is_truncatable(extension : str) -> bool:
+    """Check whether the text of a file can be extracted from its first bytes
+    
+    Arguments:
+        extension {str} -- file extension
+    
+    Returns:
+        bool -- a cut off file of this extension is still readable
+    """
+    return extension.lower() in _truncatable_extensions
+
+def sniff_extension(binary_data : io.BytesIO, filename : str = None) -> str:
+    """Guess the extension of a file from its leading bytes, or from the mime type of its name
+    
+    Arguments:
+        binary_data {io.BytesIO} -- seekable binary file object, its position is restored
+    
+    Keyword Arguments:
+        filename {str} -- file name (default: {None})
+    
+    Returns:
+        str -- registered extension, or None
+    """
+    position = binary_data.tell()
+    head = binary_data.read(max([len(magic) for magic, extension in _magic_numbers] or [0]))
+    binary_data.seek(position)
+    for magic, extension in _magic_numbers:
+        if head.startswith(magic):
+            return extension
+    if filename is not None:
+        return _mime_types.get(mimetypes.guess_type(filename)[0])
+    return None
 
 def get_pdf_text_from_path(filepath : str) -> str:
     """Extract text in a pdf file
@@ -25,29 +156,56 @@ def get_pdf_text_from_path(filepath : str) -> str:
         str -- text in the pdf file
     """
     with open(filepath, 'rb') as file_obj:
-        reader = PyPDF2.PdfFileReader(file_obj)
+        reader = load_pypdf2().PdfFileReader(file_obj)
         text = []
         for i in range(reader.numPages):
             page_obj = reader.getPage(i)
             text.append(page_obj.extractText())
         return "\n".join(text).strip()
 
-def get_pdf_text_from_binary_data(binary_data : io.BytesIO) -> str:
+@register_page_extractor(["pdf"])
+def get_pdf_pages_from_binary_data(binary_data : io.BytesIO, start : int = 0, stop : int = None, max_chars : int = MAX_CONTENT_CHARS) -> list:
+    """Extract the text of every page, or of a range of pages, in a pdf file given byte streams
+    
+    Arguments:
+        binary_data {io.BytesIO} -- pdf content in bytes, or any seekable binary file object
+    
+    Keyword Arguments:
+        start {int} -- first page index (default: {0})
+        stop {int} -- page index after the last page, the page count if None (default: {None})
+        max_chars {int} -- stop extracting pages once this many characters are read, unlimited if 0 (default: {MAX_CONTENT_CHARS})
+    
+    Returns:
+        list -- text of each page
+    """
+    reader = load_pypdf2().PdfFileReader(binary_data)
+    stop = reader.numPages if stop is None else stop
+    pages = []
+    num_of_chars = 0
+    for i in range(start, stop):
+        pages.append(reader.getPage(i).extractText())
+        num_of_chars += len(pages[-1]) + 1
+        if max_chars and num_of_chars >= max_chars:
+            logger.warning(f"Truncating pdf text after page {i + 1} of {reader.numPages}")
+            break
+    return pages
+
+@register_extractor(["pdf"], mime_types=["application/pdf"], magic=b"%PDF-")
+def get_pdf_text_from_binary_data(binary_data : io.BytesIO, max_chars : int = MAX_CONTENT_CHARS) -> str:
     """Extract text in a pdf file given byte streams
     
     Arguments:
-        binary_data {io.BytesIO} -- pdf content in bytes
+        binary_data {io.BytesIO} -- pdf content in bytes, or any seekable binary file object
+    
+    Keyword Arguments:
+        max_chars {int} -- stop extracting pages once this many characters are read, unlimited if 0 (default: {MAX_CONTENT_CHARS})
     
     Returns:
         str -- text in the pdf file
     """
     try:
-        reader = PyPDF2.PdfFileReader(binary_data)
-        text = []
-        for i in range(reader.numPages):
-            page_obj = reader.getPage(i)
-            text.append(page_obj.extractText())
-        return "\n".join(text).strip()
+        text = "\n".join(get_pdf_pages_from_binary_data(binary_data, max_chars=max_chars))
+        return (text[:max_chars] if max_chars else text).strip()
     except Exception as e:
         logger.error(e)
         raise e
@@ -95,17 +253,38 @@ def get_txt_text_from_path(filepath : str) -> str:
         text = f.read()
     return text.strip()
 
-def get_txt_text_from_binary_data(binary_data : io.BytesIO) -> str:
-    """Extract text in a txt file from binary data
+@register_extractor(["txt"], mime_types=["text/plain"], truncatable=True)
+def get_txt_text_from_binary_data(binary_data : io.BytesIO, max_chars : int = MAX_CONTENT_CHARS, chunk_size : int = S3_READ_CHUNK_SIZE) -> str:
+    """Extract text in a txt file from binary data, decoding it incrementally chunk by chunk
     
     Arguments:
-        binary_data {io.BytesIO} -- txt content in bytes
+        binary_data {io.BytesIO} -- txt content in bytes, or any binary file object
+    
+    Keyword Arguments:
+        max_chars {int} -- stop decoding once this many characters are read, unlimited if 0 (default: {MAX_CONTENT_CHARS})
+        chunk_size {int} -- bytes decoded at a time (default: {S3_READ_CHUNK_SIZE})
     
     Returns:
-        str -- text in the txt file
+        str -- text in the txt file, invalid UTF-8 sequences are replaced
     """
     try:
-        return binary_data.read().decode("UTF-8").strip()
+        decoder = codecs.getincrementaldecoder("UTF-8")(errors="replace")
+        text = []
+        num_of_chars = 0
+        while True:
+            chunk = binary_data.read(chunk_size)
+            if not chunk:
+                # an incomplete trailing sequence comes from a truncated download, drop it
+                if decoder.getstate()[0]:
+                    logger.warning("Dropping incomplete UTF-8 sequence at the end of txt data")
+                break
+            text.append(decoder.decode(chunk))
+            num_of_chars += len(text[-1])
+            if max_chars and num_of_chars >= max_chars:
+                logger.warning(f"Truncating txt text after {num_of_chars} characters")
+                break
+        text = "".join(text)
+        return (text[:max_chars] if max_chars else text).strip()
     except Exception as e:
         logger.error(e)
         raise e
@@ -120,46 +299,440 @@ def get_file_text_from_path(filepath : str) -> str:
         str -- text in the text file
     """
     extension = filepath.split('.')[-1]
-    if extension == 'pdf':
-        return get_pdf_text_from_path(filepath)
-    # elif extension == 'docx':
-    #     return get_docx_text_from_path(filepath)
-    elif extension == 'txt':
-        return get_txt_text_from_path(filepath)
+    with open(filepath, 'rb') as binary_data:
+        return get_file_text_from_binary_data(extension, binary_data, filename=os.path.basename(filepath))
 
-def get_file_text_from_binary_data(extension : str, binary_data : io.BytesIO) -> str:
-    """Extract the text from a text file given its binary data
+def get_file_extension(extension : str, binary_data : io.BytesIO, filename : str = None) -> str:
+    """Get the registered extension of a file, sniffing its content when the given extension is not registered
+    
+    Arguments:
+        extension {str} -- file extension
+        binary_data {io.BytesIO} -- seekable binary file object
+    
+    Keyword Arguments:
+        filename {str} -- file name used to sniff the mime type (default: {None})
+    
+    Raises:
+        UnsupportedFileTypeError -- no extractor is registered for the file
+    
+    Returns:
+        str -- registered extension
+    """
+    extension = (extension or "").lower()
+    if extension not in _extractors:
+        extension = sniff_extension(binary_data, filename=filename)
+    if extension not in _extractors:
+        raise UnsupportedFileTypeError(f"No text extractor for extension {extension}")
+    return extension
+
+def get_file_text_from_binary_data(extension : str, binary_data : io.BytesIO, filename : str = None) -> str:
+    """Extract the text from a text file given its binary data, using the extractor registered for its extension
     
     Arguments:
         extension {str} -- file extension
         binary_data {io.BytesIO} -- text content in binary format
     
+    Keyword Arguments:
+        filename {str} -- file name used to sniff the mime type when the extension is not registered (default: {None})
+    
+    Raises:
+        UnsupportedFileTypeError -- no extractor is registered for the file
+    
     Returns:
         str -- text in the text file
     """
-    if extension == 'pdf':
-        return get_pdf_text_from_binary_data(binary_data)
-    # elif extension == 'docx':
-    #     return get_docx_text_from_binary_data(binary_data)
-    elif extension == 'txt':
-        return get_txt_text_from_binary_data(binary_data)
+    return _extractors[get_file_extension(extension, binary_data, filename=filename)](binary_data)
 
-def get_binary_data_from_file_in_s3(bucket : str, key : str) -> io.BytesIO:
-    """Extract binary data from file in an S3 bucket
+def get_file_pages_from_binary_data(extension : str, binary_data : io.BytesIO, filename : str = None) -> list:
+    """Extract the text of each page of a file, a file without pages is a single page
+    
+    Arguments:
+        extension {str} -- file extension
+        binary_data {io.BytesIO} -- text content in binary format
+    
+    Keyword Arguments:
+        filename {str} -- file name used to sniff the mime type when the extension is not registered (default: {None})
+    
+    Returns:
+        list -- text of each page
+    """
+    extension = get_file_extension(extension, binary_data, filename=filename)
+    if extension in _page_extractors:
+        return _page_extractors[extension](binary_data)
+    return [_extractors[extension](binary_data)]
+
+def split_into_passages(pages : list, max_chars : int = PASSAGE_MAX_CHARS) -> list:
+    """Split the pages of a document into passages of at most max_chars, cutting at whitespace when possible
+    
+    Arguments:
+        pages {list} -- text of each page
+    
+    Keyword Arguments:
+        max_chars {int} -- max characters per passage (default: {PASSAGE_MAX_CHARS})
+    
+    Returns:
+        list -- list of passages in the form
+        [
+            {
+                "page" : 1-based page number,
+                "offset" : character offset in the pages joined by new lines,
+                "content" : passage text
+            },
+            ...
+        ]
+    """
+    passages = []
+    page_offset = 0
+    for page_number, page in enumerate(pages, start=1):
+        start = 0
+        while start < len(page) and page[start].isspace():
+            start += 1
+        while start < len(page):
+            stop = min(start + max_chars, len(page))
+            if stop < len(page):
+                cut = max(page.rfind(" ", start + 1, stop + 1), page.rfind("\n", start + 1, stop + 1))
+                if cut > start:
+                    stop = cut
+            content = page[start:stop].rstrip()
+            if content:
+                passages.append({
+                    "page" : page_number,
+                    "offset" : page_offset + start,
+                    "content" : content
+                })
+            # the next passage starts at the next word
+            start = stop
+            while start < len(page) and page[start].isspace():
+                start += 1
+        page_offset += len(page) + 1
+    return passages
+
+def get_binary_data_from_file_in_s3(bucket : str, key : str, spool_threshold : int = S3_SPOOL_THRESHOLD, max_bytes : int = S3_MAX_OBJECT_BYTES, chunk_size : int = S3_READ_CHUNK_SIZE) -> tempfile.SpooledTemporaryFile:
+    """Stream a file in an S3 bucket into a spooled buffer that spills to a temporary file when large
+    
+    Only truncatable formats such as txt are cut off at max_bytes, a larger file of any other format
+    raises ObjectTooLargeError, because its first bytes alone, e.g. a pdf without its trailer, cannot be parsed.
     
     Arguments:
         bucket {str} -- S3 Bucket Name
         key {str} -- File Key
     
+    Keyword Arguments:
+        spool_threshold {int} -- bytes kept in memory before spilling to disk (default: {S3_SPOOL_THRESHOLD})
+        max_bytes {int} -- largest file read, unlimited if 0 (default: {S3_MAX_OBJECT_BYTES})
+        chunk_size {int} -- bytes read from the response body at a time (default: {S3_READ_CHUNK_SIZE})
+    
     Returns:
-        io.BytesIO -- binary data of the file
+        tempfile.SpooledTemporaryFile -- binary file object positioned at the start, to be closed by the caller
     """
 
+    binary_data = None
     try:
-        response = s3.get_object(Bucket=bucket, Key=key)
-        s3_file_content = response['Body'].read()
-        return io.BytesIO(s3_file_content)
+        response = get_s3_client().get_object(Bucket=bucket, Key=key)
+        body = response['Body']
+        if max_bytes and response.get('ContentLength', 0) > max_bytes and not is_truncatable(key.split('.')[-1]):
+            body.close()
+            raise ObjectTooLargeError(f"{response['ContentLength']} bytes exceed the limit of {max_bytes} bytes")
+        binary_data = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        num_of_bytes = 0
+        while True:
+            chunk = body.read(chunk_size if not max_bytes else min(chunk_size, max_bytes - num_of_bytes))
+            if not chunk:
+                break
+            binary_data.write(chunk)
+            num_of_bytes += len(chunk)
+            if max_bytes and num_of_bytes >= max_bytes:
+                logger.warning(f"Truncating bucket {bucket} key {key} after {num_of_bytes} bytes")
+                break
+        body.close()
+        binary_data.seek(0)
+        return binary_data
     except Exception as e:
+        if binary_data is not None:
+            binary_data.close()
         logger.error(f"Unable to read from bucket and {bucket} key {key}")
         logger.error(e)
         raise e
+
+def iter_binary_data_from_files_in_s3(s3_tuple_list : list, max_workers : int = S3_FETCH_CONCURRENCY, byte_budget : int = S3_FETCH_BYTE_BUDGET):
+    """Download files from S3 concurrently and yield them in the order of the list
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples in the form (s3 bucket, s3 object key, object size)
+    
+    Keyword Arguments:
+        max_workers {int} -- max number of concurrent downloads (default: {S3_FETCH_CONCURRENCY})
+        byte_budget {int} -- max bytes downloaded ahead of the consumer (default: {S3_FETCH_BYTE_BUDGET})
+    
+    Yields:
+        tuple -- (s3_tuple, binary data of the file), or (s3_tuple, exception) if the file could not be read, e.g. it was deleted meanwhile
+    """
+
+    def fetch(s3_tuple : tuple) -> tuple:
+        try:
+            return s3_tuple, get_binary_data_from_file_in_s3(bucket=s3_tuple[0], key=s3_tuple[1])
+        except Exception as e:
+            return s3_tuple, e
+
+    return ordered_map(fetch, s3_tuple_list, max_workers=max_workers, weight=lambda s3_tuple: s3_tuple[2], budget=byte_budget)
+
+
+def get_cpu_count() -> int:
+    """Get the number of vCPUs available to this process
+    
+    Returns:
+        int -- number of usable cpus
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+class _PositionalReader(io.RawIOBase):
+    """Read-only view of a file descriptor with its own offset, forked workers share the descriptor of a spilled spooled file but not its offset"""
+
+    def __init__(self, fd : int):
+        self._fd = fd
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = os.pread(self._fd, len(buffer), self._position)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset : int, whence : int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += os.fstat(self._fd).st_size
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+def _open_inherited(binary_data):
+    """Open a binary file object inherited from the parent process, reading a file on disk without its shared offset"""
+    # a spooled temporary file keeps a BytesIO until it spills to a temporary file
+    buffer = getattr(binary_data, "_file", binary_data)
+    if isinstance(buffer, io.BytesIO):
+        return buffer
+    return io.BufferedReader(_PositionalReader(buffer.fileno()))
+
+def _extract_unit(extension : str, binary_data, page_range : tuple) -> list:
+    """Extract the pages of a work unit from a seekable binary file object"""
+    binary_data.seek(0)
+    if page_range is not None:
+        return get_pdf_pages_from_binary_data(binary_data, *page_range, max_chars=0)
+    return get_file_pages_from_binary_data(extension, binary_data)
+
+def _extract_units_in_process(units : list, open_binary_data=lambda binary_data: binary_data) -> list:
+    """Extract every (unit id, extension, binary data, page range) unit, returning (unit id, pages, error) tuples"""
+    results = []
+    for unit_id, extension, binary_data, page_range in units:
+        try:
+            results.append((unit_id, _extract_unit(extension, open_binary_data(binary_data), page_range), None))
+        except Exception as e:
+            results.append((unit_id, None, f"{type(e).__name__}: {e}"))
+    return results
+
+def _extract_units(conn, units : list):
+    """Worker process entry point, extracts every unit and sends back (unit id, pages, error) tuples"""
+    conn.send(_extract_units_in_process(units, _open_inherited))
+    conn.close()
+
+def _split_into_units(extension_list : list, binary_data_list : list, num_of_workers : int, min_parallel_pages : int) -> list:
+    """Split files into work units, page ranges for large pdfs and whole files otherwise
+    
+    Returns:
+        list -- list of (unit id, extension, binary data, page range or None, estimated pages), unit id is (file index, range index)
+    """
+    units = []
+    for file_index, (extension, binary_data) in enumerate(zip(extension_list, binary_data_list)):
+        num_of_pages = 1
+        if extension == 'pdf':
+            try:
+                binary_data.seek(0)
+                num_of_pages = load_pypdf2().PdfFileReader(binary_data).numPages
+            except Exception:
+                # let the worker raise the parsing error for this file
+                pass
+        if extension != 'pdf' or num_of_pages < min_parallel_pages:
+            units.append(((file_index, 0), extension, binary_data, None, num_of_pages))
+            continue
+        pages_per_unit = -(-num_of_pages // num_of_workers)
+        for range_index, start in enumerate(range(0, num_of_pages, pages_per_unit)):
+            stop = min(start + pages_per_unit, num_of_pages)
+            units.append(((file_index, range_index), extension, binary_data, (start, stop), stop - start))
+    return units
+
+def get_file_texts_from_binary_data_list(extension_list : list, binary_data_list : list, max_workers : int = PDF_PARALLEL_WORKERS, min_parallel_pages : int = PDF_PARALLEL_MIN_PAGES, max_chars : int = MAX_CONTENT_CHARS, return_exceptions : bool = False, keep_pages : bool = False, timeout : float = PDF_WORKER_TIMEOUT) -> list:
+    """Extract the text of many files on a pool of worker processes, splitting large pdfs into page ranges
+    
+    Worker processes talk over pipes since multiprocessing queues and pools need /dev/shm, which lambda does
+    not provide. Files are extracted in this process when there is a single vCPU, too little work to pay
+    for the worker start-up, or no fork start method. The file objects are read in place, so a spooled
+    file that spilled to disk is never loaded into memory as a whole, and forked workers inherit them.
+    Workers are only forked while this is the only thread, since a lock held by another thread, e.g.
+    the logging lock on python 3.6, stays locked forever in the child. A worker that does not answer
+    within the timeout is terminated and its units are extracted in this process.
+    
+    Arguments:
+        extension_list {list} -- list of file extensions
+        binary_data_list {list} -- list of seekable binary file objects, e.g. from get_binary_data_from_file_in_s3
+    
+    Keyword Arguments:
+        max_workers {int} -- number of worker processes, the number of vCPUs if 0 (default: {PDF_PARALLEL_WORKERS})
+        min_parallel_pages {int} -- pdfs with at least this many pages are split into page ranges (default: {PDF_PARALLEL_MIN_PAGES})
+        max_chars {int} -- max characters kept per file, unlimited if 0 (default: {MAX_CONTENT_CHARS})
+        return_exceptions {bool} -- return an exception in place of the text of a failed file instead of raising it (default: {False})
+        keep_pages {bool} -- return the list of page texts of each file instead of its whole text (default: {False})
+        timeout {float} -- seconds to wait for the workers to answer (default: {PDF_WORKER_TIMEOUT})
+    
+    Returns:
+        list -- list of text, or of page text lists, in the order of the files
+    """
+    num_of_workers = max_workers or get_cpu_count()
+    if "fork" not in multiprocessing.get_all_start_methods() or threading.active_count() > 1:
+        num_of_workers = 1
+    units = _split_into_units(extension_list, binary_data_list, num_of_workers, min_parallel_pages)
+    num_of_workers = min(num_of_workers, len(units))
+
+    if num_of_workers <= 1 or sum(unit[4] for unit in units) < min_parallel_pages:
+        results = _extract_units_in_process([unit[:4] for unit in units])
+    else:
+        # longest units first, each to the least loaded worker
+        assignments = [[] for _ in range(num_of_workers)]
+        loads = [0] * num_of_workers
+        for unit in sorted(units, key=lambda unit: unit[4], reverse=True):
+            worker = loads.index(min(loads))
+            assignments[worker].append(unit[:4])
+            loads[worker] += unit[4]
+
+        # the workers read the files written so far through the inherited descriptors
+        for binary_data in binary_data_list:
+            binary_data.flush()
+        context = multiprocessing.get_context("fork")
+        workers = []
+        for assigned_units in assignments:
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=_extract_units, args=(child_conn, assigned_units), daemon=True)
+            process.start()
+            child_conn.close()
+            workers.append((process, parent_conn))
+        results = []
+        stop_time = time.monotonic() + timeout
+        for assigned_units, (process, parent_conn) in zip(assignments, workers):
+            try:
+                if not parent_conn.poll(max(0, stop_time - time.monotonic())):
+                    logger.warning(f"Extraction worker {process.pid} did not answer within {timeout}s, extracting its units in process")
+                    process.terminate()
+                    results.extend(_extract_units_in_process(assigned_units))
+                else:
+                    results.extend(parent_conn.recv())
+            except EOFError:
+                results.extend((unit[0], None, "worker process exited unexpectedly") for unit in assigned_units)
+            parent_conn.close()
+            process.join()
+
+    file_pages = [[] for _ in binary_data_list]
+    errors = [None] * len(binary_data_list)
+    for (file_index, range_index), pages, error in sorted(results, key=lambda result: result[0]):
+        if error is not None:
+            errors[file_index] = errors[file_index] or error
+        else:
+            file_pages[file_index].extend(pages)
+
+    output = []
+    for extension, pages, error in zip(extension_list, file_pages, errors):
+        if error is not None:
+            exception = ValueError(f"Unable to extract {extension} text: {error}")
+            if not return_exceptions:
+                raise exception
+            output.append(exception)
+        elif keep_pages:
+            output.append(truncate_pages(pages, max_chars))
+        else:
+            text = "\n".join(pages)
+            output.append((text[:max_chars] if max_chars else text).strip())
+    return output
+
+def truncate_pages(pages : list, max_chars : int) -> list:
+    """Drop the page text beyond max_chars, counting a new line between pages
+    
+    Arguments:
+        pages {list} -- text of each page
+        max_chars {int} -- max characters kept, unlimited if 0
+    
+    Returns:
+        list -- text of each kept page
+    """
+    if not max_chars:
+        return pages
+    kept = []
+    remaining = max_chars
+    for page in pages:
+        if remaining <= 0:
+            break
+        kept.append(page[:remaining])
+        remaining -= len(page) + 1
+    return kept
+
+def iter_file_texts_from_s3(s3_tuple_list : list, window : int = None, keep_pages : bool = False, queue_size : int = PIPELINE_QUEUE_SIZE, deadline=None):
+    """Download files from S3 concurrently and extract their text in windows spread over the worker processes
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples in the form (s3 bucket, s3 object key, object size)
+    
+    Keyword Arguments:
+        window {int} -- number of downloaded files extracted together, the number of workers if None (default: {None})
+        keep_pages {bool} -- yield the list of page texts instead of the whole text (default: {False})
+        queue_size {int} -- downloaded files buffered while a window is extracted, downloads pause during extraction if 0 (default: {PIPELINE_QUEUE_SIZE})
+        deadline {concurrency.Deadline} -- once reached no further window is extracted and the downloads stop (default: {None})
+    
+    Yields:
+        tuple -- (s3_tuple, text) in the order of the list, text is an exception if the file could not be downloaded or extracted,
+        or DeadlineReached for every file left unextracted at the deadline
+    """
+    s3_tuple_list = list(s3_tuple_list)
+    window = window or PDF_PARALLEL_WORKERS or get_cpu_count()
+    batch = []
+    num_of_yielded = 0
+    fetched = iter_binary_data_from_files_in_s3(s3_tuple_list)
+    if queue_size > 0:
+        fetched = prefetch(fetched, queue_size)
+    while True:
+        item = next(fetched, None)
+        if item is not None:
+            batch.append(item)
+        if batch and (item is None or len(batch) >= window) and deadline is not None and deadline.reached():
+            if hasattr(fetched, "close"):
+                fetched.close()
+            for s3_tuple, binary_data in batch:
+                if not isinstance(binary_data, Exception):
+                    binary_data.close()
+            logger.warning(f"Deadline reached, leaving {len(s3_tuple_list) - num_of_yielded} files unextracted")
+            for s3_tuple in s3_tuple_list[num_of_yielded:]:
+                yield s3_tuple, DeadlineReached()
+            return
+        if batch and (item is None or len(batch) >= window):
+            fetched_batch = [(s3_tuple, binary_data) for s3_tuple, binary_data in batch if not isinstance(binary_data, Exception)]
+            extension_list = [s3_tuple[1].split('.')[-1] for s3_tuple, binary_data in fetched_batch]
+            try:
+                text_list = iter(get_file_texts_from_binary_data_list(extension_list, [binary_data for s3_tuple, binary_data in fetched_batch], return_exceptions=True, keep_pages=keep_pages))
+            finally:
+                for s3_tuple, binary_data in fetched_batch:
+                    binary_data.close()
+            for s3_tuple, binary_data in batch:
+                # a file that could not be downloaded keeps its place with the download error
+                yield s3_tuple, binary_data if isinstance(binary_data, Exception) else next(text_list)
+                num_of_yielded += 1
+            batch = []
+        if item is None:
+            return
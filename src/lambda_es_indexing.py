@@ -1,111 +1,887 @@
 """
 A lambda function that detects S3 put event and index information into elasticsearch
 """
-from decoder import deserialize_to_dict
-from fileprocess import get_binary_data_from_file_in_s3, get_file_text_from_binary_data
-from esclient import TextfileDocument, ImagefileDocument
-from client_rekognition import detect_labels, detect_text, recognize_celebrities
+from eventparser import iter_s3_records, parse_sqs_message, S3Record
+from fileprocess import iter_file_texts_from_s3, supported_extensions, split_into_passages, truncate_pages, is_truncatable
+from esclient import ESClientBase, TextfileDocument, TextfilePassageDocument, ImagefileDocument, get_etag
+from cache import TTLCache
+from esbulk import BulkSummary
+from esclient_async import AsyncESClientBase, run
+from client_rekognition import iter_image_analyses
+from concurrency import ordered_map, prefetch, Deadline, DeadlineReached
+from client_comprehend import enrich_texts, BATCH_MAX_DOCUMENTS, BATCH_MAX_DOCUMENT_BYTES
+from client_textract import start_text_detection, get_text_detection_pages, parse_completion_record, SUCCEEDED_STATUSES
 
-from config import ES_HOST, ES_PORT, AWS_DEFAULT_REGION
+from config import ES_HOST, ES_PORT, AWS_DEFAULT_REGION, ETAG_CACHE_MAXSIZE, ETAG_CACHE_TTL
+from config import TEXTFILE_PASSAGE_MODE, PASSAGE_DELETE_BATCH_SIZE, COMPREHEND_ENRICHMENT, MAX_CONTENT_CHARS, PIPELINE_QUEUE_SIZE
+from config import TEXTRACT_SNS_TOPIC_ARN, TEXTRACT_EXTENSIONS, TEXTRACT_MIN_BYTES
+from config import REKOGNITION_CONCURRENCY, LAMBDA_DEADLINE_MARGIN_MS, S3_MAX_OBJECT_BYTES
 from http import HTTPStatus
 
-supported_textfile_types = set(['pdf', 'txt'])
+supported_textfile_types = supported_extensions()
+if TEXTRACT_SNS_TOPIC_ARN:
+    supported_textfile_types |= TEXTRACT_EXTENSIONS
 supported_imagefile_types = set(['jpg', 'jpeg', 'png', 'bmp', 'gif'])
 
 es_tx = TextfileDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
 es_im = ImagefileDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
+es_psg = TextfilePassageDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
+es_tx_async = AsyncESClientBase(es_tx)
+es_im_async = AsyncESClientBase(es_im)
 
-def dispatcher(s3_tuple_list : list) -> dict:
-    """ Dispatch the lambda handler
+# (index, pid) -> (etag, size) of the objects indexed by this container
+etag_cache = TTLCache(maxsize=ETAG_CACHE_MAXSIZE, ttl=ETAG_CACHE_TTL)
+
+def filter_changed_s3_tuples(es_client : ESClientBase, s3_tuple_list : list, new_pids : set = None) -> list:
+    """ Drop the objects whose etag and size match the indexed document
+    
+    The warm container cache is checked first, the remaining objects are looked up with a single _mget.
+    Objects without an etag are always kept.
     
     Arguments:
-        s3_tuple_list {list} -- list of tuples of in the form (s3_bucket_name, s3_key_name, s3_object_size)
+        es_client {ESClientBase} -- elasticsearch client of the index
+        s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size, s3_object_etag)
+    
+    Keyword Arguments:
+        new_pids {set} -- collects the primary ids the _mget found no document for (default: {None})
     
     Returns:
-        dict -- dictionary of http response
+        list -- list of changed s3 tuples, in order
+    """
+
+    unchanged = set()
+    lookup = {}
+    for s3_tuple in s3_tuple_list:
+        etag = get_etag(s3_tuple)
+        if etag is None:
+            continue
+        pid = es_client.create_pid(s3_tuple)
+        if etag_cache.get((es_client.index, pid)) == (etag, s3_tuple[2]):
+            unchanged.add(pid)
+        else:
+            lookup[pid] = s3_tuple
+
+    sources = es_client.get_document_sources(list(lookup), fields=["etag", "filesize"])
+    if new_pids is not None:
+        new_pids.update(pid for pid in lookup if pid not in sources)
+    for pid, source in sources.items():
+        s3_tuple = lookup[pid]
+        if (source.get("etag"), source.get("filesize")) == (get_etag(s3_tuple), s3_tuple[2]):
+            etag_cache.set((es_client.index, pid), (get_etag(s3_tuple), s3_tuple[2]))
+            unchanged.add(pid)
+
+    if unchanged:
+        print(f"Skipping {len(unchanged)} unchanged objects in {es_client.index}")
+    return [s3_tuple for s3_tuple in s3_tuple_list if es_client.create_pid(s3_tuple) not in unchanged]
+
+def remember_etags(es_client : ESClientBase, s3_tuple_list : list, failed_pids : list):
+    """ Cache the etag of every object that was indexed successfully
+    
+    Arguments:
+        es_client {ESClientBase} -- elasticsearch client of the index
+        s3_tuple_list {list} -- list of indexed s3 tuples
+        failed_pids {list} -- primary ids that failed to be indexed
+    """
+
+    failed_pids = set(failed_pids)
+    for s3_tuple in s3_tuple_list:
+        pid = es_client.create_pid(s3_tuple)
+        if get_etag(s3_tuple) is not None and pid not in failed_pids:
+            etag_cache.set((es_client.index, pid), (get_etag(s3_tuple), s3_tuple[2]))
+
+def object_id(s3_tuple : tuple) -> tuple:
+    """ Identify the object of an s3 tuple in a failure report
+    
+    Arguments:
+        s3_tuple {tuple} -- tuple in the form (s3_bucket_name, s3_key_name, ...)
+    
+    Returns:
+        tuple -- (s3_bucket_name, s3_key_name)
+    """
+
+    return tuple(s3_tuple[:2])
+
+def reject(s3_tuple : tuple, error : Exception, failures : dict):
+    """ Record the failure of one object, or raise it when failures are not collected
+    
+    Arguments:
+        s3_tuple {tuple} -- failed s3 tuple
+        error {Exception} -- failure
+        failures {dict} -- object id -> error message, or None
+    """
+
+    if failures is None:
+        raise error
+    print(f"Unable to process {s3_tuple}: {error!r}")
+    failures[object_id(s3_tuple)] = repr(error)
+
+def take_until_deadline(s3_tuple_list : list, deadline : Deadline, failures : dict):
+    """ Hand out objects until the deadline is reached, recording the objects that were not taken as failures
+    
+    The deadline is checked when the next stage asks for an object, which suits stages that take objects
+    as they work on them rather than reading ahead, e.g. image chunks and textract job starts.
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size)
+        deadline {Deadline} -- deadline of the invocation, never reached if None
+        failures {dict} -- collects object id -> DeadlineReached error of the objects that were not taken
+    
+    Yields:
+        tuple -- s3 tuple
+    """
+
+    for i, s3_tuple in enumerate(s3_tuple_list):
+        if deadline is not None and deadline.reached():
+            print(f"Deadline reached with {deadline.remaining_ms():.0f}ms left, leaving {len(s3_tuple_list) - i} objects to be retried")
+            for unfinished in s3_tuple_list[i:]:
+                reject(unfinished, DeadlineReached(), failures)
+            return
+        yield s3_tuple
+
+def iter_until_deadline(extracted, deadline : Deadline, failures : dict = None):
+    """ Pass extracted texts on to the bulk stage until half the safety margin is left, rejecting the rest
+    
+    Extraction stops at the margin, the texts extracted before it are still indexed while the remaining half
+    of the margin leaves time for their bulk requests.
+    
+    Arguments:
+        extracted {iterable} -- iterable of (s3_tuple, text or pages, enrichment)
+        deadline {Deadline} -- deadline of the invocation, never reached if None
+    
+    Keyword Arguments:
+        failures {dict} -- collects object id -> DeadlineReached error of the texts that were not indexed, raised if None (default: {None})
+    
+    Yields:
+        tuple -- (s3_tuple, text or pages, enrichment)
+    """
+
+    for s3_tuple, text_data, enrichment in extracted:
+        if deadline is not None and deadline.reached(deadline.margin_ms / 2):
+            reject(s3_tuple, DeadlineReached(), failures)
+            continue
+        yield s3_tuple, text_data, enrichment
+
+def pipeline_stage(items):
+    """ Run a stage of the ingest pipeline on its own thread, buffering at most PIPELINE_QUEUE_SIZE items for the next stage
+    
+    Arguments:
+        items {iterable} -- items produced by the stage
+    
+    Returns:
+        iterable -- items for the next stage
+    """
+
+    return prefetch(items, PIPELINE_QUEUE_SIZE) if PIPELINE_QUEUE_SIZE > 0 else items
+
+def iter_extracted_texts(textfile_s3_tuple_list : list, keep_pages : bool = False, enrich : bool = COMPREHEND_ENRICHMENT, failures : dict = None, handed_off : set = None, deadline : Deadline = None):
+    """ Fetch files concurrently, extract them on worker processes and optionally enrich them with comprehend
+    
+    Extracted texts are enriched BATCH_MAX_DOCUMENTS at a time, so each comprehend operation costs one call
+    per batch rather than one per file.
+    
+    Arguments:
+        textfile_s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size)
+    
+    Keyword Arguments:
+        keep_pages {bool} -- yield the list of page texts instead of the whole text (default: {False})
+        enrich {bool} -- detect entities, key phrases and sentiment (default: {COMPREHEND_ENRICHMENT})
+        failures {dict} -- collects object id -> error of the files that failed to extract, raised if None (default: {None})
+        handed_off {set} -- collects the object ids of the files without text that were handed to textract (default: {None})
+        deadline {Deadline} -- deadline after which no window is extracted and no text is handed to the bulk stage,
+                               every file left is rejected with DeadlineReached (default: {None})
+    
+    Yields:
+        tuple -- (s3_tuple, text or pages, enrichment dictionary) in order
     """
 
-    # filter out non-supporting textfile types
-    textfile_s3_tuple_list = list(filter(lambda x: x[1].split('.')[-1] in supported_textfile_types, s3_tuple_list))
-    num_of_textfiles = len(textfile_s3_tuple_list)
+    # fetch -> extract -> enrich -> bulk, each stage on its own threads or processes and connected by bounded queues
+    extracted = pipeline_stage(iter_file_texts_from_s3(textfile_s3_tuple_list, keep_pages=keep_pages, deadline=deadline))
+    if TEXTRACT_SNS_TOPIC_ARN:
+        extracted = iter_textract_fallbacks(extracted, failures=failures, handed_off=handed_off)
+    if not enrich:
+        return iter_until_deadline(iter_enriched_texts(extracted, enrich=False, failures=failures), deadline, failures=failures)
+    return iter_until_deadline(pipeline_stage(iter_enriched_texts(extracted, enrich=True, failures=failures)), deadline, failures=failures)
+
+def iter_textract_fallbacks(extracted, failures : dict = None, handed_off : set = None):
+    """ Hand the files whose local extraction found no text, such as small scanned pdfs, to asynchronous textract jobs
+    
+    Arguments:
+        extracted {iterable} -- iterable of (s3_tuple, text or pages or exception)
+    
+    Keyword Arguments:
+        failures {dict} -- collects object id -> error of the files whose job could not be started, raised if None (default: {None})
+        handed_off {set} -- collects the object ids of the files handed to textract (default: {None})
+    
+    Yields:
+        tuple -- (s3_tuple, text or pages or exception) of the files indexed by this invocation
+    """
+
+    for s3_tuple, text_data in extracted:
+        if isinstance(text_data, Exception) or s3_tuple[1].split('.')[-1].lower() not in TEXTRACT_EXTENSIONS or \
+                (text_data if isinstance(text_data, str) else "".join(text_data)).strip():
+            yield s3_tuple, text_data
+            continue
+        # indexed by handle_textract_completion once the job finished
+        try:
+            print(f"Started textract job {start_text_detection(s3_tuple)} for {s3_tuple} without extracted text")
+        except Exception as e:
+            reject(s3_tuple, e, failures)
+            continue
+        if handed_off is not None:
+            handed_off.add(object_id(s3_tuple))
+
+def iter_enriched_texts(extracted, enrich : bool = COMPREHEND_ENRICHMENT, failures : dict = None):
+    """ Optionally enrich extracted texts with comprehend, skipping or raising extraction errors in order
+    
+    Arguments:
+        extracted {iterable} -- iterable of (s3_tuple, text or pages or exception)
+    
+    Keyword Arguments:
+        enrich {bool} -- detect entities, key phrases and sentiment (default: {COMPREHEND_ENRICHMENT})
+        failures {dict} -- collects object id -> error of the files that failed to extract, raised if None (default: {None})
+    
+    Yields:
+        tuple -- (s3_tuple, text or pages, enrichment dictionary) in order
+    """
 
-    if num_of_textfiles > 0:
+    batch = []
+    for s3_tuple, text_data in extracted:
+        if isinstance(text_data, Exception):
+            reject(s3_tuple, text_data, failures)
+            continue
+        if not enrich:
+            yield s3_tuple, text_data, {}
+            continue
+        batch.append((s3_tuple, text_data))
+        if len(batch) < BATCH_MAX_DOCUMENTS:
+            continue
+        yield from enrich_extracted_texts(batch)
+        batch = []
+    yield from enrich_extracted_texts(batch)
 
-        # get file extensions, binary data, and text in file
-        # TODO: replace this with Amazon Textract
-        extension_list = [s3_key.split('.')[-1] for s3_bucket, s3_key, s3_size in textfile_s3_tuple_list]
-        binary_data_list = [get_binary_data_from_file_in_s3(bucket=s3_bucket, key=s3_key) for s3_bucket, s3_key, s3_size in textfile_s3_tuple_list]
-        text_list = [get_file_text_from_binary_data(extension, binary_data) for extension, binary_data in zip(extension_list, binary_data_list)]
-        
-        # create and put textfile document
-        es_tx.put_index()
-        es_tx.put_mapping()
-        pid_list = [es_tx.create_pid(s3_tuple=s3_tuple) for s3_tuple in textfile_s3_tuple_list]
-        doc_list = [es_tx.create_doc_entry(
+def enrich_extracted_texts(batch : list) -> list:
+    """ Enrich a batch of extracted texts
+    
+    Arguments:
+        batch {list} -- list of (s3_tuple, text or pages)
+    
+    Returns:
+        list -- list of (s3_tuple, text or pages, enrichment dictionary)
+    """
+
+    if not batch:
+        return []
+    enrichments = enrich_texts([text_data if isinstance(text_data, str) else join_leading_pages(text_data) for s3_tuple, text_data in batch])
+    return [(s3_tuple, text_data, enrichment) for (s3_tuple, text_data), enrichment in zip(batch, enrichments)]
+
+def join_leading_pages(pages : list, max_chars : int = BATCH_MAX_DOCUMENT_BYTES) -> str:
+    """ Join the pages comprehend reads, the first page may be short or blank, e.g. a cover page
+    
+    Comprehend only reads the first BATCH_MAX_DOCUMENT_BYTES of UTF-8, which never holds more characters,
+    so pages are joined until max_chars and truncate_utf8 cuts the rest.
+    
+    Arguments:
+        pages {list} -- list of page texts
+    
+    Keyword Arguments:
+        max_chars {int} -- stop joining once the text has this many characters (default: {BATCH_MAX_DOCUMENT_BYTES})
+    
+    Returns:
+        str -- text of the leading pages separated by newlines
+    """
+
+    leading_pages = []
+    num_of_chars = 0
+    for page in pages:
+        if num_of_chars >= max_chars:
+            break
+        leading_pages.append(page)
+        num_of_chars += len(page) + 1
+    return "\n".join(leading_pages)
+
+def iter_textfile_documents(textfile_s3_tuple_list : list, extracted=None):
+    """ Fetch files concurrently, extract them on worker processes and create textfile documents in order
+    
+    Arguments:
+        textfile_s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size)
+    
+    Keyword Arguments:
+        extracted {iterable} -- (s3_tuple, text, enrichment) of the files extracted elsewhere, fetched and extracted here if None (default: {None})
+    
+    Yields:
+        tuple -- (primary id, textfile document)
+    """
+
+    if extracted is None:
+        extracted = iter_extracted_texts(textfile_s3_tuple_list)
+    for s3_tuple, text_data, enrichment in extracted:
+        extension = s3_tuple[1].split('.')[-1]
+        yield es_tx.create_pid(s3_tuple=s3_tuple), es_tx.create_doc_entry(
             title=s3_tuple[1],
             extension=extension,
             s3_tuple=s3_tuple,
-            content=text_data
-        ) for extension, s3_tuple, text_data in zip(extension_list, textfile_s3_tuple_list, text_list)]
-        es_tx.put_document_bulk(pid_list=pid_list, document_list=doc_list)
+            content=text_data,
+            enrichment=enrichment
+        )
 
-    imagefile_s3_tuple_list = list(filter(lambda x: x[1].split('.')[-1] in supported_imagefile_types, s3_tuple_list))
-    num_of_imagefiles = len(imagefile_s3_tuple_list)
-
-    if num_of_imagefiles > 0:
+def iter_textfile_passage_actions(textfile_s3_tuple_list : list, extracted=None, parents : list = None):
+    """ Fetch and extract files like iter_textfile_documents, encoding each file as a parent document
+    without content followed by its passages
+    
+    Arguments:
+        textfile_s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size)
+    
+    Keyword Arguments:
+        extracted {iterable} -- (s3_tuple, pages, enrichment) of the files extracted elsewhere, fetched and extracted here if None (default: {None})
+        parents {list} -- collects the (primary id, textfile document) of every file instead of yielding its action, so that
+                          the parent is written once its passages succeeded (default: {None})
+    
+    Yields:
+        tuple -- (primary id, encoded bulk action) of the textfile and passage indices
+    """
 
-        extension_list = [s3_key.split('.')[-1] for s3_bucket, s3_key, s3_size in imagefile_s3_tuple_list]
-        es_im.put_index()
-        es_im.put_mapping()
-        pid_list = [es_im.create_pid(s3_tuple=s3_tuple) for s3_tuple in imagefile_s3_tuple_list]
-        doc_list = [es_im.create_doc_entry(
+    if extracted is None:
+        extracted = iter_extracted_texts(textfile_s3_tuple_list, keep_pages=True)
+    tx_encoder = es_tx.bulk_encoder("index")
+    psg_encoder = es_psg.bulk_encoder("index")
+    for s3_tuple, pages, enrichment in extracted:
+        extension = s3_tuple[1].split('.')[-1]
+        parent_pid = es_tx.create_pid(s3_tuple=s3_tuple)
+        parent = es_tx.create_doc_entry(
+            title=s3_tuple[1],
             extension=extension,
             s3_tuple=s3_tuple,
-            image_labels=detect_labels(s3_tuple),
-            image_texts=detect_text(s3_tuple),
-            celebrities=recognize_celebrities(s3_tuple)
-        ) for extension, s3_tuple in zip(extension_list, imagefile_s3_tuple_list)]
-        es_im.put_document_bulk(pid_list=pid_list, document_list=doc_list)
+            content=None,
+            enrichment=enrichment
+        )
+        if parents is None:
+            yield parent_pid, tx_encoder.encode_action(parent_pid, parent)
+        else:
+            parents.append((parent_pid, parent))
+        for pid, passage in es_psg.create_doc_entries(parent_pid, s3_tuple[1], extension, s3_tuple, split_into_passages(pages)):
+            yield pid, psg_encoder.encode_action(pid, passage)
 
-    # TODO: Handle Delete file requests
+def iter_cleared_passages(extracted, failures : dict = None, new_pids : set = None, batch_size : int = PASSAGE_DELETE_BATCH_SIZE):
+    """ Delete the passages of the files taken from the extracted stream, since a changed file may have fewer passages than before
+    
+    The passages of up to batch_size files are deleted with a single delete by query before the files are passed on.
+    
+    Arguments:
+        extracted {iterable} -- iterable of (s3_tuple, pages, enrichment)
+    
+    Keyword Arguments:
+        failures {dict} -- collects object id -> error of the files whose passages could not be deleted, raised if None (default: {None})
+        new_pids {set} -- primary ids of the files that had no document, so no passage to delete (default: {None})
+        batch_size {int} -- max number of files whose passages are deleted together (default: {PASSAGE_DELETE_BATCH_SIZE})
+    
+    Yields:
+        tuple -- (s3_tuple, pages, enrichment) of the files whose stale passages are gone
+    """
+
+    new_pids = new_pids or set()
+    batch = []
+    for item in extracted:
+        batch.append(item)
+        if len(batch) < batch_size:
+            continue
+        yield from clear_passages(batch, failures, new_pids)
+        batch = []
+    yield from clear_passages(batch, failures, new_pids)
+
+def clear_passages(batch : list, failures : dict, new_pids : set) -> list:
+    """ Delete the passages of a batch of files with a single delete by query
+    
+    Arguments:
+        batch {list} -- list of (s3_tuple, pages, enrichment)
+        failures {dict} -- collects object id -> error of the files whose passages could not be deleted, raised if None
+        new_pids {set} -- primary ids of the files that had no document
+    
+    Returns:
+        list -- list of (s3_tuple, pages, enrichment) of the files whose stale passages are gone
+    """
+
+    parent_pids = [es_tx.create_pid(s3_tuple) for s3_tuple, pages, enrichment in batch if es_tx.create_pid(s3_tuple) not in new_pids]
+    if parent_pids:
+        try:
+            es_psg.delete_passages(parent_pids)
+        except Exception as e:
+            for s3_tuple, pages, enrichment in batch:
+                reject(s3_tuple, e, failures)
+            return []
+    return batch
+
+def get_parent_pids(failed_pids : list) -> list:
+    """ Map failed passage ids back to the primary id of their textfile document
+    
+    Arguments:
+        failed_pids {list} -- primary ids of failed textfile and passage documents
+    
+    Returns:
+        list -- primary ids of the textfile documents
+    """
+
+    parent_pids = []
+    for pid in failed_pids:
+        parent_pid, separator, passage_number = pid.rpartition("#")
+        parent_pids.append(parent_pid if separator and passage_number.isdigit() else pid)
+    return parent_pids
+
+def iter_imagefile_documents(imagefile_s3_tuple_list : list, failures : dict = None, deadline : Deadline = None):
+    """ Analyze images concurrently and create imagefile documents in order
+    
+    With a deadline the images are analyzed REKOGNITION_CONCURRENCY at a time, and no further
+    images are taken once it is reached.
+    
+    Arguments:
+        imagefile_s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size)
+    
+    Keyword Arguments:
+        failures {dict} -- collects object id -> error of the images whose every analysis failed or that were not taken (default: {None})
+        deadline {Deadline} -- deadline of the invocation, requires failures (default: {None})
+    
+    Yields:
+        tuple -- (primary id, imagefile document)
+    """
+
+    chunk_size = max(1, REKOGNITION_CONCURRENCY) if deadline is not None else max(1, len(imagefile_s3_tuple_list))
+    taken = take_until_deadline(imagefile_s3_tuple_list, deadline, failures)
+    while True:
+        chunk = [s3_tuple for _, s3_tuple in zip(range(chunk_size), taken)]
+        if not chunk:
+            return
+        for s3_tuple, analysis in pipeline_stage(iter_image_analyses(chunk)):
+            if len(analysis["errors"]) == 3:
+                print(f"Skipping {s3_tuple}, every image analysis failed: {analysis['errors']}")
+                if failures is not None:
+                    failures[object_id(s3_tuple)] = f"every image analysis failed: {analysis['errors']}"
+                continue
+            yield es_im.create_pid(s3_tuple=s3_tuple), es_im.create_doc_entry(
+                extension=s3_tuple[1].split('.')[-1],
+                s3_tuple=s3_tuple,
+                image_labels=analysis["labels"],
+                image_texts=analysis["texts"],
+                celebrities=analysis["celebrities"]
+            )
+
+def is_too_large(s3_tuple : tuple) -> bool:
+    """ Check whether a file is too large to be downloaded and cannot be cut off, e.g. a pdf over S3_MAX_OBJECT_BYTES
+    
+    Arguments:
+        s3_tuple {tuple} -- tuple in the form (s3_bucket_name, s3_key_name, s3_object_size)
+    
+    Returns:
+        bool -- the file cannot be extracted by the lambda
+    """
+
+    return bool(S3_MAX_OBJECT_BYTES) and s3_tuple[2] > S3_MAX_OBJECT_BYTES and not is_truncatable(s3_tuple[1].split('.')[-1])
+
+def uses_textract(s3_tuple : tuple) -> bool:
+    """ Check whether a file is large enough to be detected by an asynchronous textract job
+    
+    Arguments:
+        s3_tuple {tuple} -- tuple in the form (s3_bucket_name, s3_key_name, s3_object_size)
+    
+    Returns:
+        bool -- the file goes to textract
+    """
+
+    return bool(TEXTRACT_SNS_TOPIC_ARN) and s3_tuple[1].split('.')[-1].lower() in TEXTRACT_EXTENSIONS and \
+        (s3_tuple[2] >= TEXTRACT_MIN_BYTES or is_too_large(s3_tuple) or s3_tuple[1].split('.')[-1].lower() not in supported_extensions())
+
+def record_bulk_failures(es_client : ESClientBase, s3_tuple_list : list, summary : BulkSummary, failures : dict):
+    """ Record the objects whose document or passages were rejected by elasticsearch
+    
+    Arguments:
+        es_client {ESClientBase} -- elasticsearch client of the objects' documents
+        s3_tuple_list {list} -- list of indexed s3 tuples
+        summary {BulkSummary} -- bulk summary of the documents
+        failures {dict} -- object id -> error message
+    """
+
+    errors = {}
+    for pid, status, error_type in summary.errors:
+        errors.setdefault(get_parent_pids([pid])[0], f"elasticsearch rejected the document with {status} {error_type}")
+    for s3_tuple in s3_tuple_list:
+        error = errors.get(es_client.create_pid(s3_tuple))
+        if error is not None:
+            failures[object_id(s3_tuple)] = error
+
+def put_textfiles(textfile_s3_tuple_list : list, extracted=None, failures : dict = None, deadline : Deadline = None, new_pids : set = None) -> BulkSummary:
+    """ Index textfiles as whole documents, or as passages in passage mode
+    
+    Arguments:
+        textfile_s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, s3_object_size, s3_object_etag)
+    
+    Keyword Arguments:
+        extracted {iterable} -- (s3_tuple, text or pages, enrichment) of the files extracted elsewhere, fetched and extracted here if None (default: {None})
+        failures {dict} -- collects object id -> error of the files that failed, extraction errors are raised if None (default: {None})
+        deadline {Deadline} -- deadline after which no further file is extracted or indexed, requires failures (default: {None})
+        new_pids {set} -- primary ids of the files known to have no document, whose passages are not deleted (default: {None})
+    
+    Returns:
+        BulkSummary -- bulk summary of the textfile documents and passages
+    """
+
+    handed_off = set()
+    if TEXTFILE_PASSAGE_MODE:
+        if extracted is None:
+            extracted = iter_extracted_texts(textfile_s3_tuple_list, keep_pages=True, failures=failures, handed_off=handed_off, deadline=deadline)
+        es_psg.ensure_index()
+        # the parent holds the etag that marks the file as indexed, so it is written once every passage of the file succeeded
+        parents = []
+        summary = run(es_tx_async.put_action_stream(iter_textfile_passage_actions(textfile_s3_tuple_list, extracted=iter_cleared_passages(extracted, failures, new_pids=new_pids), parents=parents)))
+        failed_parent_pids = set(get_parent_pids(summary.failed_pids))
+        summary.merge(run(es_tx_async.put_document_stream((pid, parent) for pid, parent in parents if pid not in failed_parent_pids)))
+    else:
+        if extracted is None:
+            extracted = iter_extracted_texts(textfile_s3_tuple_list, failures=failures, handed_off=handed_off, deadline=deadline)
+        summary = run(es_tx_async.put_document_stream(iter_textfile_documents(textfile_s3_tuple_list, extracted=extracted)))
+    if failures is not None:
+        record_bulk_failures(es_tx, textfile_s3_tuple_list, summary, failures)
+    # an object skipped for an extraction error or the deadline, or handed to textract, has no document whose etag could be remembered
+    remember_etags(es_tx, [s3_tuple for s3_tuple in textfile_s3_tuple_list if (failures is None or object_id(s3_tuple) not in failures) and object_id(s3_tuple) not in handed_off], get_parent_pids(summary.failed_pids))
+    return summary
+
+def failure_report(failures : dict) -> list:
+    """ List the failed objects of a failure dictionary
+    
+    Arguments:
+        failures {dict} -- object id -> error message
+    
+    Returns:
+        list -- list in the form
+        [
+            {"bucket" : "...", "key" : "...", "error" : "..."},
+            ...
+        ]
+    """
+
+    return [{"bucket" : bucket, "key" : key, "error" : error} for (bucket, key), error in failures.items()]
+
+def summary_response(summary : BulkSummary, failures : dict = None) -> dict:
+    """ Turn a bulk summary into the http response of the lambda
+    
+    Arguments:
+        summary {BulkSummary} -- merged bulk summary
+    
+    Keyword Arguments:
+        failures {dict} -- object id -> error message of the failed objects (default: {None})
+    
+    Returns:
+        dict -- dictionary of http response, with a per object "failures" report if any object failed
+    """
+
+    print(f"bulk summary: {summary}")
+    if failures:
+        print(f"failed objects: {failures}")
+        return {
+            "statusCode" : HTTPStatus.INTERNAL_SERVER_ERROR,
+            "body" : f"Processing {len(failures)} objects FAILED.",
+            "failures" : failure_report(failures)
+        }
+    if summary.failed > 0:
+        print(f"bulk errors: {summary.errors}")
+        return {
+            "statusCode" : HTTPStatus.INTERNAL_SERVER_ERROR,
+            "body" : f"Putting {summary.failed} of {summary.success + summary.failed} documents into elasticsearch FAILED."
+        }
 
     return { 
         "statusCode" : HTTPStatus.OK,
         "body" : "Putting documents into elasticsearch successfully."
     }
 
-# TODO: AWS Just changed the message sends in sqs queue, update this later
-def handle_sqs_trigger(event : dict):
+def dispatcher(s3_tuple_list : list) -> dict:
+    """ Dispatch the lambda handler
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples of in the form (s3_bucket_name, s3_key_name, s3_object_size, s3_object_etag)
+    
+    Returns:
+        dict -- dictionary of http response, with a per object "failures" report if any object failed
+    """
+
+    summary, failures = dispatch(s3_tuple_list)
+    return summary_response(summary, failures)
+
+def dispatch_textfiles(textfile_s3_tuple_list : list, failures : dict, deadline : Deadline = None) -> BulkSummary:
+    """ Index the changed textfiles, starting textract jobs for the large documents
+    
+    Arguments:
+        textfile_s3_tuple_list {list} -- list of tuples of in the form (s3_bucket_name, s3_key_name, s3_object_size, s3_object_etag)
+        failures {dict} -- collects object id -> error message of the failed objects
+    
+    Keyword Arguments:
+        deadline {Deadline} -- deadline after which the objects not yet taken are reported as failures (default: {None})
+    
+    Returns:
+        BulkSummary -- bulk summary of the textfile documents
+    """
+
+    es_tx.ensure_index()
+    new_pids = set()
+    textfile_s3_tuple_list = filter_changed_s3_tuples(es_tx, textfile_s3_tuple_list, new_pids=new_pids)
+    # large documents are indexed by handle_textract_completion once their job finished
+    for s3_tuple in take_until_deadline(list(filter(uses_textract, textfile_s3_tuple_list)), deadline, failures):
+        try:
+            print(f"Started textract job {start_text_detection(s3_tuple)} for {s3_tuple}")
+        except Exception as e:
+            reject(s3_tuple, e, failures)
+    textfile_s3_tuple_list = [s3_tuple for s3_tuple in textfile_s3_tuple_list if not uses_textract(s3_tuple)]
+    # retrying a file too large for the lambda would fail the same way, so it is skipped rather than reported as failed
+    for s3_tuple in filter(is_too_large, textfile_s3_tuple_list):
+        print(f"Skipping {s3_tuple}: {s3_tuple[2]} bytes exceed S3_MAX_OBJECT_BYTES of {S3_MAX_OBJECT_BYTES} bytes and no textract topic is configured")
+    textfile_s3_tuple_list = [s3_tuple for s3_tuple in textfile_s3_tuple_list if not is_too_large(s3_tuple)]
+    if not textfile_s3_tuple_list:
+        return BulkSummary()
+    return put_textfiles(textfile_s3_tuple_list, failures=failures, deadline=deadline, new_pids=new_pids)
+
+def dispatch_imagefiles(imagefile_s3_tuple_list : list, failures : dict, deadline : Deadline = None) -> BulkSummary:
+    """ Analyze and index the changed imagefiles
+    
+    Arguments:
+        imagefile_s3_tuple_list {list} -- list of tuples of in the form (s3_bucket_name, s3_key_name, s3_object_size, s3_object_etag)
+        failures {dict} -- collects object id -> error message of the failed objects
+    
+    Keyword Arguments:
+        deadline {Deadline} -- deadline after which the objects not yet taken are reported as failures (default: {None})
+    
+    Returns:
+        BulkSummary -- bulk summary of the imagefile documents
+    """
+
+    es_im.ensure_index()
+    imagefile_s3_tuple_list = filter_changed_s3_tuples(es_im, imagefile_s3_tuple_list)
+    summary = run(es_im_async.put_document_stream(iter_imagefile_documents(imagefile_s3_tuple_list, failures=failures, deadline=deadline)))
+    record_bulk_failures(es_im, imagefile_s3_tuple_list, summary, failures)
+    remember_etags(es_im, [s3_tuple for s3_tuple in imagefile_s3_tuple_list if object_id(s3_tuple) not in failures], summary.failed_pids)
+    return summary
+
+def dispatch(s3_tuple_list : list, deadline : Deadline = None) -> tuple:
+    """ Index the objects, isolating the failure of one object from the others
+    
+    The textfile and imagefile branches share nothing but the failures, so they run on their own threads
+    and a mixed batch takes as long as the slower branch rather than both.
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples of in the form (s3_bucket_name, s3_key_name, s3_object_size, s3_object_etag)
+    
+    Keyword Arguments:
+        deadline {Deadline} -- deadline after which the objects not yet taken are reported as failures (default: {None})
+    
+    Returns:
+        tuple -- (BulkSummary, dictionary of object id -> error message of the failed objects)
+    """
+
+    summary = BulkSummary()
+    failures = {}
+
+    # filter out non-supporting file types
+    branches = [
+        (dispatch_textfiles, list(filter(lambda x: x[1].split('.')[-1] in supported_textfile_types, s3_tuple_list))),
+        (dispatch_imagefiles, list(filter(lambda x: x[1].split('.')[-1] in supported_imagefile_types, s3_tuple_list)))
+    ]
+    branches = [(branch, branch_s3_tuple_list) for branch, branch_s3_tuple_list in branches if branch_s3_tuple_list]
+
+    if len(branches) == 1:
+        branch, branch_s3_tuple_list = branches[0]
+        summary.merge(branch(branch_s3_tuple_list, failures, deadline=deadline))
+    elif branches:
+        for branch_summary in ordered_map(lambda branch: branch[0](branch[1], failures, deadline=deadline), branches, max_workers=len(branches)):
+            summary.merge(branch_summary)
+
+    return summary, failures
+
+def sequencer_order(s3_record : S3Record) -> int:
+    """ Get the order of a notification, the sequencers of an object's events are hexadecimal and increase
+    
+    Arguments:
+        s3_record {S3Record} -- record
+    
+    Returns:
+        int -- sequencer value, -1 without a sequencer
+    """
+
+    return int(s3_record.sequencer, 16) if s3_record.sequencer else -1
+
+def resolve_latest_records(s3_records : list) -> list:
+    """ Keep the latest notification of every object, so that an older put never overwrites a delete
+    
+    Arguments:
+        s3_records {list} -- list of S3Record
+    
+    Returns:
+        list -- list of S3Record, one per object, the later one of records with equal sequencers
+    """
+
+    latest = {}
+    for s3_record in s3_records:
+        current = latest.get(object_id(s3_record.s3_tuple))
+        if current is None or sequencer_order(s3_record) >= sequencer_order(current):
+            latest[object_id(s3_record.s3_tuple)] = s3_record
+    return list(latest.values())
 
-    event = deserialize_to_dict(event)
+def delete_objects(s3_tuple_list : list, failures : dict):
+    """ Remove the documents of deleted objects with one bulk request per index
+    
+    Arguments:
+        s3_tuple_list {list} -- list of tuples in the form (s3_bucket_name, s3_key_name, ...)
+        failures {dict} -- collects object id -> error of the objects whose documents could not be removed
+    """
 
-    s3_tuple_list = list(map(lambda x : (x["body"]["Records"][0]["s3"]["bucket"]["name"], \
-                                         x["body"]["Records"][0]["s3"]["object"]["key"], \
-                                         x["body"]["Records"][0]["s3"]["object"]["size"]), \
-                                         event["Records"]))
+    for es_client, supported_types in [(es_tx, supported_textfile_types), (es_im, supported_imagefile_types)]:
+        deleted = {es_client.create_pid(s3_tuple) : s3_tuple for s3_tuple in s3_tuple_list if s3_tuple[1].split('.')[-1] in supported_types}
+        if not deleted:
+            continue
+        for pid in deleted:
+            etag_cache.invalidate((es_client.index, pid))
+        try:
+            errors = {}
+            for item in es_client.delete_document_bulk(list(deleted)).json().get("items", []):
+                result = item["delete"]
+                # an already missing document or index is deleted as well
+                if result.get("status", 500) >= 300 and result.get("status") != HTTPStatus.NOT_FOUND:
+                    errors[result["_id"]] = f"elasticsearch rejected the delete with {result.get('status')} {result.get('error')}"
+        except Exception as e:
+            errors = {pid : repr(e) for pid in deleted}
+        print(f"Deleted {len(deleted) - len(errors)} of {len(deleted)} documents from {es_client.index}")
+        if es_client is es_tx and TEXTFILE_PASSAGE_MODE:
+            # the documents are gone either way, an object whose passages remain is retried for them alone
+            try:
+                es_psg.delete_passages(list(deleted))
+            except Exception as e:
+                print(f"Unable to delete the passages of {len(deleted)} documents: {e!r}")
+                for pid in deleted:
+                    errors.setdefault(pid, f"unable to delete the passages: {e!r}")
+        for pid, error in errors.items():
+            if pid in deleted:
+                failures[object_id(deleted[pid])] = error
+
+def dispatch_records(s3_records : list, deadline : Deadline = None) -> tuple:
+    """ Index the created objects and remove the deleted ones of a batch of notifications
+    
+    Arguments:
+        s3_records {list} -- list of S3Record
+    
+    Keyword Arguments:
+        deadline {Deadline} -- deadline after which the created objects not yet taken are reported as failures (default: {None})
+    
+    Returns:
+        tuple -- (BulkSummary of the indexed documents, dictionary of object id -> error message of the failed objects)
+    """
+
+    s3_records = resolve_latest_records(s3_records)
+    summary, failures = dispatch([s3_record.s3_tuple for s3_record in s3_records if not s3_record.is_removed], deadline=deadline)
+    removed = [s3_record.s3_tuple for s3_record in s3_records if s3_record.is_removed]
+    if removed:
+        delete_objects(removed, failures)
+    return summary, failures
+
+def iter_textract_texts(completions : list, keep_pages : bool = False):
+    """ Collect the pages of finished textract jobs one job at a time
+    
+    Arguments:
+        completions {list} -- successful completions from parse_completion_record
+    
+    Keyword Arguments:
+        keep_pages {bool} -- yield the list of page texts instead of the whole text (default: {False})
+    
+    Yields:
+        tuple -- (s3_tuple, text or pages, or the exception of a job whose pages could not be read)
+    """
+
+    for completion in completions:
+        try:
+            pages = truncate_pages(get_text_detection_pages(completion["job_id"]), MAX_CONTENT_CHARS)
+        except Exception as e:
+            yield completion["s3_tuple"], e
+            continue
+        yield completion["s3_tuple"], pages if keep_pages else "\n".join(pages).strip()
+
+def handle_textract_completion(event : dict) -> dict:
+    """ Index the documents of the textract jobs whose completion was published to the SNS topic
+    
+    Arguments:
+        event {dict} -- SNS event
+    
+    Returns:
+        dict -- dictionary of http response
+    """
+
+    completions = [parse_completion_record(record) for record in event["Records"]]
+    failed = [completion for completion in completions if completion["status"] not in SUCCEEDED_STATUSES]
+    completions = [completion for completion in completions if completion["status"] in SUCCEEDED_STATUSES]
+    for completion in failed:
+        print(f"Textract job {completion['job_id']} of {completion['s3_tuple']} {completion['status']}")
+
+    summary = BulkSummary()
+    failures = {object_id(completion["s3_tuple"]) : f"textract job {completion['job_id']} {completion['status']}" for completion in failed}
+    if completions:
+        es_tx.ensure_index()
+        extracted = iter_enriched_texts(iter_textract_texts(completions, keep_pages=TEXTFILE_PASSAGE_MODE), failures=failures)
+        summary.merge(put_textfiles([completion["s3_tuple"] for completion in completions], extracted=extracted, failures=failures))
+
+    return summary_response(summary, failures)
+
+def handle_sqs_trigger(event : dict, deadline : Deadline = None) -> dict:
+    """ Index the objects of an SQS batch and report the messages to be redelivered
+    
+    Only the messages with a failed object, including the objects left over at the deadline, are reported
+    in batchItemFailures, which requires the ReportBatchItemFailures response type on the event source mapping.
+    
+    Arguments:
+        event {dict} -- SQS event
+    
+    Keyword Arguments:
+        deadline {Deadline} -- deadline of the invocation (default: {None})
+    
+    Returns:
+        dict -- partial batch response in the form {"batchItemFailures" : [{"itemIdentifier" : message id}, ...]}
+    """
+
+    messages = []
+    failed_message_ids = []
+    for record in event["Records"]:
+        try:
+            messages.append((record["messageId"], parse_sqs_message(record)))
+        except Exception as e:
+            print(f"Unable to parse message {record.get('messageId')}: {e!r}")
+            failed_message_ids.append(record.get("messageId"))
 
     try:
-        return dispatcher(s3_tuple_list=s3_tuple_list)
-    except:
-        return { 
-            "statusCode" : HTTPStatus.INTERNAL_SERVER_ERROR,
-            "body" : "Putting documents into elasticsearch FAILED."
-        }
+        summary, failures = dispatch_records([s3_record for message_id, s3_records in messages for s3_record in s3_records], deadline=deadline)
+        summary_response(summary, failures)
+        failed_message_ids += [message_id for message_id, s3_records in messages if any(object_id(s3_record.s3_tuple) in failures for s3_record in s3_records)]
+    except Exception as e:
+        print(f"Unable to process the batch: {e!r}")
+        failed_message_ids += [message_id for message_id, s3_records in messages]
+
+    return {"batchItemFailures" : [{"itemIdentifier" : message_id} for message_id in failed_message_ids]}
 
-def handle_s3_trigger(event : dict):
+def handle_s3_trigger(event : dict, deadline : Deadline = None) -> dict:
+    """ Index the objects of an S3 event, reporting every failed object
+    
+    Arguments:
+        event {dict} -- S3 event
+    
+    Keyword Arguments:
+        deadline {Deadline} -- deadline of the invocation (default: {None})
+    
+    Returns:
+        dict -- dictionary of http response, with a per object "failures" report if any object failed
+    """
 
-    s3_tuple_list = [(
-        record["s3"]["bucket"]["name"], 
-        record["s3"]["object"]["key"], 
-        record["s3"]["object"]["size"]) 
-        for record in event["Records"]]
+    s3_records = list(iter_s3_records(event))
+    s3_tuple_list = [s3_record.s3_tuple for s3_record in s3_records]
 
     try:
-        return dispatcher(s3_tuple_list=s3_tuple_list)
-    except:
+        return summary_response(*dispatch_records(s3_records, deadline=deadline))
+    except Exception as e:
+        print(f"Unable to process the event: {e!r}")
         return { 
             "statusCode" : HTTPStatus.INTERNAL_SERVER_ERROR,
-            "body" : "Putting documents into elasticsearch FAILED."
+            "body" : "Putting documents into elasticsearch FAILED.",
+            "failures" : failure_report({object_id(s3_tuple) : repr(e) for s3_tuple in s3_tuple_list})
         }
 
 def lambda_handler(event : dict, context : dict) -> dict:
@@ -113,18 +889,21 @@ def lambda_handler(event : dict, context : dict) -> dict:
 
     Arguments:
         event {dict} -- dictionary of lambda events
-        context {dict} -- dictionary of lambda context
+        context {object} -- lambda context, whose remaining time bounds the objects taken from the event
 
     Returns:
         dict -- dictionary of http response
     """
 
     print(f"testing - {event}")
+    deadline = Deadline(context, margin_ms=LAMBDA_DEADLINE_MARGIN_MS)
 
-    if event["Records"][0]["eventSource"] == "aws:s3":
-        return handle_s3_trigger(event)
-    elif event["Records"][0]["eventSource"] == "aws:sqs":
-        return handle_sqs_trigger(event)
+    if event["Records"][0].get("eventSource") == "aws:s3":
+        return handle_s3_trigger(event, deadline=deadline)
+    elif event["Records"][0].get("eventSource") == "aws:sqs":
+        return handle_sqs_trigger(event, deadline=deadline)
+    elif event["Records"][0].get("EventSource") == "aws:sns":
+        return handle_textract_completion(event)
 
     return { 
         "statusCode" : HTTPStatus.INTERNAL_SERVER_ERROR,
@@ -1,10 +1,25 @@
 from client_lex import LexResponse, to_validate_text
-from client_comprehend import detect_keyphrases
-from esclient import TextfileDocument, ImagefileDocument
+from client_comprehend import detect_keyphrases, get_detect_cache
+from esclient import ESClientBase, TextfileDocument, TextfilePassageDocument, ImagefileDocument
+from cache import TTLCache
 
 from config import ES_HOST, ES_PORT, AWS_DEFAULT_REGION
+from config import SEARCH_CACHE_MAXSIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_GENERATION_INTERVAL
+from config import TEXTFILE_PASSAGE_MODE
 
 import json
+import string
+import time
+from http import HTTPStatus
+
+es_tx = TextfileDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
+es_im = ImagefileDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
+es_psg = TextfilePassageDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
+
+# the search cache lives at module level so repeated queries in a warm container skip elasticsearch
+search_cache = TTLCache(maxsize=SEARCH_CACHE_MAXSIZE, ttl=SEARCH_CACHE_TTL)
+generations = {}
+generation_checked_at = {}
 
 def validate_slots(slots : dict) -> dict:
     """ Validate slots
@@ -20,6 +35,80 @@ def validate_slots(slots : dict) -> dict:
 
     return slots
 
+def normalize_keywords(keywords : list) -> tuple:
+    """ Normalize keywords into a sorted set of lower case words, so that equivalent queries share a cache key
+    
+    Arguments:
+        keywords {list} -- list of keywords or key phrases
+    
+    Returns:
+        tuple -- sorted unique words
+    """
+
+    words = (word.strip(string.punctuation) for keyword in keywords for word in keyword.lower().split())
+    return tuple(sorted(set(word for word in words if word)))
+
+def check_search_cache_generation(es_client : ESClientBase):
+    """ Invalidate the search cache when the index changed, checking at most once per SEARCH_CACHE_GENERATION_INTERVAL
+    
+    Arguments:
+        es_client {ESClientBase} -- elasticsearch client of the searched index
+    """
+
+    now = time.monotonic()
+    if now - generation_checked_at.get(es_client.index, float("-inf")) < SEARCH_CACHE_GENERATION_INTERVAL:
+        return
+    generation_checked_at[es_client.index] = now
+    try:
+        generations[es_client.index] = es_client.index_generation()
+    except Exception as e:
+        print(f"Unable to get the generation of index {es_client.index}: {e}")
+        return
+    if search_cache.set_generation(tuple(sorted(generations.items()))):
+        print("Index changed, search cache invalidated")
+
+def cached_search(key : tuple, es_client : ESClientBase, search) -> dict:
+    """ Run a search through the search cache
+    
+    Arguments:
+        key {tuple} -- cache key
+        es_client {ESClientBase} -- elasticsearch client of the searched index
+        search {callable} -- function sending the search and returning the http response
+    
+    Returns:
+        dict -- search response body, only successful responses are cached
+    """
+
+    check_search_cache_generation(es_client)
+    data = search_cache.get(key)
+    if data is None:
+        res = search()
+        data = res.json()
+        # an error body would be served to every repeat of the search until it expires
+        if HTTPStatus.OK == res.status_code and "hits" in data:
+            search_cache.set(key, data)
+        else:
+            print(f"Not caching the failed search {key}: {res.status_code} {data}")
+    print(f"search cache: {search_cache.stats()}")
+    return data
+
+def get_keywords(description : str) -> list:
+    """ Use the words of a short description, or the key phrases of a long one, as keywords
+    
+    Arguments:
+        description {str} -- user description
+    
+    Returns:
+        list -- list of keywords
+    """
+
+    keywords = description.split()
+    if len(keywords) > 10:
+        keywords = detect_keyphrases(description)
+        print(f"comprehend cache: {get_detect_cache().stats()}")
+    print(f"Getting keywords {keywords}")
+    return keywords
+
 def get_textfile_search_message(description : str) -> list:
     """
     
@@ -35,26 +124,57 @@ def get_textfile_search_message(description : str) -> list:
     """
     print(f"Starting textfilesearch using description {description}")
 
-    keywords = description.split()
-    if len(keywords) > 10:
-        keywords = detect_keyphrases(description)
-    print(f"Getting keywords {keywords}")
-    es_tx = TextfileDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
-    response = es_tx.search_and_highlight_document(
-        keywords=keywords,
-        num_of_docs=3,
-        num_of_highlights=1,
-        highlight_fragment_size=50
+    keywords = get_keywords(description)
+    search_params = {
+        "num_of_docs" : 3,
+        "num_of_highlights" : 1,
+        "highlight_fragment_size" : 50
+    }
+    if TEXTFILE_PASSAGE_MODE:
+        return get_passage_search_message(keywords, search_params)
+    data = cached_search(
+        key=("text", normalize_keywords(keywords), tuple(sorted(search_params.items()))),
+        es_client=es_tx,
+        search=lambda: es_tx.search_and_highlight_document(keywords=keywords, **search_params)
     )
-    print(f"search_highlight_doc: {response.json()}")
-    if len(response.json()["hits"]["hits"]) == 0:
+    print(f"search_highlight_doc: {data}")
+    if len(data["hits"]["hits"]) == 0:
         return []
 
     return [
         (hit["_source"]["title"],
         hit["highlight"]["content"][0],
         hit["_source"]["s3_url"])
-        for hit in response.json()["hits"]["hits"]
+        for hit in data["hits"]["hits"]
+    ]
+
+def get_passage_search_message(keywords : list, search_params : dict) -> list:
+    """ Search the passages of the textfiles, citing the page of the best passage of each file
+    
+    Arguments:
+        keywords {list} -- list of strings to be searched
+        search_params {dict} -- keyword arguments of search_and_highlight_passages
+    
+    Returns:
+        list -- list in the form
+        [
+            (filename (page n) {str}, highlight {str}, link URL {str}),
+            ...
+        ]
+    """
+
+    data = cached_search(
+        key=("passage", normalize_keywords(keywords), tuple(sorted(search_params.items()))),
+        es_client=es_psg,
+        search=lambda: es_psg.search_and_highlight_passages(keywords=keywords, **search_params)
+    )
+    print(f"search_highlight_passages: {data}")
+
+    return [
+        (f"{hit['_source']['title']} (page {hit['_source']['page']})",
+        hit.get("highlight", {}).get("content", [""])[0],
+        hit["_source"]["s3_url"])
+        for hit in data["hits"]["hits"]
     ]
 
 def get_imagefile_search_message(description : str) -> list:
@@ -72,22 +192,19 @@ def get_imagefile_search_message(description : str) -> list:
     """
     print(f"Starting imagefilesearch using description {description}")
 
-    keywords = description.split()
-    if len(keywords) > 10:
-        keywords = detect_keyphrases(description)
-    print(f"Getting keywords {keywords}")
-    es_im = ImagefileDocument(host=ES_HOST, port=ES_PORT, aws_region=AWS_DEFAULT_REGION)
-    response = es_im.search_document_by_tags(
-        tag_list=keywords,
-        num_of_docs=3
+    keywords = get_keywords(description)
+    data = cached_search(
+        key=("image", normalize_keywords(keywords), (("num_of_docs", 3),)),
+        es_client=es_im,
+        search=lambda: es_im.search_document_by_tags(tag_list=keywords, num_of_docs=3)
     )
-    if len(response.json()["hits"]["hits"]) == 0:
+    if len(data["hits"]["hits"]) == 0:
         return []
     
     return [
         (hit["_source"]["tags"],
         hit["_source"]["s3_url"])
-        for hit in response.json()["hits"]["hits"]
+        for hit in data["hits"]["hits"]
     ]
 
 
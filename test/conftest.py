@@ -54,3 +54,10 @@ def sqs_event():
     with open(testfiles_filepath + "sqs_event.json") as f:
         put_event = json.loads(f.read())
     return put_event
+
+@pytest.fixture
+def es_stub(request):
+    from .es_stub import ESStubServer
+    server = ESStubServer().start()
+    request.addfinalizer(server.stop)
+    return server
@@ -0,0 +1,71 @@
+"""
+A local HTTP stand-in for elasticsearch used by the unit tests and benchmarks
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, dict(self.headers), body))
+        status, payload = self.server.responder(self.command, self.path, self.headers, body)
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _dispatch
+
+
+class ESStubServer(ThreadingMixIn, HTTPServer):
+    """ Threaded HTTP/1.1 server that records requests and counts tcp connections
+
+    The responder is a callable (method, path, headers, body) -> (status, payload)
+    where payload is a json serializable object or raw bytes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, responder=None):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.lock = threading.Lock()
+        self.connection_count = 0
+        self.requests = []
+        self.responder = responder or (lambda method, path, headers, body: (200, {}))
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return "http://127.0.0.1"
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,33 @@
+import gzip
+import json
+
+from bulkencoder import BulkEncoder, dumps_json
+
+def test_encode_index_actions():
+    encoder = BulkEncoder("textfilesearch", "textfile")
+    data = encoder.encode([("a", {"content" : "café"}), ("b", {"content" : "x"})])
+
+    lines = data.decode("UTF-8").split("\n")
+    assert "" == lines[-1]
+    assert {"index" : {"_index" : "textfilesearch", "_type" : "textfile", "_id" : "a"}} == json.loads(lines[0])
+    assert {"content" : "café"} == json.loads(lines[1])
+    assert "b" == json.loads(lines[2])["index"]["_id"]
+    assert data == encoder.encode_action("a", {"content" : "café"}) + encoder.encode_action("b", {"content" : "x"})
+
+def test_encode_delete_actions():
+    data = BulkEncoder("imagefilesearch", "imagefile", op_type="delete").encode(["a", "b"])
+    assert [{"delete" : {"_index" : "imagefilesearch", "_type" : "imagefile", "_id" : pid}} for pid in ["a", "b"]] == \
+        [json.loads(line) for line in data.decode("UTF-8").splitlines()]
+
+def test_dumps_json_falls_back_on_non_string_keys():
+    assert {"1" : "a"} == json.loads(dumps_json({1 : "a"}))
+
+def test_gzip_bulk_body(es_stub):
+    from esclient import TextfileDocument
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    tx._post_bulk(tx.bulk_encoder("delete").encode(["a"]), gzip=True)
+
+    method, path, headers, body = es_stub.requests[0]
+    assert "gzip" == headers["Content-Encoding"]
+    assert {"delete" : {"_index" : "textfilesearch", "_type" : "textfile", "_id" : "a"}} == json.loads(gzip.decompress(body))
@@ -0,0 +1,58 @@
+from cache import TTLCache
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_ttl_cache_expires_entries():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+    cache.set("key", "value")
+    assert "value" == cache.get("key")
+
+    timer.now = 10
+    assert cache.get("key") is None
+    assert {"hits" : 1, "misses" : 1, "evictions" : 0, "size" : 0} == cache.stats()
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=10, timer=FakeTimer())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert 1 == cache.get("a")
+    assert 3 == cache.get("c")
+    assert 1 == cache.evictions
+
+def test_ttl_cache_generation_change_clears_entries():
+    cache = TTLCache(timer=FakeTimer())
+    assert not cache.set_generation((1, 0))
+    cache.set("a", 1)
+    assert not cache.set_generation((1, 0))
+    assert 1 == cache.get("a")
+    assert cache.set_generation((2, 0))
+    assert cache.get("a") is None
+
+def test_tiered_cache_promotes_persistent_hits(tmp_path):
+    from cache import SqliteCache, TieredCache
+
+    path = str(tmp_path / "cache.sqlite3")
+    timer = FakeTimer()
+    cache = TieredCache(TTLCache(maxsize=2, ttl=10), SqliteCache(path, ttl=10, timer=timer))
+    cache.set("key", ["phrase"])
+
+    # a new container process only finds the value in the persistent tier
+    restarted = TieredCache(TTLCache(maxsize=2, ttl=10), SqliteCache(path, ttl=10, timer=timer))
+    assert ["phrase"] == restarted.get("key")
+    assert ["phrase"] == restarted.get("key")
+    assert {"hits" : 1, "misses" : 0, "errors" : 0} == restarted.stats()["persistent"]
+    assert 1 == restarted.stats()["memory"]["hits"]
+
+    timer.now = 10
+    assert None is TieredCache(TTLCache(), SqliteCache(path, ttl=10, timer=timer)).get("key")
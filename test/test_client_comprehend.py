@@ -0,0 +1,76 @@
+import threading
+
+import client_comprehend
+
+class FakeComprehend:
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def batch_detect_sentiment(self, TextList, LanguageCode):
+        with self.lock:
+            self.calls.append(("sentiment", TextList))
+        return {
+            "ResultList" : [{"Index" : index, "Sentiment" : "POSITIVE"} for index, text in enumerate(TextList) if text != "bad"],
+            "ErrorList" : [{"Index" : index, "ErrorCode" : "INTERNAL_SERVER_ERROR", "ErrorMessage" : "failed"} for index, text in enumerate(TextList) if text == "bad"]
+        }
+
+    def batch_detect_key_phrases(self, TextList, LanguageCode):
+        with self.lock:
+            self.calls.append(("keyphrases", TextList))
+        return {"ResultList" : [{"Index" : index, "KeyPhrases" : [{"Text" : text}]} for index, text in enumerate(TextList)], "ErrorList" : []}
+
+    def batch_detect_entities(self, TextList, LanguageCode):
+        raise RuntimeError("throttled")
+
+def test_truncate_utf8():
+    assert "short" == client_comprehend.truncate_utf8("short", max_bytes=5)
+    assert "ab" == client_comprehend.truncate_utf8("abéé", max_bytes=3)
+    assert 5000 >= len(client_comprehend.truncate_utf8("é" * 6000).encode("utf-8"))
+
+def test_batch_detect_chunks_and_maps_by_index(monkeypatch):
+    fake = FakeComprehend()
+    monkeypatch.setattr(client_comprehend, "comprehend", fake)
+
+    text_list = [f"text {i}" for i in range(60)]
+    text_list[3] = "bad"
+    text_list[7] = "  "
+    sentiments = client_comprehend.detect_sentiment_batch(text_list, return_exceptions=True)
+
+    assert 3 == len(fake.calls)
+    assert [25, 25, 9] == sorted((len(texts) for name, texts in fake.calls), reverse=True)
+    assert isinstance(sentiments[3], client_comprehend.ComprehendItemError)
+    assert 3 == sentiments[3].index
+    assert None is sentiments[7]
+    assert ["POSITIVE"] * 5 == sentiments[8:13]
+
+    fake.calls.clear()
+    enrichments = client_comprehend.enrich_texts(["first", "second"])
+    assert [{"keyphrases" : ["first"], "sentiment" : "POSITIVE"}, {"keyphrases" : ["second"], "sentiment" : "POSITIVE"}] == enrichments
+    assert 2 == len(fake.calls)
+
+def test_detect_keyphrases_is_cached_by_content_hash(monkeypatch, tmp_path):
+    calls = []
+    class SingleComprehend:
+        def detect_key_phrases(self, Text, LanguageCode):
+            calls.append(Text)
+            return {"KeyPhrases" : [{"Text" : Text.split()[0]}]}
+    monkeypatch.setattr(client_comprehend, "comprehend", SingleComprehend())
+    monkeypatch.setattr(client_comprehend, "detect_cache", client_comprehend.create_detect_cache(str(tmp_path / "cache.sqlite3")))
+
+    assert ["repeated"] == client_comprehend.detect_keyphrases("repeated description")
+    assert ["repeated"] == client_comprehend.detect_keyphrases("repeated description")
+    assert ["other"] == client_comprehend.detect_keyphrases("other description")
+    assert ["repeated description", "other description"] == calls
+    assert client_comprehend.detect_cache_key("keyphrases", "text") != client_comprehend.detect_cache_key("entities", "text")
+
+def test_detect_cache_is_created_on_first_use(monkeypatch, tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    monkeypatch.setattr(client_comprehend, "detect_cache", None)
+    monkeypatch.setattr(client_comprehend, "create_detect_cache", lambda: client_comprehend.TieredCache(client_comprehend.TTLCache(maxsize=8, ttl=60), client_comprehend.SqliteCache(str(path), ttl=60)))
+    assert not path.exists()
+
+    cache = client_comprehend.get_detect_cache()
+    assert path.exists()
+    assert cache is client_comprehend.get_detect_cache()
@@ -0,0 +1,63 @@
+import client_rekognition
+
+def test_iter_image_analyses_isolates_failures(monkeypatch):
+    def detect_text(s3_tuple, **params):
+        if s3_tuple[1] == "bad.jpg":
+            raise RuntimeError("throttled")
+        return [f"text of {s3_tuple[1]}"]
+
+    monkeypatch.setattr(client_rekognition, "detect_labels", lambda s3_tuple, **params: [f"label of {s3_tuple[1]}"])
+    monkeypatch.setattr(client_rekognition, "detect_text", detect_text)
+    monkeypatch.setattr(client_rekognition, "recognize_celebrities", lambda s3_tuple, **params: [])
+
+    s3_tuple_list = [("bucket", "good.jpg", 10), ("bucket", "bad.jpg", 10)]
+    results = list(client_rekognition.iter_image_analyses(s3_tuple_list, max_workers=6, max_tps=0))
+
+    assert s3_tuple_list == [s3_tuple for s3_tuple, analysis in results]
+    good, bad = [analysis for s3_tuple, analysis in results]
+    assert {"labels" : ["label of good.jpg"], "texts" : ["text of good.jpg"], "celebrities" : [], "errors" : {}} == good
+    assert ["label of bad.jpg"] == bad["labels"]
+    assert [] == bad["texts"]
+    assert {"texts" : "throttled"} == bad["errors"]
+
+def test_iter_image_analyses_reuses_stored_analyses(monkeypatch, tmp_path):
+    from cache import DirectoryJSONStore
+
+    calls = []
+    def detect_labels(s3_tuple, **params):
+        calls.append(s3_tuple[1])
+        return [f"label of {s3_tuple[1]}"]
+
+    monkeypatch.setattr(client_rekognition, "detect_labels", detect_labels)
+    monkeypatch.setattr(client_rekognition, "detect_text", lambda s3_tuple, **params: [])
+    monkeypatch.setattr(client_rekognition, "recognize_celebrities", lambda s3_tuple, **params: [])
+
+    store = DirectoryJSONStore(str(tmp_path))
+    s3_tuple_list = [("bucket", "a.jpg", 10, '"etag-a"'), ("bucket", "b.jpg", 10, None)]
+    first = list(client_rekognition.iter_image_analyses(s3_tuple_list, max_tps=0, store=store))
+    second = list(client_rekognition.iter_image_analyses(s3_tuple_list, max_tps=0, store=store))
+
+    assert first == second
+    # the object without an etag has no stable identity and is analyzed every time
+    assert ["a.jpg", "b.jpg", "b.jpg"] == calls
+    assert 1 == store.hits
+
+    list(client_rekognition.iter_image_analyses(s3_tuple_list[:1], max_tps=0, min_confidence=0.5, store=store))
+    assert "a.jpg" == calls[-1]
+
+def test_iter_image_analyses_limits_each_api_on_its_own(monkeypatch):
+    limiters = []
+    class RateLimiter:
+        def __init__(self, max_tps):
+            self.max_tps = max_tps
+            self.acquired = 0
+            limiters.append(self)
+        def acquire(self):
+            self.acquired += 1
+    monkeypatch.setattr(client_rekognition, "RateLimiter", RateLimiter)
+    for name in ["detect_labels", "detect_text", "recognize_celebrities"]:
+        monkeypatch.setattr(client_rekognition, name, lambda s3_tuple, **params: [])
+
+    s3_tuple_list = [("bucket", f"{i}.jpg", 10) for i in range(4)]
+    list(client_rekognition.iter_image_analyses(s3_tuple_list, max_tps=50))
+    assert [(50, 4)] * 3 == [(limiter.max_tps, limiter.acquired) for limiter in limiters]
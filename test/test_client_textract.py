@@ -0,0 +1,105 @@
+import json
+
+import client_textract
+import lambda_es_indexing
+
+class FakeTextract:
+    """ Local stand-in for the asynchronous textract api, returning the blocks of a job two at a time """
+
+    def __init__(self, blocks : list, status : str = "SUCCEEDED"):
+        self.blocks = blocks
+        self.status = status
+        self.started = []
+        self.pages_requested = 0
+
+    def start_document_text_detection(self, **kwargs):
+        self.started.append(kwargs)
+        return {"JobId" : f"job-{len(self.started)}"}
+
+    def get_document_text_detection(self, JobId, MaxResults, NextToken=None):
+        self.pages_requested += 1
+        if self.status != "SUCCEEDED":
+            return {"JobStatus" : self.status, "StatusMessage" : "unreadable", "Blocks" : []}
+        start = int(NextToken or 0)
+        response = {"JobStatus" : self.status, "Blocks" : self.blocks[start:start + 2]}
+        if start + 2 < len(self.blocks):
+            response["NextToken"] = str(start + 2)
+        return response
+
+BLOCKS = [
+    {"BlockType" : "PAGE", "Page" : 1},
+    {"BlockType" : "LINE", "Page" : 1, "Text" : "first line"},
+    {"BlockType" : "WORD", "Page" : 1, "Text" : "first"},
+    {"BlockType" : "LINE", "Page" : 1, "Text" : "second line"},
+    {"BlockType" : "PAGE", "Page" : 2},
+    {"BlockType" : "PAGE", "Page" : 3},
+    {"BlockType" : "LINE", "Page" : 3, "Text" : "last page"}
+]
+
+def completion_event(status : str = "SUCCEEDED") -> dict:
+    return {"Records" : [{"EventSource" : "aws:sns", "Sns" : {"Message" : json.dumps({
+        "JobId" : "job-1",
+        "Status" : status,
+        "JobTag" : "2048:abc",
+        "DocumentLocation" : {"S3Bucket" : "bucket", "S3ObjectName" : "scan.pdf"}
+    })}}]}
+
+def test_start_and_collect_text_detection(monkeypatch):
+    fake = FakeTextract(BLOCKS)
+    monkeypatch.setattr(client_textract, "textract", fake)
+
+    job_id = client_textract.start_text_detection(("bucket", "docs/scan.pdf", 2048, '"abc"'), sns_topic_arn="topic", role_arn="role")
+    assert "job-1" == job_id
+    assert "2048:abc" == fake.started[0]["JobTag"]
+    assert {"SNSTopicArn" : "topic", "RoleArn" : "role"} == fake.started[0]["NotificationChannel"]
+
+    # identical files under other keys or buckets get their own job
+    client_textract.start_text_detection(("bucket", "archive/x/quarterly-report.pdf", 2048, '"abc"'))
+    client_textract.start_text_detection(("bucket", "current/x/quarterly-report.pdf", 2048, '"abc"'))
+    client_textract.start_text_detection(("other", "current/x/quarterly-report.pdf", 2048, '"abc"'))
+    tokens = [started["ClientRequestToken"] for started in fake.started]
+    assert len(tokens) == len(set(tokens))
+    assert all(len(token) <= 64 for token in tokens)
+
+    assert ["first line\nsecond line", "", "last page"] == client_textract.get_text_detection_pages(job_id)
+    assert 4 == fake.pages_requested
+
+    completion = client_textract.parse_completion_record(completion_event()["Records"][0])
+    assert ("bucket", "scan.pdf", 2048, "abc") == completion["s3_tuple"]
+
+def test_failed_job_raises(monkeypatch):
+    import pytest
+
+    monkeypatch.setattr(client_textract, "textract", FakeTextract(BLOCKS, status="FAILED"))
+    with pytest.raises(client_textract.TextractJobError):
+        client_textract.get_text_detection_pages("job-1")
+
+def test_handle_textract_completion(monkeypatch):
+    monkeypatch.setattr(lambda_es_indexing, "get_text_detection_pages", lambda job_id: ["page one", "page two"])
+    indexed = []
+    def put_textfiles(s3_tuple_list, extracted=None, failures=None):
+        indexed.extend(extracted)
+        return lambda_es_indexing.BulkSummary()
+    monkeypatch.setattr(lambda_es_indexing, "put_textfiles", put_textfiles)
+    monkeypatch.setattr(lambda_es_indexing.es_tx, "ensure_index", lambda: False)
+
+    response = lambda_es_indexing.lambda_handler(completion_event(), {})
+    assert 200 == response["statusCode"]
+    assert [(("bucket", "scan.pdf", 2048, "abc"), "page one\npage two", {})] == indexed
+
+    assert 500 == lambda_es_indexing.lambda_handler(completion_event("FAILED"), {})["statusCode"]
+
+def test_files_without_extracted_text_fall_back_to_textract(monkeypatch):
+    started = []
+    monkeypatch.setattr(lambda_es_indexing, "TEXTRACT_SNS_TOPIC_ARN", "topic")
+    monkeypatch.setattr(lambda_es_indexing, "start_text_detection", lambda s3_tuple: started.append(s3_tuple) or "job-1")
+    texts = {"scan.pdf" : ["", " \n"], "report.pdf" : ["text"], "empty.txt" : [""]}
+    monkeypatch.setattr(lambda_es_indexing, "iter_file_texts_from_s3", lambda s3_tuple_list, keep_pages, deadline=None: ((s3_tuple, texts[s3_tuple[1]]) for s3_tuple in s3_tuple_list))
+
+    s3_tuple_list = [("bucket", key, 10, "abc") for key in texts]
+    handed_off = set()
+    extracted = list(lambda_es_indexing.iter_extracted_texts(s3_tuple_list, keep_pages=True, enrich=False, handed_off=handed_off))
+
+    assert [s3_tuple_list[0]] == started
+    assert {("bucket", "scan.pdf")} == handed_off
+    assert ["report.pdf", "empty.txt"] == [s3_tuple[1] for s3_tuple, pages, enrichment in extracted]
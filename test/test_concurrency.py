@@ -0,0 +1,109 @@
+import threading
+import time
+
+from concurrency import ordered_map, Deadline
+
+def test_ordered_map_keeps_order_and_overlaps_calls():
+    def slow_square(x):
+        time.sleep(0.1 * (5 - x))
+        return x * x
+
+    start = time.perf_counter()
+    assert [0, 1, 4, 9, 16] == list(ordered_map(slow_square, range(5), max_workers=5))
+    assert time.perf_counter() - start < 0.9
+
+def test_ordered_map_respects_byte_budget():
+    lock = threading.Lock()
+    outstanding = [0, 0]
+
+    def fetch(size):
+        with lock:
+            outstanding[0] += size
+            outstanding[1] = max(outstanding)
+        time.sleep(0.05)
+        return size
+
+    results = []
+    for size in ordered_map(fetch, [40, 40, 40, 100, 10], max_workers=4, weight=lambda size: size, budget=100):
+        results.append(size)
+        with lock:
+            outstanding[0] -= size
+
+    assert [40, 40, 40, 100, 10] == results
+    assert outstanding[1] <= 100
+
+def test_ordered_map_raises_failed_call():
+    def fail_on_two(x):
+        if x == 2:
+            raise ValueError(x)
+        return x
+
+    results = []
+    try:
+        for x in ordered_map(fail_on_two, range(4), max_workers=2):
+            results.append(x)
+    except ValueError:
+        pass
+    assert [0, 1] == results
+
+def test_rate_limiter_spaces_calls():
+    from concurrency import RateLimiter
+
+    class FakeClock:
+        def __init__(self):
+            self.now = 0.0
+            self.sleeps = []
+        def timer(self):
+            return self.now
+        def sleep(self, seconds):
+            self.sleeps.append(seconds)
+
+    clock = FakeClock()
+    limiter = RateLimiter(max_tps=4, timer=clock.timer, sleep=clock.sleep)
+    for _ in range(3):
+        limiter.acquire()
+    assert [0.25, 0.5] == clock.sleeps
+
+def test_prefetch_overlaps_and_bounds_the_producer():
+    import pytest
+    from concurrency import prefetch
+
+    produced = []
+    def produce():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    items = prefetch(produce(), maxsize=3)
+    assert 0 == next(items)
+    time.sleep(0.3)
+    # the producer ran ahead of the consumer but no further than the queue allows
+    assert 3 <= len(produced) <= 5
+    items.close()
+    time.sleep(0.3)
+    assert len(produced) <= 5
+
+    def fail():
+        yield 1
+        raise RuntimeError("extraction failed")
+    items = prefetch(fail(), maxsize=3)
+    assert 1 == next(items)
+    with pytest.raises(RuntimeError):
+        next(items)
+
+def test_deadline():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 5000
+
+    now = [100.0]
+    clock = lambda: now[0]
+
+    assert not Deadline({}, margin_ms=10 ** 9).reached()
+    deadline = Deadline(Context(), margin_ms=4000, clock=clock)
+    assert not deadline.reached()
+    assert deadline.reached(margin_ms=5001)
+    now[0] += 1.5
+    assert 3500 == deadline.remaining_ms()
+    assert deadline.reached()
+    assert not deadline.reached(margin_ms=3500)
@@ -72,4 +72,156 @@ def test_create_document_bulk(textfile_document, s3_tuple_list, example_textfile
     response = tx.query_all()
     assert len(example_textfile_data_list) == response.json()["hits"]["total"]
     
-    
\ No newline at end of file
+    
+def test_session_is_shared_and_pooled(es_stub):
+    from esclient import get_session, ImagefileDocument
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    im = ImagefileDocument(host=es_stub.host, port=es_stub.port)
+    assert tx.session is im.session is get_session()
+
+    for _ in range(5):
+        tx.search_document(body={"query" : {"match_all" : {}}})
+        im.search_document(body={"query" : {"match_all" : {}}})
+
+    assert 10 == len(es_stub.requests)
+    assert 1 == es_stub.connection_count
+
+def test_put_document_stream_retries_rejected_items(es_stub):
+    import json
+
+    attempts = []
+    def responder(method, path, headers, body):
+        lines = body.decode("UTF-8").splitlines()
+        pids = [json.loads(line)["index"]["_id"] for line in lines[::2]]
+        attempts.append(pids)
+        items = []
+        for pid in pids:
+            if pid == "rejected" and len(attempts) == 1:
+                items.append({"index" : {"_id" : pid, "status" : 429, "error" : {"type" : "es_rejected_execution_exception"}}})
+            elif pid == "invalid":
+                items.append({"index" : {"_id" : pid, "status" : 400, "error" : {"type" : "mapper_parsing_exception"}}})
+            else:
+                items.append({"index" : {"_id" : pid, "status" : 201}})
+        return 200, {"errors" : True, "items" : items}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    documents = ((pid, {"content" : pid}) for pid in ["ok", "rejected", "invalid"])
+    summary = tx.put_document_stream(documents, backoff=0)
+
+    assert [["ok", "rejected", "invalid"], ["rejected"]] == attempts
+    assert 2 == summary.success
+    assert 1 == summary.retried
+    assert [("invalid", 400, "mapper_parsing_exception")] == summary.errors
+
+def test_put_document_stream_chunks_by_count_and_bytes(es_stub):
+    import json
+
+    def responder(method, path, headers, body):
+        lines = body.decode("UTF-8").splitlines()
+        return 200, {"items" : [{"index" : {"_id" : json.loads(line)["index"]["_id"], "status" : 201}} for line in lines[::2]]}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    summary = tx.put_document_stream(((str(i), {"content" : "x" * 100}) for i in range(5)), max_chunk_docs=2)
+    assert 5 == summary.success
+    assert 3 == summary.chunks
+
+    summary = tx.put_document_stream(((str(i), {"content" : "x" * 100}) for i in range(5)), max_chunk_bytes=250)
+    assert 5 == summary.success
+    assert 5 == summary.chunks
+
+def test_ensure_index_once_per_container(es_stub):
+    indices = set()
+    def responder(method, path, headers, body):
+        if method == "HEAD":
+            return (200 if path in indices else 404), b""
+        if method == "PUT" and path == "/textfilesearch":
+            indices.add(path)
+        return 200, {"acknowledged" : True}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    tx.invalidate_index_cache()
+    assert tx.ensure_index()
+    assert not tx.ensure_index()
+    assert [("HEAD", "/textfilesearch"), ("PUT", "/textfilesearch")] == [request[:2] for request in es_stub.requests]
+
+    tx.invalidate_index_cache()
+    assert tx.ensure_index()
+    assert ("PUT", "/textfilesearch/_mapping/textfile") == es_stub.requests[-1][:2]
+    tx.invalidate_index_cache()
+
+def test_ensure_index_with_template_updates_an_existing_mapping(es_stub):
+    es_stub.responder = lambda method, path, headers, body: (200, {"acknowledged" : True} if method != "HEAD" else b"")
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    tx.invalidate_index_cache()
+    assert tx.ensure_index(index_template="legacy")
+    assert [("PUT", "/_template/textfilesearch"), ("HEAD", "/textfilesearch"), ("PUT", "/textfilesearch/_mapping/textfile")] == [request[:2] for request in es_stub.requests]
+    tx.invalidate_index_cache()
+
+def test_scan_iterates_every_page(es_stub):
+    import json
+
+    pages = [[{"_id" : "1"}, {"_id" : "2"}], [{"_id" : "3"}], []]
+    def responder(method, path, headers, body):
+        if method == "DELETE":
+            return 200, {"succeeded" : True}
+        return 200, {"_scroll_id" : "scroll", "hits" : {"hits" : pages.pop(0)}}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    hits = tx.scan(source=["title"], size=2)
+    assert ["1", "2", "3"] == [hit["_id"] for hit in hits]
+
+    first_body = json.loads(es_stub.requests[0][3])
+    assert 2 == first_body["size"]
+    assert ["title"] == first_body["_source"]
+    assert "/textfilesearch/textfile/_search?scroll=1m" == es_stub.requests[0][1]
+    assert ("DELETE", "/_search/scroll") == es_stub.requests[-1][:2]
+
+def test_delete_document_by_query_polls_task(es_stub):
+    polls = []
+    def responder(method, path, headers, body):
+        if path.startswith("/_tasks/"):
+            polls.append(path)
+            return 200, {"completed" : len(polls) > 1, "response" : {"deleted" : 3}}
+        return 200, {"task" : "node:1"}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    res = tx.delete_document_by_query({"query" : {"match_all" : {}}}, wait_for_completion=False, poll_task=True, poll_interval=0)
+    assert 3 == res.json()["response"]["deleted"]
+    assert "/textfilesearch/textfile/_delete_by_query?slices=auto&conflicts=proceed&wait_for_completion=false" == es_stub.requests[0][1]
+    assert ["/_tasks/node:1", "/_tasks/node:1"] == polls
+
+    es_stub.responder = lambda method, path, headers, body: (200, {"completed" : False} if path.startswith("/_tasks/") else {"task" : "node:2"})
+    with pytest.raises(TimeoutError):
+        tx.wait_for_task("node:2", poll_interval=0.05, max_wait=0.2)
+
+def test_highlighter_mapping_and_search_body(es_stub):
+    import json
+    from esclient import TextfilePassageDocument
+
+    es_stub.responder = lambda method, path, headers, body: (200, {"hits" : {"total" : 0, "hits" : []}})
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port, highlighter="fvh")
+    assert "with_positions_offsets" == tx.mapping["properties"]["content"]["term_vector"]
+    assert "index.highlight.max_analyzed_offset" in tx.settings
+    tx.search_and_highlight_document(keywords=["dummy"])
+    assert "fvh" == json.loads(es_stub.requests[-1][3])["highlight"]["fields"]["content"]["type"]
+
+    psg = TextfilePassageDocument(host=es_stub.host, port=es_stub.port, highlighter="unified")
+    assert "offsets" == psg.mapping["properties"]["content"]["index_options"]
+    psg.search_and_highlight_passages(keywords=["dummy"])
+    body = json.loads(es_stub.requests[-1][3])
+    assert "unified" == body["highlight"]["fields"]["content"]["type"]
+    assert {"field" : "parent_id"} == body["collapse"]
+
+    # the default keeps the content mapping of indices created before the highlighter option
+    assert {"type" : "text"} == TextfileDocument(host=es_stub.host, port=es_stub.port).mapping["properties"]["content"]
+
+    with pytest.raises(ValueError):
+        TextfileDocument(highlighter="postings")
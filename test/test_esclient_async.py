@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+
+from esclient_async import AsyncTextfileDocument, run
+
+def test_put_document_stream_keeps_chunks_in_flight(es_stub):
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    def responder(method, path, headers, body):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.2)
+        with lock:
+            in_flight[0] -= 1
+        lines = body.decode("UTF-8").splitlines()
+        return 200, {"items" : [{"index" : {"_id" : json.loads(line)["index"]["_id"], "status" : 201}} for line in lines[::2]]}
+    es_stub.responder = responder
+
+    tx = AsyncTextfileDocument(host=es_stub.host, port=es_stub.port, max_concurrency=4)
+    start = time.perf_counter()
+    summary = run(tx.put_document_stream(((str(i), {"content" : "text"}) for i in range(8)), max_chunk_docs=1))
+    elapsed = time.perf_counter() - start
+    tx.close()
+
+    assert 8 == summary.success
+    assert 8 == summary.chunks
+    assert 4 == in_flight[1]
+    assert elapsed < 1.0
+
+def test_concurrent_searches(es_stub):
+    import asyncio
+
+    tx = AsyncTextfileDocument(host=es_stub.host, port=es_stub.port)
+
+    async def search_all():
+        return await asyncio.gather(*[tx.search_and_highlight_document(keywords=[str(i)]) for i in range(3)])
+
+    responses = run(search_all())
+    tx.close()
+    assert [200, 200, 200] == [res.status_code for res in responses]
+    assert 3 == len(es_stub.requests)
+
+def test_put_document_stream_pulls_documents_off_the_event_loop(es_stub):
+    def responder(method, path, headers, body):
+        lines = body.decode("UTF-8").splitlines()
+        return 200, {"items" : [{"index" : {"_id" : json.loads(line)["index"]["_id"], "status" : 201}} for line in lines[::2]]}
+    es_stub.responder = responder
+
+    threads = set()
+    def documents():
+        for i in range(3):
+            threads.add(threading.current_thread())
+            yield str(i), {"content" : "text"}
+
+    tx = AsyncTextfileDocument(host=es_stub.host, port=es_stub.port)
+    summary = run(tx.put_document_stream(documents(), max_chunk_docs=1))
+    tx.close()
+
+    assert 3 == summary.success
+    assert threading.current_thread() not in threads
@@ -0,0 +1,36 @@
+import json
+import os
+
+from eventparser import iter_s3_records, parse_sqs_message, S3Record
+
+EVENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "events")
+
+def load_event(name : str) -> dict:
+    with open(os.path.join(EVENTS_DIR, name)) as f:
+        return json.load(f)
+
+def test_iter_s3_records_of_s3_event():
+    records = list(iter_s3_records(load_event("s3_event.json")))
+    assert ("example-bucket", "test_docx.docx", 1024, None) == records[0].s3_tuple
+    assert "ObjectCreated:Put" == records[0].event_name
+
+def test_iter_s3_records_of_sqs_event_expands_every_record():
+    s3_records = [
+        {"eventName" : "ObjectCreated:Put", "s3" : {"bucket" : {"name" : "bucket"}, "object" : {"key" : "my+report%281%29.pdf", "size" : 10, "eTag" : "abc", "sequencer" : "01"}}},
+        {"eventName" : "ObjectRemoved:Delete", "s3" : {"bucket" : {"name" : "bucket"}, "object" : {"key" : "old.txt", "sequencer" : "02"}}}
+    ]
+    event = {"Records" : [
+        {"messageId" : "m1", "eventSource" : "aws:sqs", "body" : json.dumps({"Records" : s3_records})},
+        {"messageId" : "m2", "eventSource" : "aws:sqs", "body" : json.dumps({"Service" : "Amazon S3", "Event" : "s3:TestEvent", "Bucket" : "bucket"})}
+    ]}
+
+    records = list(iter_s3_records(event))
+    assert [
+        S3Record("m1", "ObjectCreated:Put", "bucket", "my report(1).pdf", 10, "abc", "01"),
+        S3Record("m1", "ObjectRemoved:Delete", "bucket", "old.txt", 0, None, "02")
+    ] == records
+    assert [False, True] == [record.is_removed for record in records]
+    assert [] == parse_sqs_message(event["Records"][1])
+
+    # the sample event carries already decoded bodies
+    assert ["test_pdf.pdf", "test_txt.txt"] == [record.key for record in iter_s3_records(load_event("sqs_event.json"))][:2]
@@ -1,3 +1,4 @@
+import pytest
 from fileprocess import *
 
 def test_get_pdf_text_from_path(logger, testfiles_filepath):
@@ -41,4 +42,144 @@ def test_get_pdf_text_binary_data(logger, pdf_binary_data):
 def test_get_txt_text_binary_data(logger, txt_binary_data):
     expected_text = "This is a dummy txt file."
     text = get_txt_text_from_binary_data(txt_binary_data)
-    assert text == expected_text  
\ No newline at end of file
+    assert text == expected_text
+
+
+class FakeS3:
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_object(self, Bucket, Key):
+        return {"Body" : io.BytesIO(self.data), "ContentLength" : len(self.data)}
+
+def test_get_binary_data_from_file_in_s3_spools_to_disk(monkeypatch):
+    import fileprocess
+    monkeypatch.setattr(fileprocess, "s3", FakeS3(b"x" * 100))
+
+    binary_data = get_binary_data_from_file_in_s3("bucket", "small.txt", spool_threshold=1000, chunk_size=16)
+    assert not binary_data._rolled
+    assert b"x" * 100 == binary_data.read()
+
+    binary_data = get_binary_data_from_file_in_s3("bucket", "large.txt", spool_threshold=50, chunk_size=16)
+    assert binary_data._rolled
+    assert b"x" * 100 == binary_data.read()
+
+    binary_data = get_binary_data_from_file_in_s3("bucket", "capped.txt", max_bytes=40, chunk_size=16)
+    assert b"x" * 40 == binary_data.read()
+
+    # a cut off pdf could not be parsed
+    with pytest.raises(ObjectTooLargeError):
+        get_binary_data_from_file_in_s3("bucket", "capped.pdf", max_bytes=40, chunk_size=16)
+
+def test_get_txt_text_decodes_incrementally_and_truncates():
+    data = "héllo wörld ".encode("UTF-8") * 10
+    assert "héllo wörld " * 10 == get_txt_text_from_binary_data(io.BytesIO(data), chunk_size=3) + " "
+    assert "héllo" == get_txt_text_from_binary_data(io.BytesIO(data), max_chars=5, chunk_size=3)
+    # a multi byte character cut by a byte cap is dropped instead of failing
+    assert "h" == get_txt_text_from_binary_data(io.BytesIO(data[:2]), chunk_size=1)
+
+def make_large_pdf(testfiles_filepath, copies):
+    import PyPDF2
+    reader = PyPDF2.PdfFileReader(open(testfiles_filepath + "fw4.pdf", "rb"))
+    writer = PyPDF2.PdfFileWriter()
+    for _ in range(copies):
+        for i in range(reader.numPages):
+            writer.addPage(reader.getPage(i))
+    binary_data = io.BytesIO()
+    writer.write(binary_data)
+    binary_data.seek(0)
+    return binary_data
+
+def test_get_file_texts_from_binary_data_list_in_parallel(testfiles_filepath, pdf_binary_data, txt_binary_data):
+    large_pdf = make_large_pdf(testfiles_filepath, copies=3)
+    expected_large_text = get_pdf_text_from_binary_data(large_pdf)
+    large_pdf.seek(0)
+
+    texts = get_file_texts_from_binary_data_list(
+        ["pdf", "pdf", "txt", "pdf"],
+        [large_pdf, pdf_binary_data, txt_binary_data, io.BytesIO(b"not a pdf")],
+        max_workers=2,
+        min_parallel_pages=4,
+        return_exceptions=True
+    )
+
+    assert expected_large_text == texts[0]
+    assert "This is a dummy PDF" == texts[1]
+    assert "This is a dummy txt file." == texts[2]
+    assert isinstance(texts[3], ValueError)
+
+def test_get_file_texts_from_spilled_spooled_files(testfiles_filepath):
+    import tempfile
+
+    large_pdf = make_large_pdf(testfiles_filepath, copies=3)
+    expected_large_text = get_pdf_text_from_binary_data(large_pdf)
+
+    for max_workers in [1, 2]:
+        spooled_list = []
+        for _ in range(2):
+            spooled = tempfile.SpooledTemporaryFile(max_size=1024)
+            spooled.write(large_pdf.getvalue())
+            spooled.seek(0)
+            spooled_list.append(spooled)
+        assert all(spooled._rolled for spooled in spooled_list)
+
+        texts = get_file_texts_from_binary_data_list(["pdf", "pdf"], spooled_list, max_workers=max_workers, min_parallel_pages=4)
+        assert [expected_large_text, expected_large_text] == texts
+        for spooled in spooled_list:
+            spooled.close()
+
+def test_a_worker_that_does_not_answer_is_replaced_in_process(monkeypatch, testfiles_filepath):
+    import time
+    import fileprocess
+
+    large_pdf = make_large_pdf(testfiles_filepath, copies=3)
+    expected_large_text = get_pdf_text_from_binary_data(large_pdf)
+    monkeypatch.setattr(fileprocess, "_extract_units", lambda conn, units: time.sleep(60))
+
+    texts = get_file_texts_from_binary_data_list(["pdf"], [large_pdf], max_workers=2, min_parallel_pages=4, timeout=0.5)
+    assert [expected_large_text] == texts
+
+def test_no_worker_is_forked_while_other_threads_run(monkeypatch, testfiles_filepath):
+    import threading
+    import multiprocessing
+
+    def get_context(method=None):
+        raise AssertionError("forked while another thread was running")
+    monkeypatch.setattr(multiprocessing, "get_context", get_context)
+
+    large_pdf = make_large_pdf(testfiles_filepath, copies=3)
+    expected_large_text = get_pdf_text_from_binary_data(large_pdf)
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        texts = get_file_texts_from_binary_data_list(["pdf"], [large_pdf], max_workers=2, min_parallel_pages=4)
+    finally:
+        stop.set()
+        thread.join()
+    assert [expected_large_text] == texts
+
+def test_extractor_registry(pdf_binary_data, txt_binary_data):
+    import pytest
+
+    assert set(["pdf", "txt"]) <= supported_extensions()
+    assert "This is a dummy PDF" == get_file_text_from_binary_data("PDF", pdf_binary_data)
+
+    pdf_binary_data.seek(0)
+    assert "pdf" == sniff_extension(pdf_binary_data)
+    assert "This is a dummy PDF" == get_file_text_from_binary_data("bin", pdf_binary_data)
+    assert "This is a dummy txt file." == get_file_text_from_binary_data(None, txt_binary_data, filename="notes.txt")
+
+    with pytest.raises(UnsupportedFileTypeError):
+        get_file_text_from_binary_data("bin", io.BytesIO(b"\x00\x01"))
+
+def test_split_into_passages():
+    pages = ["alpha beta gamma delta", "", "  epsilon zeta"]
+    passages = split_into_passages(pages, max_chars=11)
+    assert ["alpha beta", "gamma delta", "epsilon", "zeta"] == [passage["content"] for passage in passages]
+    assert [1, 1, 3, 3] == [passage["page"] for passage in passages]
+
+    text = "\n".join(pages)
+    for passage in passages:
+        assert text[passage["offset"]:].startswith(passage["content"])
@@ -0,0 +1,334 @@
+import json
+
+import lambda_es_indexing
+from esclient import TextfileDocument
+
+def test_filter_changed_s3_tuples(es_stub):
+    def responder(method, path, headers, body):
+        docs = json.loads(body)["docs"]
+        return 200, {"docs" : [
+            {"_id" : doc["_id"], "found" : True, "_source" : {"etag" : "same", "filesize" : 10}} if doc["_id"] != "bucket-new.pdf" else
+            {"_id" : doc["_id"], "found" : False} for doc in docs
+        ]}
+    es_stub.responder = responder
+    lambda_es_indexing.etag_cache.clear()
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    s3_tuple_list = [
+        ("bucket", "same.pdf", 10, '"same"'),
+        ("bucket", "changed.pdf", 10, '"other"'),
+        ("bucket", "resized.pdf", 11, '"same"'),
+        ("bucket", "unknown.pdf", 10, None),
+        ("bucket", "new.pdf", 10, '"same"')
+    ]
+    new_pids = set()
+    changed = lambda_es_indexing.filter_changed_s3_tuples(tx, s3_tuple_list, new_pids=new_pids)
+    assert s3_tuple_list[1:] == changed
+    assert {"bucket-new.pdf"} == new_pids
+    assert 1 == len(es_stub.requests)
+    assert ["etag", "filesize"] == json.loads(es_stub.requests[0][3])["docs"][0]["_source"]
+
+    # the unchanged object is now answered by the warm container cache
+    assert [] == lambda_es_indexing.filter_changed_s3_tuples(tx, s3_tuple_list[:1])
+    assert 1 == len(es_stub.requests)
+
+def test_iter_textfile_passage_actions(monkeypatch):
+    s3_tuple = ("bucket", "notes.txt", 10, '"etag"')
+    monkeypatch.setattr(lambda_es_indexing, "iter_file_texts_from_s3", lambda s3_tuple_list, keep_pages, deadline=None: iter([(s3_tuple, ["first page", "second page"])]))
+
+    actions = list(lambda_es_indexing.iter_textfile_passage_actions([s3_tuple]))
+    parent_pid = lambda_es_indexing.es_tx.create_pid(s3_tuple)
+    assert [parent_pid, f"{parent_pid}#0", f"{parent_pid}#1"] == [pid for pid, action in actions]
+
+    header, source = actions[2][1].decode("utf-8").splitlines()
+    assert "textfilepassages" == json.loads(header)["index"]["_index"]
+    assert {"parent_id" : parent_pid, "page" : 2, "offset" : 11, "content" : "second page"}.items() <= json.loads(source).items()
+    assert None is json.loads(actions[0][1].decode("utf-8").splitlines()[1])["content"]
+
+    assert [parent_pid, parent_pid] == lambda_es_indexing.get_parent_pids([parent_pid, f"{parent_pid}#1"])
+
+def test_iter_extracted_texts_enriches_in_batches(monkeypatch):
+    s3_tuple_list = [("bucket", f"{i}.txt", 10) for i in range(30)]
+    batches = []
+    def enrich_texts(text_list):
+        batches.append(len(text_list))
+        return [{"sentiment" : "NEUTRAL"} for text in text_list]
+    monkeypatch.setattr(lambda_es_indexing, "iter_file_texts_from_s3", lambda s3_tuple_list, keep_pages, deadline=None: ((s3_tuple, s3_tuple[1]) for s3_tuple in s3_tuple_list))
+    monkeypatch.setattr(lambda_es_indexing, "enrich_texts", enrich_texts)
+
+    items = list(lambda_es_indexing.iter_extracted_texts(s3_tuple_list, enrich=True))
+    assert [25, 5] == batches
+    assert [s3_tuple[1] for s3_tuple in s3_tuple_list] == [text for s3_tuple, text, enrichment in items]
+    assert all({"sentiment" : "NEUTRAL"} == enrichment for s3_tuple, text, enrichment in items)
+
+def test_pages_are_enriched_beyond_the_first_page(monkeypatch):
+    enriched = []
+    monkeypatch.setattr(lambda_es_indexing, "enrich_texts", lambda text_list: enriched.extend(text_list) or [{} for text in text_list])
+
+    pages = ["", "cover", "a" * 3000, "b" * 3000, "c" * 3000]
+    lambda_es_indexing.enrich_extracted_texts([(("bucket", "doc.pdf", 10), pages)])
+
+    # a blank first page is not all comprehend reads, and pages past BATCH_MAX_DOCUMENT_BYTES are not joined
+    assert ["\ncover\n" + "a" * 3000 + "\n" + "b" * 3000] == enriched
+
+def test_handle_sqs_trigger_reports_only_failed_messages(monkeypatch, es_stub):
+    from esclient_async import AsyncESClientBase
+
+    def responder(method, path, headers, body):
+        if path.endswith("/_mget"):
+            return 200, {"docs" : []}
+        if path == "/_bulk":
+            lines = body.decode("UTF-8").splitlines()
+            items = []
+            for line in lines[::2]:
+                pid = json.loads(line)["index"]["_id"]
+                if "invalid" in pid:
+                    items.append({"index" : {"_id" : pid, "status" : 400, "error" : {"type" : "mapper_parsing_exception"}}})
+                else:
+                    items.append({"index" : {"_id" : pid, "status" : 201}})
+            return 200, {"errors" : True, "items" : items}
+        return 200, {"acknowledged" : True}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx", tx)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx_async", AsyncESClientBase(tx))
+    def iter_file_texts_from_s3(s3_tuple_list, keep_pages, deadline=None):
+        for s3_tuple in s3_tuple_list:
+            yield s3_tuple, ValueError("corrupt pdf") if "corrupt" in s3_tuple[1] else "text"
+    monkeypatch.setattr(lambda_es_indexing, "iter_file_texts_from_s3", iter_file_texts_from_s3)
+    lambda_es_indexing.etag_cache.clear()
+
+    def message(message_id, key):
+        return {"messageId" : message_id, "eventSource" : "aws:sqs", "body" : json.dumps({"Records" : [
+            {"s3" : {"bucket" : {"name" : "bucket"}, "object" : {"key" : key, "size" : 10, "eTag" : "abc"}}}
+        ]})}
+    event = {"Records" : [message("1", "good.txt"), message("2", "corrupt.pdf"), message("3", "invalid.txt"), {"messageId" : "4", "body" : json.dumps({"Event" : "s3:TestEvent"})}]}
+
+    response = lambda_es_indexing.lambda_handler(event, {})
+    assert {"batchItemFailures" : [{"itemIdentifier" : "2"}, {"itemIdentifier" : "3"}]} == response
+
+    # the objects that failed are retried, the indexed one is known to be unchanged
+    assert ("textfilesearch", "bucket-good.txt") in lambda_es_indexing.etag_cache
+    assert 1 == len(lambda_es_indexing.etag_cache)
+
+    report = lambda_es_indexing.handle_s3_trigger({"Records" : [json.loads(message("2", "corrupt.pdf")["body"])["Records"][0]]})
+    assert [{"bucket" : "bucket", "key" : "corrupt.pdf", "error" : "ValueError('corrupt pdf')"}] == report["failures"]
+
+def test_removed_objects_are_deleted_in_sequencer_order(monkeypatch, es_stub):
+    from eventparser import S3Record
+
+    def responder(method, path, headers, body):
+        lines = body.decode("UTF-8").splitlines()
+        return 200, {"items" : [{"delete" : {"_id" : json.loads(line)["delete"]["_id"], "status" : 404 if "missing" in line else 200}} for line in lines]}
+    es_stub.responder = responder
+    monkeypatch.setattr(lambda_es_indexing, "es_tx", TextfileDocument(host=es_stub.host, port=es_stub.port))
+    dispatched = []
+    def dispatch(s3_tuple_list, deadline=None):
+        dispatched.extend(s3_tuple_list)
+        return lambda_es_indexing.BulkSummary(), {}
+    monkeypatch.setattr(lambda_es_indexing, "dispatch", dispatch)
+    lambda_es_indexing.etag_cache.set(("textfilesearch", "bucket-a.txt"), ("abc", 10))
+
+    s3_records = [
+        S3Record("m1", "ObjectRemoved:Delete", "bucket", "a.txt", 0, None, "0A"),
+        S3Record("m2", "ObjectCreated:Put", "bucket", "a.txt", 10, "abc", "09"),
+        S3Record("m3", "ObjectRemoved:Delete", "bucket", "b.txt", 0, None, "01"),
+        S3Record("m4", "ObjectCreated:Put", "bucket", "b.txt", 10, "def", "0100"),
+        S3Record("m5", "ObjectRemoved:Delete", "bucket", "missing.txt", 0, None, "01")
+    ]
+    summary, failures = lambda_es_indexing.dispatch_records(s3_records)
+
+    assert {} == failures
+    assert [("bucket", "b.txt", 10, "def")] == dispatched
+    assert 1 == len(es_stub.requests)
+    assert ["bucket-a.txt", "bucket-missing.txt"] == [json.loads(line)["delete"]["_id"] for line in es_stub.requests[0][3].decode("UTF-8").splitlines()]
+    # a re-upload of the same content is indexed again
+    assert ("textfilesearch", "bucket-a.txt") not in lambda_es_indexing.etag_cache
+
+def test_passage_deletes_of_removed_objects_fail_on_their_own(monkeypatch, es_stub):
+    from esclient import TextfilePassageDocument
+
+    passage_status = [404]
+    def responder(method, path, headers, body):
+        if "/_delete_by_query" in path:
+            return passage_status[0], {"error" : {"type" : "index_not_found_exception"}} if passage_status[0] == 404 else {"error" : {"type" : "search_phase_execution_exception"}}
+        return 200, {"items" : [{"delete" : {"_id" : json.loads(line)["delete"]["_id"], "status" : 200}} for line in body.decode("UTF-8").splitlines()]}
+    es_stub.responder = responder
+    monkeypatch.setattr(lambda_es_indexing, "TEXTFILE_PASSAGE_MODE", True)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx", TextfileDocument(host=es_stub.host, port=es_stub.port))
+    monkeypatch.setattr(lambda_es_indexing, "es_psg", TextfilePassageDocument(host=es_stub.host, port=es_stub.port))
+
+    # a passage index that was never created has no passage to delete
+    failures = {}
+    lambda_es_indexing.delete_objects([("bucket", "a.txt", 0, None)], failures)
+    assert {} == failures
+
+    passage_status[0] = 500
+    lambda_es_indexing.delete_objects([("bucket", "a.txt", 0, None)], failures)
+    assert [("bucket", "a.txt")] == list(failures)
+    assert failures[("bucket", "a.txt")].startswith("unable to delete the passages")
+
+def test_objects_left_at_the_deadline_are_reported(monkeypatch, es_stub):
+    import io
+    import functools
+    import fileprocess
+    from concurrency import Deadline
+    from esclient_async import AsyncESClientBase
+
+    # extracting a file takes 0.3s on a fake clock, the invocation times out 0.6s after it started
+    now = [0.0]
+
+    class FakeS3:
+        def get_object(self, Bucket, Key):
+            return {"Body" : io.BytesIO(b"text")}
+
+    def get_file_texts_from_binary_data_list(extension_list, binary_data_list, return_exceptions, keep_pages):
+        now[0] += 0.3 * len(binary_data_list)
+        return ["text"] * len(binary_data_list)
+
+    def responder(method, path, headers, body):
+        if path.endswith("/_mget"):
+            return 200, {"docs" : []}
+        if path == "/_bulk":
+            return 200, {"errors" : False, "items" : [{"index" : {"_id" : json.loads(line)["index"]["_id"], "status" : 201}} for line in body.decode("UTF-8").splitlines()[::2]]}
+        return 200, {"acknowledged" : True}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx", tx)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx_async", AsyncESClientBase(tx))
+    monkeypatch.setattr(lambda_es_indexing, "LAMBDA_DEADLINE_MARGIN_MS", 400)
+    monkeypatch.setattr(lambda_es_indexing, "Deadline", functools.partial(Deadline, clock=lambda: now[0]))
+    monkeypatch.setattr(fileprocess, "s3", FakeS3())
+    monkeypatch.setattr(fileprocess, "PDF_PARALLEL_WORKERS", 1)
+    monkeypatch.setattr(fileprocess, "get_file_texts_from_binary_data_list", get_file_texts_from_binary_data_list)
+    lambda_es_indexing.etag_cache.clear()
+
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 600
+
+    def message(message_id, key):
+        return {"messageId" : message_id, "eventSource" : "aws:sqs", "body" : json.dumps({"Records" : [
+            {"s3" : {"bucket" : {"name" : "bucket"}, "object" : {"key" : key, "size" : 10, "eTag" : "abc"}}}
+        ]})}
+    event = {"Records" : [message(str(i), f"{i}.txt") for i in range(10)]}
+
+    response = lambda_es_indexing.lambda_handler(event, Context())
+
+    # the margin is reached once the first file was extracted, the others are left to be retried without being extracted
+    assert 0.3 == now[0]
+    assert [{"itemIdentifier" : str(i)} for i in range(1, 10)] == response["batchItemFailures"]
+    assert [["bucket-0.txt"]] == [[json.loads(line)["index"]["_id"] for line in request[3].decode("UTF-8").splitlines()[::2]] for request in es_stub.requests if request[1] == "/_bulk"]
+    assert ("textfilesearch", "bucket-1.txt") not in lambda_es_indexing.etag_cache
+
+def test_dispatch_runs_text_and_image_branches_concurrently(monkeypatch):
+    import threading
+
+    # each branch waits for the other, which only returns if both run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    def branch(name):
+        def dispatch_branch(s3_tuple_list, failures, deadline=None):
+            barrier.wait()
+            failures[("bucket", name)] = "failed"
+            summary = lambda_es_indexing.BulkSummary()
+            summary.success = len(s3_tuple_list)
+            return summary
+        return dispatch_branch
+    monkeypatch.setattr(lambda_es_indexing, "dispatch_textfiles", branch("text"))
+    monkeypatch.setattr(lambda_es_indexing, "dispatch_imagefiles", branch("image"))
+
+    summary, failures = lambda_es_indexing.dispatch([("bucket", "a.txt", 10, "abc"), ("bucket", "b.png", 10, "def"), ("bucket", "c.txt", 10, "ghi")])
+    assert 3 == summary.success
+    assert {("bucket", "text") : "failed", ("bucket", "image") : "failed"} == failures
+
+def test_passage_mode_writes_the_parent_after_its_passages(monkeypatch, es_stub):
+    from esclient import TextfilePassageDocument
+    from esclient_async import AsyncESClientBase
+
+    def responder(method, path, headers, body):
+        if path == "/_bulk":
+            items = []
+            for line in body.decode("UTF-8").splitlines()[::2]:
+                pid = json.loads(line)["index"]["_id"]
+                if pid == "bucket-bad.txt#1":
+                    items.append({"index" : {"_id" : pid, "status" : 400, "error" : {"type" : "mapper_parsing_exception"}}})
+                else:
+                    items.append({"index" : {"_id" : pid, "status" : 201}})
+            return 200, {"errors" : True, "items" : items}
+        return 200, {"acknowledged" : True}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    monkeypatch.setattr(lambda_es_indexing, "TEXTFILE_PASSAGE_MODE", True)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx", tx)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx_async", AsyncESClientBase(tx))
+    monkeypatch.setattr(lambda_es_indexing, "es_psg", TextfilePassageDocument(host=es_stub.host, port=es_stub.port))
+    monkeypatch.setattr(lambda_es_indexing.es_psg, "ensure_index", lambda: False)
+    lambda_es_indexing.etag_cache.clear()
+
+    s3_tuple_list = [("bucket", "good.txt", 10, "abc"), ("bucket", "bad.txt", 10, "def"), ("bucket", "new.txt", 10, "ghi")]
+    extracted = iter([(s3_tuple, ["a" * 1500], {}) for s3_tuple in s3_tuple_list])
+    failures = {}
+    lambda_es_indexing.put_textfiles(s3_tuple_list, extracted=extracted, failures=failures, new_pids={"bucket-new.txt"})
+
+    bulks = [[json.loads(line)["index"]["_id"] for line in request[3].decode("UTF-8").splitlines()[::2]] for request in es_stub.requests if request[1] == "/_bulk"]
+    deletes = [json.loads(request[3])["query"]["terms"]["parent_id"] for request in es_stub.requests if "/_delete_by_query" in request[1]]
+    assert [["bucket-good.txt#0", "bucket-good.txt#1", "bucket-bad.txt#0", "bucket-bad.txt#1", "bucket-new.txt#0", "bucket-new.txt#1"], ["bucket-good.txt", "bucket-new.txt"]] == bulks
+    # one delete for the whole batch, a file without a document has no passage to delete
+    assert [["bucket-good.txt", "bucket-bad.txt"]] == deletes
+    assert ["bad.txt"] == [key for bucket, key in failures]
+    assert ("textfilesearch", "bucket-bad.txt") not in lambda_es_indexing.etag_cache
+
+def test_a_failed_download_fails_only_its_message(monkeypatch, es_stub):
+    import io
+    import fileprocess
+    from esclient_async import AsyncESClientBase
+
+    class NoSuchKey(Exception):
+        pass
+
+    class FakeS3:
+        def get_object(self, Bucket, Key):
+            if Key == "gone.txt":
+                raise NoSuchKey("The specified key does not exist.")
+            return {"Body" : io.BytesIO(b"still here")}
+
+    def responder(method, path, headers, body):
+        if path.endswith("/_mget"):
+            return 200, {"docs" : []}
+        if path == "/_bulk":
+            return 200, {"errors" : False, "items" : [{"index" : {"_id" : json.loads(line)["index"]["_id"], "status" : 201}} for line in body.decode("UTF-8").splitlines()[::2]]}
+        return 200, {"acknowledged" : True}
+    es_stub.responder = responder
+
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx", tx)
+    monkeypatch.setattr(lambda_es_indexing, "es_tx_async", AsyncESClientBase(tx))
+    monkeypatch.setattr(fileprocess, "s3", FakeS3())
+    lambda_es_indexing.etag_cache.clear()
+
+    def message(message_id, key):
+        return {"messageId" : message_id, "eventSource" : "aws:sqs", "body" : json.dumps({"Records" : [
+            {"s3" : {"bucket" : {"name" : "b"}, "object" : {"key" : key, "size" : 10, "eTag" : "abc"}}}
+        ]})}
+    response = lambda_es_indexing.lambda_handler({"Records" : [message("m1", "ok.txt"), message("m2", "gone.txt")]}, {})
+
+    assert {"batchItemFailures" : [{"itemIdentifier" : "m2"}]} == response
+    assert [["b-ok.txt"]] == [[json.loads(line)["index"]["_id"] for line in request[3].decode("UTF-8").splitlines()[::2]] for request in es_stub.requests if request[1] == "/_bulk"]
+
+def test_a_pdf_too_large_to_download_is_skipped(monkeypatch):
+    put = []
+    monkeypatch.setattr(lambda_es_indexing, "S3_MAX_OBJECT_BYTES", 100)
+    monkeypatch.setattr(lambda_es_indexing, "TEXTRACT_SNS_TOPIC_ARN", "")
+    monkeypatch.setattr(lambda_es_indexing.es_tx, "ensure_index", lambda: None)
+    monkeypatch.setattr(lambda_es_indexing, "filter_changed_s3_tuples", lambda es_client, s3_tuple_list, new_pids=None: s3_tuple_list)
+    monkeypatch.setattr(lambda_es_indexing, "put_textfiles", lambda s3_tuple_list, failures=None, deadline=None, new_pids=None: put.append(s3_tuple_list))
+
+    failures = {}
+    lambda_es_indexing.dispatch_textfiles([("b", "large.pdf", 101, "e"), ("b", "large.txt", 101, "e"), ("b", "small.pdf", 100, "e")], failures)
+
+    # a cut off txt is still readable, a cut off pdf is not and retrying it would not help
+    assert [[("b", "large.txt", 101, "e"), ("b", "small.pdf", 100, "e")]] == put
+    assert {} == failures
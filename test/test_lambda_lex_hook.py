@@ -0,0 +1,18 @@
+import lambda_lex_hook
+from esclient import TextfileDocument
+
+def test_cached_search_does_not_cache_errors(es_stub):
+    responses = [(503, {"error" : "unavailable"}), (200, {"hits" : {"hits" : []}})]
+    def responder(method, path, headers, body):
+        if path.endswith("/_search"):
+            return responses.pop(0)
+        return 200, {"_all" : {"primaries" : {"indexing" : {"index_total" : 0, "delete_total" : 0}}}}
+    es_stub.responder = responder
+    tx = TextfileDocument(host=es_stub.host, port=es_stub.port)
+    search = lambda: tx.search_document(body={"query" : {"match_all" : {}}})
+    lambda_lex_hook.search_cache.clear()
+
+    assert "hits" not in lambda_lex_hook.cached_search(("test",), tx, search)
+    assert {"hits" : {"hits" : []}} == lambda_lex_hook.cached_search(("test",), tx, search)
+    assert {"hits" : {"hits" : []}} == lambda_lex_hook.cached_search(("test",), tx, search)
+    assert 2 == sum(request[1].endswith("/_search") for request in es_stub.requests)